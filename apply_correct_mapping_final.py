@@ -3,89 +3,83 @@
 Apply the correct OPS to XML mapping based on manual verification
 """
 
+import argparse
 import re
 from pathlib import Path
 
-def get_correct_mapping():
+import metrics
+from book_index import load_book_index
+from books import DEFAULT_ISBN, book_isbn, existing_part_files, find_book, find_ops_location
+from mapping_store import manual_mappings, open_mapping_store
+from ops_source import DEFAULT_OPS_LOCATION, open_ops_source
+from rewrite import splice
+
+def get_correct_mapping(isbn=DEFAULT_ISBN):
     """
     Return the correct OPS ID to XML ID mapping
-    Based on direct comparison of OPS XHTML content and XML chapter structure
+    Based on direct comparison of OPS XHTML content and XML chapter structure (kept in mappings/<isbn>.jsonl)
     """
-    return {
-        # Part 3 - Aerobic Bacteriology
-        "9781683674832_v1_c15": "ch0021",  # 3.4. Body Fluid Cultures
-        "9781683674832_v1_c16": "ch0022",  # 3.5. Cerebrospinal Fluid Cultures
-        "9781683674832_v1_c17": "ch0023",  # 3.6. Medical Devices
-        "9781683674832_v1_c18": "ch0024",  # 3.7. Fecal and Other Gastrointestinal Cultures
-        "9781683674832_v1_c19": "ch0024",  # 3.7.2. Campylobacter (subsection of ch0024)
-        "9781683674832_v1_c20": "ch0024",  # 3.7.3. Helicobacter (subsection of ch0024)
-        "9781683674832_v1_c21": "ch0025",  # 3.7.2. Quantitative Culture of Small-Bowel
-        "9781683674832_v1_c22": "ch0028",  # 3.8. Genital Cultures
-        
-        # Part 15 - Environmental/Sterility
-        "9781683674832_v4_c80": "ch0389",  # 15.3.4 Media Fill Test Procedure
-    }
+    return manual_mappings(isbn, 'chapter')
 
-def fix_part_sect1_files(xml_dir, mapping):
-    """Fix all part-level sect1 files with correct mapping"""
+def fix_part_sect1_files(xml_dir, mapping, isbn=DEFAULT_ISBN, part_ids=None):
+    """Fix all part-level sect1 files with correct mapping (part_ids default to the book's parts)"""
+    if part_ids is None:
+        part_ids = load_book_index(Path(xml_dir) / f'book.{isbn}.xml').parts
     
     total_fixes = 0
     
-    for i in range(1, 19):
-        part_id = f"pt{i:04d}"
-        file_path = Path(xml_dir) / f"sect1.9781683674832.{part_id}s0001.xml"
-        
-        if not file_path.exists():
-            continue
-        
+    for _part_id, file_path in existing_part_files(xml_dir, isbn, part_ids):
         with open(file_path, 'r', encoding='utf-8') as f:
             content = f.read()
+        metrics.record_read(content)
         
-        original_content = content
-        file_fixes = 0
-        
-        # Find and replace broken links
-        for ops_id, xml_id in mapping.items():
-            if ops_id in content:
-                # Replace all occurrences
-                old_pattern = f'linkend="{ops_id}"'
-                new_pattern = f'linkend="{xml_id}"'
-                
-                count = content.count(old_pattern)
-                if count > 0:
-                    content = content.replace(old_pattern, new_pattern)
-                    file_fixes += count
-                    print(f"  {ops_id} → {xml_id} ({count} occurrences)")
+        new_content, file_fixes = fix_content_with_mapping(content, mapping)
         
-        if content != original_content:
+        if file_fixes:
             with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(content)
+                f.write(new_content)
+            metrics.record_write(new_content)
             print(f"\n✓ {file_path.name}: Fixed {file_fixes} links")
             total_fixes += file_fixes
     
     return total_fixes
 
-def verify_mapping(xml_dir, mapping):
+def fix_content_with_mapping(content, mapping):
+    """Replace mapped linkends in content; return (new content, number of fixes)"""
+    # Collect every mapped linkend in one scan
+    edits = []
+    counts = {}
+    for match in re.finditer(r'linkend="([^"]+)"', content):
+        ops_id = match.group(1)
+        if ops_id in mapping:
+            edits.append((match.span(1), mapping[ops_id]))
+            counts[ops_id] = counts.get(ops_id, 0) + 1
+    
+    for ops_id, xml_id in mapping.items():
+        if ops_id in counts:
+            print(f"  {ops_id} → {xml_id} ({counts[ops_id]} occurrences)")
+    
+    return splice(content, edits), len(edits)
+
+def verify_mapping(xml_dir, mapping, ops_location=DEFAULT_OPS_LOCATION, isbn=DEFAULT_ISBN):
     """Verify the mapping by showing what OPS chapters map to what XML chapters"""
     print("=" * 80)
     print("VERIFICATION: OPS to XML Chapter Mapping")
     print("=" * 80)
     
-    # Read book.xml to get chapter titles
-    with open(Path(xml_dir) / 'book.9781683674832.xml', 'r', encoding='utf-8') as f:
-        book_content = f.read()
+    # Index book.xml once to get chapter titles
+    book_index = load_book_index(Path(xml_dir) / f'book.{isbn}.xml')
     
     # Read OPS files to get their titles
-    ops_dir = '/workspace/OPS_extracted/OPS'
+    ops = open_ops_source(ops_location)
     
     for ops_id in sorted(mapping.keys()):
         xml_id = mapping[ops_id]
         
         # Get OPS title
-        ops_file = Path(ops_dir) / f"{ops_id}.xhtml"
-        if ops_file.exists():
-            with open(ops_file, 'r', encoding='utf-8') as f:
-                ops_content = f.read(2000)
+        ops_file = f"{ops_id}.xhtml"
+        if ops.exists(ops_file):
+            ops_content = ops.read_text(ops_file, 2000)
             
             title_match = re.search(r'<title>([^<]+)</title>', ops_content)
             ops_title = title_match.group(1) if title_match else "Unknown"
@@ -93,13 +87,10 @@ def verify_mapping(xml_dir, mapping):
             ops_title = "File not found"
         
         # Get XML title
-        xml_pattern = rf'<chapter id="{xml_id}"[^>]*>.*?<emphasis role="chapterNumber">([^<]+)</emphasis>.*?<emphasis role="chapterTitle">([^<]+)</emphasis>'
-        xml_match = re.search(xml_pattern, book_content, re.DOTALL)
+        chapter = book_index.chapter(xml_id)
         
-        if xml_match:
-            xml_num = xml_match.group(1).strip()
-            xml_title = xml_match.group(2).strip()
-            xml_full = f"{xml_num} {xml_title}"
+        if chapter:
+            xml_full = f"{chapter['number']} {chapter['title']}"
         else:
             xml_full = "Not found in book.xml"
         
@@ -107,29 +98,42 @@ def verify_mapping(xml_dir, mapping):
         print(f"  OPS: {ops_title}")
         print(f"  XML: {xml_full}")
 
-def main():
-    xml_dir = '/workspace/extracted_final'
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply the OPS -> XML chapter mapping to the part-level files")
+    parser.add_argument('--xml-dir', default='/workspace/extracted_final')
+    parser.add_argument('--ops', help="OPS.zip, OPS directory or .epub (default: found next to the XML)")
+    metrics.add_argument(parser)
+    args = parser.parse_args(argv)
+    metrics.start(args.metrics)
+    
+    xml_dir = args.xml_dir
+    book_path = find_book(xml_dir)
+    isbn = book_isbn(book_path)
+    ops_location = args.ops or find_ops_location(xml_dir, isbn) or DEFAULT_OPS_LOCATION
     
     print("=" * 80)
     print("APPLYING CORRECT OPS TO XML MAPPING")
     print("=" * 80)
     
-    mapping = get_correct_mapping()
+    # Only the hand-verified entries; the automatic and content-signature ones are applied by the pipeline
+    with open_mapping_store(xml_dir, isbn) as store:
+        mapping = store.mapping(isbn, 'chapter', ('manual',))
     
     print(f"\nTotal mappings to apply: {len(mapping)}\n")
     
     # Verify mapping first
-    verify_mapping(xml_dir, mapping)
+    verify_mapping(xml_dir, mapping, ops_location, isbn)
     
     print("\n" + "=" * 80)
     print("FIXING PART-LEVEL SECT1 FILES")
     print("=" * 80 + "\n")
     
-    total_fixes = fix_part_sect1_files(xml_dir, mapping)
+    total_fixes = fix_part_sect1_files(xml_dir, mapping, isbn, load_book_index(book_path).parts)
     
     print("\n" + "=" * 80)
     print(f"TOTAL FIXES APPLIED: {total_fixes}")
     print("=" * 80)
+    metrics.finish(args.metrics)
 
 if __name__ == '__main__':
     main()
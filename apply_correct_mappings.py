@@ -3,67 +3,62 @@
 Apply correct table/appendix ID mappings to part-level sect1 files
 """
 
+import argparse
 import re
-from pathlib import Path
 
-def get_specific_mappings():
-    """Define specific known mappings that were found"""
-    return {
-        # Part 2 - Chapter 12 tables
-        "Table 2.1–1": "ch0012s0004ta01",
-        "Table 2.1–2": "ch0012s0004ta12",
-        "Table 2.1–3": "ch0012s0004ta13",
-        "Table 2.1–4": "ch0012s0004ta14",
-        "Table 2.1–5": "ch0012s0004ta21",
-        "Table 2.1–6": "ch0012s0004ta24",
-        "Table 2.1–7": "ch0012s0004ta26",
-        "Table 2.1–8": "ch0012s0004ta29",
-        "Table 2.1–9": "ch0012s0004ta30",
-        "Table 2.1–10": "ch0012s0004ta32",
-        "Table 2.1–11": "ch0012s0004ta33",
-        "Table 2.1–12": "ch0012s0004ta35",
-        "Table 2.1–13": "ch0012s0004ta36",
-    }
+import metrics
+from book_index import load_book_index
+from books import DEFAULT_ISBN, book_isbn, existing_part_files, find_book
+from label_matcher import as_label_matcher
+from mapping_store import manual_mappings
+from rewrite import splice
+from scanner import scan_directory
 
-def extract_comprehensive_mappings(extracted_dir):
+def get_specific_mappings(isbn=DEFAULT_ISBN):
+    """Known table label mappings that were found by hand (kept in mappings/<isbn>.jsonl)"""
+    return manual_mappings(isbn, 'table')
+
+def extract_comprehensive_mappings(extracted_dir, workers=None, isbn=DEFAULT_ISBN):
     """Extract all table and appendix mappings from XML files"""
-    mappings = get_specific_mappings()
+    mappings = get_specific_mappings(isbn)
     
-    # Scan all sect1 files for tables and appendices
-    for xml_file in Path(extracted_dir).glob('sect1.*.xml'):
-        with open(xml_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Find tables with their labels
-        # Look for <table id="..."> followed by text containing "Table X.Y-Z"
-        table_blocks = re.findall(
-            r'<table id="([^"]+)">\s*<title>.*?</title>',
-            content,
-            re.DOTALL
-        )
-        
-        for match in re.finditer(r'<table id="([^"]+)">\s*<title>(.*?)</title>', content, re.DOTALL):
-            table_id = match.group(1)
-            title_content = match.group(2)
-            
-            # Extract table label from title
-            label_match = re.search(r'Table\s+(\d+\.\d+)[–-](\d+)', title_content)
-            if label_match:
-                table_label = f"Table {label_match.group(1)}–{label_match.group(2)}"
-                mappings[table_label] = table_id
-                # Also add dash variant
-                table_label_dash = f"Table {label_match.group(1)}-{label_match.group(2)}"
-                mappings[table_label_dash] = table_id
+    # Scan all sect1 files for tables in a process pool
+    scan = scan_directory(extracted_dir, 'sect1.*.xml', workers, fields=('tables',))
+    
+    for table_label, table_id in scan['tables'].items():
+        mappings[table_label] = table_id
+        # Also add dash variant
+        mappings[table_label.replace('–', '-')] = table_id
     
     return mappings
 
-def fix_file_with_mappings(file_path, mappings):
+@metrics.timed('fix_file_with_mappings')
+def fix_file_with_mappings(file_path, mappings, isbn=DEFAULT_ISBN):
     """Fix a single file using the mappings"""
     with open(file_path, 'r', encoding='utf-8') as f:
         content = f.read()
+    metrics.record_read(content)
+    
+    new_content, fixes_count = fix_content_with_mappings(content, mappings, isbn)
+    
+    if fixes_count:
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(new_content)
+        metrics.record_write(new_content)
     
-    original_content = content
-    fixes_count = 0
+    return fixes_count
+
+def fix_content_with_mappings(content, mappings, isbn=DEFAULT_ISBN, recheck=None):
+    """
+    Fix links in content using the mappings; return (new content, number of fixes).
+    Besides the OPS links, links to the ids in recheck are resolved again from their label;
+    by default these are the targets of the book's manual table mappings, which earlier
+    fixes pointed labels of the same chapter at by mistake.
+    """
+    edits = []
+    matcher = as_label_matcher(mappings)
+    if recheck is None:
+        recheck = set(get_specific_mappings(isbn).values())
     
     # Fix each link
     for match in re.finditer(r'<link linkend="([^"]+)">([^<]+)</link>', content):
@@ -71,56 +66,50 @@ def fix_file_with_mappings(file_path, mappings):
         link_text = match.group(2).strip()
         
         # Skip if already fixed (not a broken link)
-        if not old_linkend.startswith('9781683674832_v') and not old_linkend.startswith('ch0012s0004ta01'):
+        if not old_linkend.startswith(f'{isbn}_v') and old_linkend not in recheck:
             continue
         
-        # Try to find mapping by matching link text
-        found_mapping = None
-        for key, value in mappings.items():
-            if key in link_text:
-                found_mapping = value
-                break
+        # Try to find mapping by the longest exact label in the link text
+        found_mapping = matcher.get(link_text)
         
-        if found_mapping:
-            old_link = f'linkend="{old_linkend}"'
-            new_link = f'linkend="{found_mapping}"'
-            content = content.replace(old_link, new_link, 1)
-            fixes_count += 1
-    
-    if content != original_content:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-        return fixes_count
+        if found_mapping and found_mapping != old_linkend:
+            edits.append((match.span(1), found_mapping))
     
-    return 0
+    return splice(content, edits), len(edits)
 
-def main():
-    extracted_dir = '/workspace/extracted_final'
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Apply the table/appendix label mappings to the part-level files")
+    parser.add_argument('--xml-dir', default='/workspace/extracted_final')
+    metrics.add_argument(parser)
+    args = parser.parse_args(argv)
+    metrics.start(args.metrics)
+    
+    extracted_dir = args.xml_dir
+    book_path = find_book(extracted_dir)
+    isbn = book_isbn(book_path)
     
     print("=" * 70)
     print("APPLYING CORRECT TABLE/APPENDIX MAPPINGS")
     print("=" * 70)
     
     print("\nExtracting comprehensive mappings...")
-    mappings = extract_comprehensive_mappings(extracted_dir)
+    mappings = extract_comprehensive_mappings(extracted_dir, isbn=isbn)
     print(f"  Total mappings: {len(mappings)}")
+    matcher = as_label_matcher(mappings)
     
     print("\nFixing part-level sect1 files...")
     total_fixes = 0
     
-    for i in range(1, 19):
-        part_id = f"pt{i:04d}"
-        sect1_file = Path(extracted_dir) / f"sect1.9781683674832.{part_id}s0001.xml"
-        
-        if sect1_file.exists():
-            fixes = fix_file_with_mappings(sect1_file, mappings)
-            if fixes > 0:
-                print(f"  Fixed {fixes} links in {sect1_file.name}")
-                total_fixes += fixes
+    for _part_id, sect1_file in existing_part_files(extracted_dir, isbn, load_book_index(book_path).parts):
+        fixes = fix_file_with_mappings(sect1_file, matcher, isbn)
+        if fixes > 0:
+            print(f"  Fixed {fixes} links in {sect1_file.name}")
+            total_fixes += fixes
     
     print("\n" + "=" * 70)
     print(f"TOTAL: Fixed {total_fixes} links")
     print("=" * 70)
+    metrics.finish(args.metrics)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Batch mode: run the link-fixing pipeline for every book under a directory tree.
+Books are discovered from their book.<isbn>.xml files and processed concurrently in a
+process pool. Each book runs in isolation (own worker, own log file, errors caught),
+and the per-book results are aggregated into one summary. A dry run writes nothing into
+the book directories: each book's log goes to a temporary file instead.
+
+Usage:
+    python batch.py ROOT [--workers N] [--stages entities,broken,...] [--dry-run] [--full]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from books import book_isbn, discover_books, find_book
+from pipeline import STAGES, parse_stages, run_pipeline
+
+LOG_FILENAME = 'pipeline.log'
+
+def run_book(xml_dir, stages=STAGES, dry_run=False, incremental=True):
+    """Run the pipeline for one book directory; never raises, returns a summary dict"""
+    summary = {
+        'xml_dir': str(xml_dir),
+        'isbn': None,
+        'status': 'ok',
+        'results': {},
+        'written': [],
+        'seconds': 0.0,
+        'error': None,
+        'log': None if dry_run else str(Path(xml_dir) / LOG_FILENAME),
+    }
+    log = io.StringIO()
+    start = time.perf_counter()
+
+    try:
+        with contextlib.redirect_stdout(log):
+            book_path = find_book(xml_dir)
+            summary['isbn'] = book_isbn(book_path)
+            # One process per book; the book's own directory scans stay in-process
+            results, written = run_pipeline(
+                xml_dir, None, stages, f"{book_path}.new", dry_run, workers=1, incremental=incremental
+            )
+        summary['results'] = results
+        summary['written'] = written
+        if stages and not results:
+            summary['status'] = 'unchanged'
+    except Exception as e:
+        summary['status'] = 'error'
+        summary['error'] = f"{type(e).__name__}: {e}"
+        log.write(traceback.format_exc())
+
+    summary['seconds'] = round(time.perf_counter() - start, 3)
+    try:
+        if dry_run:
+            with tempfile.NamedTemporaryFile(
+                'w', encoding='utf-8', prefix=f"pipeline.{summary['isbn'] or 'book'}.", suffix='.log', delete=False
+            ) as f:
+                f.write(log.getvalue())
+            summary['log'] = f.name
+        else:
+            with open(summary['log'], 'w', encoding='utf-8') as f:
+                f.write(log.getvalue())
+    except OSError as e:
+        summary['log'] = None
+        print(f"Could not write log for {xml_dir}: {e}")
+    return summary
+
+def run_batch(root, stages=STAGES, workers=None, dry_run=False, incremental=True):
+    """Run every book under root in a process pool; return the per-book summaries in directory order"""
+    book_dirs = discover_books(root)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, max(1, len(book_dirs)))
+
+    print(f"Found {len(book_dirs)} books under {root}; running with {workers} workers")
+    summaries = []
+    if workers <= 1:
+        for xml_dir in book_dirs:
+            summaries.append(run_book(xml_dir, stages, dry_run, incremental))
+            print_book_line(summaries[-1])
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(run_book, xml_dir, stages, dry_run, incremental) for xml_dir in book_dirs
+            ]
+            for future in as_completed(futures):
+                summaries.append(future.result())
+                print_book_line(summaries[-1])
+
+    return sorted(summaries, key=lambda summary: summary['xml_dir'])
+
+def print_book_line(summary):
+    fixes = sum(summary['results'].get(stage, 0) for stage in ('broken', 'comprehensive', 'tables', 'mapping'))
+    detail = summary['error'] if summary['error'] else f"{fixes} links fixed, {len(summary['written'])} files written"
+    print(f"  [{summary['status']:>9}] {summary['isbn'] or '?'} ({summary['seconds']:.2f}s) {detail}")
+
+def aggregate(summaries, elapsed):
+    """Totals across books: status counts, per-stage fixes, files written and timings"""
+    totals = {
+        'books': len(summaries),
+        'status': {},
+        'results': {},
+        'files_written': 0,
+        'elapsed_seconds': round(elapsed, 3),
+        'book_seconds': round(sum(summary['seconds'] for summary in summaries), 3),
+    }
+    for summary in summaries:
+        totals['status'][summary['status']] = totals['status'].get(summary['status'], 0) + 1
+        for stage, count in summary['results'].items():
+            totals['results'][stage] = totals['results'].get(stage, 0) + count
+        totals['files_written'] += len(summary['written'])
+    return totals
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fix entity references and broken links for many books")
+    parser.add_argument('root', help="directory searched recursively for book.<isbn>.xml files")
+    parser.add_argument('--workers', type=int, help="number of books processed concurrently (default: CPU count)")
+    parser.add_argument('--stages', type=parse_stages, default=STAGES,
+                        help=f"comma-separated stages to run (default: {','.join(STAGES)})")
+    parser.add_argument('--dry-run', action='store_true', help="run all stages but write nothing")
+    parser.add_argument('--full', action='store_true', help="ignore the manifests and process every file")
+    parser.add_argument('--summary-json', help="also write the per-book summaries and totals to this file")
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    summaries = run_batch(args.root, args.stages, args.workers, args.dry_run, not args.full)
+    totals = aggregate(summaries, time.perf_counter() - start)
+
+    print("\n" + "=" * 80)
+    print("BATCH SUMMARY")
+    print("=" * 80)
+    print(f"  Books: {totals['books']} ({', '.join(f'{k}: {v}' for k, v in sorted(totals['status'].items()))})")
+    for stage, count in totals['results'].items():
+        print(f"  {stage}: {count}")
+    print(f"  Files written: {totals['files_written']}")
+    print(f"  Wall time: {totals['elapsed_seconds']:.2f}s (sum of per-book time: {totals['book_seconds']:.2f}s)")
+
+    failed = [summary for summary in summaries if summary['status'] == 'error']
+    if failed:
+        print("\nFailed books:")
+        for summary in failed:
+            print(f"  {summary['xml_dir']}: {summary['error']} (log: {summary['log']})")
+
+    if args.summary_json:
+        with open(args.summary_json, 'w', encoding='utf-8') as f:
+            json.dump({'books': summaries, 'totals': totals}, f, indent=2)
+
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
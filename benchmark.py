@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the link-fixing stages.
+Generates a synthetic corpus (or uses an existing one) and times each stage in a fresh
+process, reporting wall time, throughput and peak RSS so optimisations can be compared
+before and after. Part-level files are restored between runs, so every run sees the
+same input.
+
+Usage:
+    python benchmark.py [--corpus DIR] [--parts 18] [--chapters 26] [--tables 4]
+                        [--broken-density 0.9] [--stages book_index,table_ids,...]
+                        [--repeat 3] [--json results.json]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from apply_correct_mappings import extract_comprehensive_mappings, fix_file_with_mappings
+from book_index import BookIndex, load_book_index
+from books import book_isbn, existing_part_files, find_book, find_ops_location
+from comprehensive_link_fixer import (
+    build_comprehensive_mapping,
+    extract_xml_table_ids,
+    fix_part_level_sect1_file,
+)
+from correct_mapping import find_xml_chapter_by_content, get_ops_content_signature
+from fix_broken_links import extract_all_ids_from_directory, fix_broken_links_in_file, load_chapter_ordinals
+from id_index import INDEX_FILENAME
+from label_matcher import LabelMatcher
+from manifest import MANIFEST_FILENAME
+from mapping_store import STORE_FILENAME
+from ops_source import open_ops_source
+from pipeline import run_pipeline
+from resolution_cache import CACHE_FILENAME
+from synthetic_corpus import generate_corpus
+
+def part_paths(corpus):
+    book_index = load_book_index(corpus['book_path'])
+    return [path for _part_id, path in existing_part_files(corpus['xml_dir'], corpus['isbn'], book_index.parts)]
+
+# Each setup function prepares its inputs (untimed) and returns the function to time,
+# which returns the number of items it processed
+
+def setup_book_index(corpus):
+    return lambda: len(BookIndex(corpus['book_path']).chapters)
+
+def setup_all_ids_cold(corpus):
+    (Path(corpus['xml_dir']) / INDEX_FILENAME).unlink(missing_ok=True)
+    return lambda: len(extract_all_ids_from_directory(corpus['xml_dir']))
+
+def setup_all_ids_warm(corpus):
+    extract_all_ids_from_directory(corpus['xml_dir'])
+    return lambda: len(extract_all_ids_from_directory(corpus['xml_dir']))
+
+def setup_table_ids(corpus):
+    return lambda: len(extract_xml_table_ids(corpus['xml_dir'], corpus['workers']))
+
+def setup_comprehensive_mapping(corpus):
+    def run():
+        ops = open_ops_source(corpus['ops_location'])
+        return len(build_comprehensive_mapping(ops, corpus['xml_dir'], corpus['isbn'])[2])
+    return run
+
+def setup_content_mapping(corpus):
+    def run():
+        ops = open_ops_source(corpus['ops_location'])
+        matched = 0
+        for name in ops.glob(f"{corpus['isbn']}_v*_c*.xhtml"):
+            signature = get_ops_content_signature(name, ops)
+            if signature and find_xml_chapter_by_content(signature, corpus['xml_dir'], corpus['isbn'])[0]:
+                matched += 1
+        return matched
+    return run
+
+def setup_fix_broken_links(corpus):
+    all_ids = extract_all_ids_from_directory(corpus['xml_dir'])
+    paths = part_paths(corpus)
+    def run():
+        # The ordinal index is built once per run, as the pipeline does
+        ordinals = load_chapter_ordinals(corpus['xml_dir'], corpus['isbn'])
+        return sum(
+            len(fix_broken_links_in_file(
+                path, corpus['book_path'], corpus['xml_dir'], all_ids, ordinals, isbn=corpus['isbn']
+            ) or [])
+            for path in paths
+        )
+    return run
+
+def setup_fix_part_level(corpus):
+    ops = open_ops_source(corpus['ops_location'])
+    chapter_mapping, _table_mappings, xhtml_mapping = build_comprehensive_mapping(
+        ops, corpus['xml_dir'], corpus['isbn']
+    )
+    table_matcher = LabelMatcher(extract_xml_table_ids(corpus['xml_dir'], corpus['workers']))
+    paths = part_paths(corpus)
+    def run():
+        return sum(
+            len(fix_part_level_sect1_file(
+                path, chapter_mapping, table_matcher, xhtml_mapping, corpus['xml_dir'], isbn=corpus['isbn']
+            ))
+            for path in paths
+        )
+    return run
+
+def setup_fix_with_mappings(corpus):
+    matcher = LabelMatcher(extract_comprehensive_mappings(corpus['xml_dir'], corpus['workers'], corpus['isbn']))
+    paths = part_paths(corpus)
+    return lambda: sum(fix_file_with_mappings(path, matcher, corpus['isbn']) for path in paths)
+
+def setup_pipeline(corpus):
+    book_output = f"{corpus['book_path']}.new"
+    def run():
+        results, _written = run_pipeline(
+            corpus['xml_dir'], corpus['ops_location'], book_output=book_output,
+            workers=corpus['workers'], incremental=False
+        )
+        return sum(results.get(stage, 0) for stage in ('broken', 'comprehensive', 'tables', 'mapping'))
+    return run
+
+# name -> (setup, unit of the items it returns)
+BENCHMARKS = {
+    'book_index': (setup_book_index, 'chapters'),
+    'all_ids_cold': (setup_all_ids_cold, 'ids'),
+    'all_ids_warm': (setup_all_ids_warm, 'ids'),
+    'table_ids': (setup_table_ids, 'tables'),
+    'comprehensive_mapping': (setup_comprehensive_mapping, 'chapters'),
+    'content_mapping': (setup_content_mapping, 'chapters'),
+    'fix_broken_links': (setup_fix_broken_links, 'links'),
+    'fix_part_level': (setup_fix_part_level, 'links'),
+    'fix_with_mappings': (setup_fix_with_mappings, 'links'),
+    'pipeline': (setup_pipeline, 'links'),
+}
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its finished children, in MB"""
+    if resource is None:
+        return None
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+def measure(name, corpus):
+    """Set up and time one benchmark; meant to run in a fresh worker process"""
+    setup, unit = BENCHMARKS[name]
+    with contextlib.redirect_stdout(io.StringIO()):
+        run = setup(corpus)
+        start = time.perf_counter()
+        items = run()
+        seconds = time.perf_counter() - start
+    return {'seconds': seconds, 'items': items, 'unit': unit, 'peak_rss_mb': peak_rss_mb()}
+
+def snapshot_part_files(corpus):
+    return {path: path.read_bytes() for path in part_paths(corpus)}
+
+def restore_part_files(corpus, snapshot):
+    """
+    Put the part-level files back to their original content and drop the pipeline's outputs
+    and on-disk caches (manifest, ID index, mapping store, resolution cache), so every run is cold
+    """
+    for path, data in snapshot.items():
+        if path.read_bytes() != data:
+            path.write_bytes(data)
+    for name in (MANIFEST_FILENAME, INDEX_FILENAME, STORE_FILENAME, CACHE_FILENAME):
+        (Path(corpus['xml_dir']) / name).unlink(missing_ok=True)
+    Path(f"{corpus['book_path']}.new").unlink(missing_ok=True)
+
+def run_benchmarks(corpus, names, repeat=1):
+    """Run each benchmark repeat times, each in a fresh process; return {name: stats}"""
+    snapshot = snapshot_part_files(corpus)
+    context = multiprocessing.get_context('spawn')
+    results = {}
+
+    for name in names:
+        runs = []
+        for _ in range(repeat):
+            restore_part_files(corpus, snapshot)
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(executor.submit(measure, name, corpus).result())
+        restore_part_files(corpus, snapshot)
+
+        times = [run['seconds'] for run in runs]
+        best = min(times)
+        peaks = [run['peak_rss_mb'] for run in runs if run['peak_rss_mb'] is not None]
+        results[name] = {
+            'seconds': round(best, 4),
+            'median_seconds': round(statistics.median(times), 4),
+            'items': runs[0]['items'],
+            'unit': runs[0]['unit'],
+            'items_per_second': round(runs[0]['items'] / best, 1) if best > 0 else None,
+            'peak_rss_mb': max(peaks) if peaks else None,
+        }
+        print_result(name, results[name])
+
+    return results
+
+def print_result(name, result):
+    throughput = f"{result['items_per_second']:>12,.0f}" if result['items_per_second'] is not None else f"{'-':>12}"
+    peak = f"{result['peak_rss_mb']:>10.1f}" if result['peak_rss_mb'] is not None else f"{'-':>10}"
+    print(
+        f"  {name:<22} {result['seconds']:>9.3f} {result['median_seconds']:>9.3f} "
+        f"{result['items']:>9} {result['unit']:<8} {throughput} {peak}"
+    )
+
+def parse_names(value):
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown benchmark(s): {', '.join(unknown)}")
+    return names
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time each link-fixing stage on a synthetic or real corpus")
+    parser.add_argument('--corpus', help="existing XML directory to benchmark (default: generate one)")
+    parser.add_argument('--ops', help="OPS location for --corpus (default: found next to the XML)")
+    parser.add_argument('--parts', type=int, default=18)
+    parser.add_argument('--chapters', type=int, default=26, help="chapters per part")
+    parser.add_argument('--tables', type=int, default=4, help="tables per chapter")
+    parser.add_argument('--broken-density', type=float, default=0.9)
+    parser.add_argument('--ops-zip', action='store_true', help="generate OPS.zip instead of an OPS directory")
+    parser.add_argument('--stages', type=parse_names, default=list(BENCHMARKS),
+                        help=f"comma-separated benchmarks (default: {','.join(BENCHMARKS)})")
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=1, help="process pool size for directory scans")
+    parser.add_argument('--json', help="write the results to this file")
+    parser.add_argument('--keep', action='store_true', help="keep the generated corpus")
+    args = parser.parse_args(argv)
+
+    work_dir = None
+    if args.corpus:
+        xml_dir = Path(args.corpus)
+        book_path = find_book(xml_dir)
+        corpus_info = {'xml_dir': str(xml_dir)}
+        ops_location = args.ops or find_ops_location(xml_dir, book_isbn(book_path))
+    else:
+        work_dir = Path(tempfile.mkdtemp(prefix='link-bench-'))
+        print(f"Generating corpus in {work_dir}...")
+        start = time.perf_counter()
+        corpus_info = generate_corpus(
+            work_dir, args.parts, args.chapters, args.tables, args.broken_density, ops_zip=args.ops_zip
+        )
+        print(f"  {corpus_info['chapters']} chapters, {corpus_info['links']} part-level links "
+              f"({time.perf_counter() - start:.1f}s)")
+        book_path = find_book(corpus_info['xml_dir'])
+        ops_location = corpus_info['ops_location']
+
+    corpus = {
+        'xml_dir': corpus_info['xml_dir'],
+        'book_path': str(book_path),
+        'isbn': book_isbn(book_path),
+        'ops_location': ops_location,
+        'workers': args.workers,
+    }
+
+    print("\n" + "=" * 100)
+    print("BENCHMARK RESULTS")
+    print("=" * 100)
+    print(f"  {'Stage':<22} {'Best (s)':>9} {'Median':>9} {'Items':>9} {'Unit':<8} {'Items/s':>12} {'Peak MB':>10}")
+    try:
+        results = run_benchmarks(corpus, args.stages, args.repeat)
+    finally:
+        if work_dir and not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'corpus': corpus_info, 'results': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Single-pass streaming model of a book XML file.
+Built once per book and shared by all scripts: one event-driven expat pass over
+fixed-size chunks collects chapters, parts and element ids, so memory
+stays bounded by the size of the tables rather than the size of the book, and
+lookups are dict lookups instead of a full read + DOTALL regex over book.xml per call.
+"""
+
+import os
+import xml.parsers.expat
+
+import metrics
+
+_INDEX_CACHE = {}
+
+READ_CHUNK_SIZE = 1 << 16
+
+class BookIndex:
+    """Chapter, part and id tables for one book XML file"""
+
+    def __init__(self, book_path, content=None):
+        self.book_path = str(book_path) if book_path else None
+        self.chapters = {}      # chapter id -> {'number', 'title', 'label', 'part'}
+        self.number_to_id = {}  # chapter number -> first chapter id with that number
+        self.part_number_to_id = {}  # (part id, chapter number) -> first chapter id in that part
+        self.parts = []         # part ids in document order
+        self.part_chapters = {} # part id -> chapter ids in document order
+        self.ids = {}           # element id -> tag of the first element carrying it
+        self._build(content)
+
+    def _build(self, content=None):
+        """Stream the book (or its already-read content) through expat once"""
+        parser = xml.parsers.expat.ParserCreate()
+        parser.buffer_text = True
+        stack = []
+        # 'capture' is the chapter emphasis role the current text belongs to
+        state = {'part': None, 'chapter': None, 'capture': None, 'text': []}
+
+        def start(name, attrs):
+            stack.append(name)
+            element_id = attrs.get('id')
+            if element_id and element_id not in self.ids:
+                self.ids[element_id] = name
+
+            if name == 'part':
+                state['part'] = element_id
+                if element_id:
+                    self.parts.append(element_id)
+                    self.part_chapters[element_id] = []
+            elif name == 'chapter' and element_id:
+                state['chapter'] = element_id
+                self.chapters[element_id] = {
+                    'number': '',
+                    'title': '',
+                    'label': attrs.get('label', ''),
+                    'part': state['part'],
+                }
+                if state['part']:
+                    self.part_chapters[state['part']].append(element_id)
+            elif name == 'emphasis' and state['chapter'] and stack[-3:-1] == ['chapter', 'title']:
+                # Only the chapter's own <title>, not nested section titles
+                role = attrs.get('role')
+                if role in ('chapterNumber', 'chapterTitle'):
+                    state['capture'] = role
+                    state['text'] = []
+
+        def end(name):
+            stack.pop()
+            capture = state['capture']
+            if name == 'emphasis' and capture in ('chapterNumber', 'chapterTitle'):
+                text = ''.join(state['text']).strip()
+                chapter = self.chapters[state['chapter']]
+                if capture == 'chapterNumber' and not chapter['number']:
+                    chapter['number'] = text
+                    self.number_to_id.setdefault(text, state['chapter'])
+                    if chapter['part']:
+                        self.part_number_to_id.setdefault((chapter['part'], text), state['chapter'])
+                elif capture == 'chapterTitle' and not chapter['title']:
+                    chapter['title'] = text
+                state['capture'] = None
+            elif name == 'chapter':
+                state['chapter'] = None
+            elif name == 'part':
+                state['part'] = None
+
+        def chars(data):
+            if state['capture']:
+                state['text'].append(data)
+
+        def skipped(name, is_parameter_entity):
+            # Keep undeclared entities (&mdash; etc.) as written in the source
+            if state['capture'] and not is_parameter_entity:
+                state['text'].append(f'&{name};')
+
+        parser.StartElementHandler = start
+        parser.EndElementHandler = end
+        parser.CharacterDataHandler = chars
+        parser.SkippedEntityHandler = skipped
+        # External sect1 entities are not expanded (no ExternalEntityRefHandler is set):
+        # chapter titles live in book.xml itself, and with a handler expat rebuilds its
+        # entity context on every reference, which is quadratic in the number of entities
+
+        metrics.count('book_index.builds')
+        if content is not None:
+            parser.Parse(content, True)
+            return
+
+        with open(self.book_path, 'rb') as f:
+            while True:
+                chunk = f.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                parser.Parse(chunk, False)
+            parser.Parse(b'', True)
+            metrics.record_read(f.tell())
+
+    def chapter(self, ch_id):
+        """Return the metadata dict for a chapter id, or None"""
+        return self.chapters.get(ch_id)
+
+    def chapter_id(self, chapter_num, part_id=None):
+        """Find a chapter id by its number, optionally restricted to one part"""
+        if part_id is None:
+            return self.number_to_id.get(chapter_num)
+        return self.part_number_to_id.get((part_id, chapter_num))
+
+    def part_chapter_numbers(self, part_id):
+        """[(chapter id, chapter number), ...] for a part, in document order"""
+        return [(ch_id, self.chapters[ch_id]['number']) for ch_id in self.part_chapters.get(part_id, [])]
+
+def load_book_index(book_path, content=None):
+    """
+    Return a shared BookIndex for book_path, rebuilding only if the file changed.
+    Pass content when the file has already been read, so it is not read again.
+    """
+    key = os.path.abspath(book_path)
+    stat = os.stat(key)
+    cached = _INDEX_CACHE.get(key)
+    if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        metrics.count('book_index.cache_hits')
+        return cached[1]
+
+    index = BookIndex(key, content)
+    _INDEX_CACHE[key] = ((stat.st_mtime_ns, stat.st_size), index)
+    return index
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Book discovery for extracted XML directories.
+A book is identified by its book.<isbn>.xml file; its part-level sect1 files are
+sect1.<isbn>.<part id>s0001.xml next to it, and its OPS content is located by convention.
+"""
+
+import re
+from pathlib import Path
+
+# The title the scripts were originally written for; used when no book id is given
+DEFAULT_ISBN = '9781683674832'
+
+BOOK_FILE_PATTERN = re.compile(r'^book\.([^.]+)\.xml$')
+
+def book_isbn(book_path):
+    """Return the book id from a book.<isbn>.xml path, or None"""
+    match = BOOK_FILE_PATTERN.match(Path(book_path).name)
+    return match.group(1) if match else None
+
+def find_book_files(xml_dir):
+    """Return the sorted book.<isbn>.xml files in a directory"""
+    return sorted(path for path in Path(xml_dir).glob('book.*.xml') if book_isbn(path))
+
+def find_book(xml_dir):
+    """Return the single book.<isbn>.xml file in a directory"""
+    books = find_book_files(xml_dir)
+    if not books:
+        raise FileNotFoundError(f"No book.*.xml found in {xml_dir}")
+    if len(books) > 1:
+        raise ValueError(f"More than one book in {xml_dir}: {', '.join(path.name for path in books)}")
+    return books[0]
+
+def discover_books(root):
+    """Return the sorted directories under root (including root) that contain a book.*.xml"""
+    return sorted({path.parent for path in Path(root).rglob('book.*.xml') if book_isbn(path)})
+
+def part_file_name(isbn, part_id):
+    return f"sect1.{isbn}.{part_id}s0001.xml"
+
+def existing_part_files(xml_dir, isbn, part_ids):
+    """[(part id, path), ...] for the parts in part_ids whose part-level sect1 file exists, in order"""
+    files = []
+    for part_id in part_ids:
+        path = Path(xml_dir) / part_file_name(isbn, part_id)
+        if path.exists():
+            files.append((part_id, path))
+    return files
+
+def find_ops_location(xml_dir, isbn):
+    """Locate a book's OPS content: OPS.zip or OPS/ in or next to the XML directory, or <isbn>.epub"""
+    xml_dir = Path(xml_dir)
+    candidates = [
+        xml_dir / 'OPS.zip',
+        xml_dir / 'OPS',
+        xml_dir.parent / 'OPS.zip',
+        xml_dir.parent / 'OPS',
+        xml_dir / f'{isbn}.epub',
+        xml_dir.parent / f'{isbn}.epub',
+    ]
+    for candidate in candidates:
+        if candidate.exists():
+            return str(candidate)
+    return None
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+"""
+Global OPS -> XML chapter alignment.
+Scores every OPS chapter signature against every XML chapter at once (title token
+similarity plus chapter-number agreement), then solves the assignment globally:
+a maximum-weight one-to-one matching over the candidate pairs, after which the
+remaining OPS files map many-to-one onto their parent chapter (subsections such
+as 3.7.2 -> 3.7) or onto their best title match.
+NumPy (optional, see requirements-optional.txt) is used for the batched similarity
+products when installed; otherwise the sparse token index from title_matcher.py
+produces the same scores, in the same order.
+The banded mode instead aligns both sides as ordered sequences (OPS reading order
+against XML document order) with a dynamic program restricted to a band around the
+diagonal: a monotone mapping with explicit gaps and merges in O(n * band) time.
+
+Usage:
+    python chapter_alignment.py [--xml-dir DIR] [--ops OPS.zip] [--mode global|banded] [--band N]
+                                [--json mapping.json]
+"""
+
+import argparse
+import heapq
+import json
+import re
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from book_index import load_book_index
+from books import find_book, book_isbn, find_ops_location
+from correct_mapping import load_ops_content_signatures
+from epub_nav import load_navigation
+from ops_source import DEFAULT_OPS_LOCATION, open_ops_source
+from section_trie import build_section_trie, load_section_trie, number_pieces
+from title_matcher import MIN_TITLE_SCORE, TitleMatcher, jaccard, title_tokens
+
+NUMBER_BONUS = 0.5         # added to the title score when the chapter numbers agree
+SUBSECTION_CONFIDENCE = 0.5
+BATCH_ROWS = 1024          # OPS rows per NumPy similarity batch
+DEFAULT_BAND = 64          # XML chapters either side of the diagonal scored by the banded alignment
+SUBSECTION_GAIN = 0.25     # banded alignment: value of merging a subsection file into the chapter before it
+MODES = ('global', 'banded')
+
+OPS_ID_PATTERN = re.compile(r'_v(\d+)_c(\d+)$')
+
+def load_ops_signatures(ops, isbn):
+    """ops id -> content signature for every OPS chapter file (prefixes read concurrently)"""
+    signatures = load_ops_content_signatures(ops, ops.glob(f'{isbn}_v*_c*.xhtml'))
+    return {Path(name).stem: signature for name, signature in signatures.items() if signature}
+
+def load_spine_order(ops):
+    """ops id -> spine position, from the EPUB package (empty without one)"""
+    return {
+        Path(name).stem: entry.spine_index
+        for name, entry in load_navigation(ops).items()
+        if entry.spine_index is not None
+    }
+
+def reading_order(ops_ids, spine_order=None):
+    """OPS ids in reading order: by spine position when known, else by the volume and chapter numbers in the id"""
+    spine_order = spine_order or {}
+
+    def key(ops_id):
+        position = spine_order.get(ops_id)
+        match = OPS_ID_PATTERN.search(ops_id)
+        numbers = (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+        return (position is None, position or 0, numbers, ops_id)
+    return sorted(ops_ids, key=key)
+
+def title_similarities(ops_titles, xml_titles, min_score=MIN_TITLE_SCORE):
+    """
+    Return {ops row: [(xml column, Jaccard score)]} for every pair scoring above min_score,
+    best score first (ties by column)
+    """
+    if np is not None and ops_titles and xml_titles:
+        return _title_similarities_numpy(ops_titles, xml_titles, min_score)
+
+    matcher = TitleMatcher({column: title for column, title in enumerate(xml_titles)})
+    return {
+        row: [(column, score) for column, score in matcher.rank(title, len(matcher), min_score) if score > min_score]
+        for row, title in enumerate(ops_titles)
+    }
+
+def _title_similarities_numpy(ops_titles, xml_titles, min_score):
+    """
+    Batched binary token matrices: intersections are one matrix product per batch.
+    Counts are exact in float64, so each score is the same division jaccard() does.
+    """
+    ops_tokens = [title_tokens(title) for title in ops_titles]
+    xml_tokens = [title_tokens(title) for title in xml_titles]
+    vocabulary = {token: index for index, token in enumerate(set().union(*xml_tokens))}
+
+    xml_matrix = np.zeros((len(xml_tokens), len(vocabulary)), dtype=np.float64)
+    for column, tokens in enumerate(xml_tokens):
+        xml_matrix[column, [vocabulary[token] for token in tokens]] = 1
+    xml_sizes = xml_matrix.sum(axis=1)
+
+    rows = {row: [] for row in range(len(ops_tokens))}
+    for start in range(0, len(ops_tokens), BATCH_ROWS):
+        batch = ops_tokens[start:start + BATCH_ROWS]
+        ops_matrix = np.zeros((len(batch), len(vocabulary)), dtype=np.float64)
+        ops_sizes = np.array([len(tokens) for tokens in batch], dtype=np.float64)
+        for offset, tokens in enumerate(batch):
+            ops_matrix[offset, [vocabulary[token] for token in tokens if token in vocabulary]] = 1
+
+        common = ops_matrix @ xml_matrix.T
+        union = ops_sizes[:, None] + xml_sizes[None, :] - common
+        scores = np.divide(common, union, out=np.zeros_like(common), where=union > 0)
+        offsets, columns = np.nonzero(scores > min_score)
+        for offset, column, score in zip(offsets.tolist(), columns.tolist(), scores[offsets, columns].tolist()):
+            rows[start + offset].append((column, score))
+    for pairs in rows.values():
+        pairs.sort(key=lambda pair: (-pair[1], pair[0]))
+    return rows
+
+def max_weight_matching(weights):
+    """
+    Optimal one-to-one matching for {(row, column): weight}, rows free to stay unmatched;
+    returns {row: column}. Successive shortest augmenting paths (Jonker-Volgenant
+    potentials) over the sparse candidate edges: costs are negated weights and every row
+    has a private zero-cost "unmatched" column, so most rows augment in a single step.
+    """
+    edges = {}  # row -> {column: cost}
+    for (row, column), weight in sorted(weights.items()):
+        edges.setdefault(row, {})[column] = -weight
+    for row, row_edges in edges.items():
+        row_edges[-row - 1] = 0.0  # private unmatched column
+
+    price = {}       # column -> potential
+    row_match = {}   # row -> column
+    column_match = {}
+
+    for source in sorted(edges):
+        dist = {}
+        via = {}     # column -> row it was reached from
+        heap = []
+        for column, cost in edges[source].items():
+            heapq.heappush(heap, (cost - price.get(column, 0.0), column, source))
+
+        while True:
+            d, column, row = heapq.heappop(heap)
+            if column in dist:
+                continue
+            dist[column] = d
+            via[column] = row
+            owner = column_match.get(column)
+            if owner is None:
+                break
+            base = d + price.get(column, 0.0) - edges[owner][column]
+            for other, cost in edges[owner].items():
+                if other not in dist:
+                    heapq.heappush(heap, (base + cost - price.get(other, 0.0), other, owner))
+
+        # Keep reduced costs non-negative, then flip the matching along the path
+        for scanned, scanned_dist in dist.items():
+            price[scanned] = price.get(scanned, 0.0) + scanned_dist - d
+        while True:
+            row = via[column]
+            previous = row_match.get(row)
+            row_match[row] = column
+            column_match[column] = row
+            if row == source:
+                break
+            column = previous
+
+    return {row: column for row, column in row_match.items() if column >= 0}
+
+def parent_chapter(number, section_trie):
+    """
+    The XML chapter owning the deepest section on number's path (3.7.2 -> the chapter with
+    section 3.7.2, else chapter 3.7); a chapter carrying number itself yields its parent instead
+    """
+    match = section_trie.lookup(number)
+    if match and match.id == match.chapter and match.number == '.'.join(number_pieces(number)):
+        return section_trie.parent_chapter(number)
+    return match.chapter if match else None
+
+def align_chapters(signatures, book_index, min_score=MIN_TITLE_SCORE, section_trie=None):
+    """
+    Return {ops id: {'chapter', 'confidence', 'method'}} for every OPS signature that could be placed.
+    method is 'number+title' or 'title' for the one-to-one assignment, 'subsection' for
+    many-to-one onto the chapter owning a subsection number, and 'shared' for a title match onto
+    a taken chapter. section_trie defaults to one over the chapter numbers alone.
+    """
+    if section_trie is None:
+        section_trie = build_section_trie(book_index)
+    ops_ids = sorted(signatures)
+    xml_ids = [ch_id for ch_id, chapter in book_index.chapters.items() if chapter['number'] and chapter['title']]
+    xml_numbers = [book_index.chapters[ch_id]['number'] for ch_id in xml_ids]
+
+    candidates = title_similarities(
+        [signatures[ops_id]['chapter_title'] for ops_id in ops_ids],
+        [book_index.chapters[ch_id]['title'] for ch_id in xml_ids],
+        min_score,
+    )
+
+    weights = {}
+    same_number = set()
+    for row, pairs in candidates.items():
+        number = signatures[ops_ids[row]]['chapter_num']
+        for column, score in pairs:
+            weights[(row, column)] = score
+            if number and xml_numbers[column] == number:
+                weights[(row, column)] += NUMBER_BONUS
+                same_number.add((row, column))
+
+    # Confidence is the edge weight scaled to [0, 1]: a title-only match tops out at 2/3
+    alignment = {}
+    for row, column in max_weight_matching(weights).items():
+        alignment[ops_ids[row]] = {
+            'chapter': xml_ids[column],
+            'confidence': round(weights[(row, column)] / (1.0 + NUMBER_BONUS), 3),
+            'method': 'number+title' if (row, column) in same_number else 'title',
+        }
+
+    # Many-to-one for what the one-to-one assignment left over
+    for row, ops_id in enumerate(ops_ids):
+        if ops_id in alignment:
+            continue
+        number = signatures[ops_id]['chapter_num']
+        parent_id = parent_chapter(number, section_trie) if number else None
+        if parent_id:
+            alignment[ops_id] = {'chapter': parent_id, 'confidence': SUBSECTION_CONFIDENCE, 'method': 'subsection'}
+        elif candidates.get(row):
+            column, score = max(candidates[row], key=lambda pair: (pair[1], -pair[0]))
+            alignment[ops_id] = {
+                'chapter': xml_ids[column],
+                'confidence': round(score / (1.0 + NUMBER_BONUS), 3),
+                'method': 'shared',
+            }
+
+    return alignment
+
+def banded_alignment(ops_ids, signatures, xml_ids, book_index, section_trie, band=DEFAULT_BAND,
+                     min_score=MIN_TITLE_SCORE):
+    """
+    Align two ordered sequences, OPS ids and XML chapter ids, with a banded dynamic program.
+    Returns the path as [(ops id or None, XML id or None, step)] in order, where step is 'match'
+    (one-to-one), 'merge' (an OPS file onto the same XML chapter as the file before it) or 'gap'.
+    A match is worth its title score (plus NUMBER_BONUS for equal numbers) less min_score and
+    needs a score above min_score; a merge is worth SUBSECTION_GAIN when the XML chapter owns
+    the OPS number, else the same as a match; gaps are worth nothing. Only cells within band
+    XML positions of the diagonal are scored; the band is at least one diagonal step (m / n)
+    wide, so every row connects to the next. Returns None if no path exists.
+    """
+    n, m = len(ops_ids), len(xml_ids)
+    if not n or not m:
+        return [(ops_id, None, 'gap') for ops_id in ops_ids] + [(None, ch_id, 'gap') for ch_id in xml_ids]
+    band = max(band, -(-m // n))
+    ops_tokens = [title_tokens(signatures[ops_id]['chapter_title']) for ops_id in ops_ids]
+    ops_numbers = [signatures[ops_id]['chapter_num'] for ops_id in ops_ids]
+    xml_tokens = [title_tokens(book_index.chapters[ch_id]['title']) for ch_id in xml_ids]
+    xml_numbers = [book_index.chapters[ch_id]['number'] for ch_id in xml_ids]
+    owners = [parent_chapter(number, section_trie) if number else None for number in ops_numbers]
+
+    def weight(i, j):
+        score = jaccard(ops_tokens[i], xml_tokens[j])
+        if ops_numbers[i] and ops_numbers[i] == xml_numbers[j]:
+            score += NUMBER_BONUS
+        return score
+
+    def match_gain(i, j):
+        score = weight(i, j)
+        return score - min_score if score > min_score else None
+
+    def merge_gain(i, j):
+        if owners[i] == xml_ids[j]:
+            return SUBSECTION_GAIN
+        return match_gain(i, j)
+
+    # Row i covers XML positions lo[i]..hi[i] around the diagonal j = i * m / n; a row never
+    # starts past the end of the row before it, so each row is reachable by an OPS gap
+    lo = []
+    hi = []
+    for i in range(n + 1):
+        center = i * m // n
+        lo.append(min(max(0, center - band), hi[-1]) if i else 0)
+        hi.append(min(m, center + band))
+
+    negative = float('-inf')
+    best = []      # best[i][j - lo[i]]: best score for ops[:i] against xml[:j]
+    assigned = []  # the same, with ops[i - 1] assigned to xml[j - 1]
+    steps = []     # how best was reached: 'assign', 'ops gap' or 'xml gap'
+    assign_steps = []  # how assigned was reached: 'match' or 'merge'
+
+    def cell(rows, i, j):
+        if 0 <= i <= n and lo[i] <= j <= hi[i]:
+            return rows[i][j - lo[i]]
+        return negative
+
+    for i in range(n + 1):
+        row_best = []
+        row_assigned = []
+        row_steps = []
+        row_assign_steps = []
+        for j in range(lo[i], hi[i] + 1):
+            assign_score = negative
+            assign_step = None
+            if i and j:
+                gain = match_gain(i - 1, j - 1)
+                if gain is not None:
+                    previous = cell(best, i - 1, j - 1)
+                    if previous > negative:
+                        assign_score = previous + gain
+                        assign_step = 'match'
+                previous = cell(assigned, i - 1, j)
+                if previous > negative:
+                    gain = merge_gain(i - 1, j - 1)
+                    if gain is not None and previous + gain > assign_score:
+                        assign_score = previous + gain
+                        assign_step = 'merge'
+
+            score, step = (0.0, None) if not i and not j else (assign_score, 'assign')
+            if i and cell(best, i - 1, j) > score:
+                score, step = cell(best, i - 1, j), 'ops gap'
+            if j and (row_best[-1] if j > lo[i] else negative) > score:
+                score, step = row_best[-1], 'xml gap'
+
+            row_best.append(score)
+            row_assigned.append(assign_score)
+            row_steps.append(step)
+            row_assign_steps.append(assign_step)
+        best.append(row_best)
+        assigned.append(row_assigned)
+        steps.append(row_steps)
+        assign_steps.append(row_assign_steps)
+
+    if cell(best, n, m) == negative:
+        return None
+
+    # Trace back from the end of both sequences
+    path = []
+    i, j = n, m
+    in_assigned = False
+    while i > 0 or j > 0:
+        if in_assigned:
+            step = assign_steps[i][j - lo[i]]
+            path.append((ops_ids[i - 1], xml_ids[j - 1], step))
+            i -= 1
+            if step == 'match':
+                j -= 1
+                in_assigned = False
+            continue
+        step = steps[i][j - lo[i]]
+        if step == 'assign':
+            in_assigned = True
+        elif step == 'ops gap':
+            path.append((ops_ids[i - 1], None, 'gap'))
+            i -= 1
+        else:
+            path.append((None, xml_ids[j - 1], 'gap'))
+            j -= 1
+    path.reverse()
+    return path
+
+def align_chapters_banded(signatures, book_index, order=None, band=DEFAULT_BAND, min_score=MIN_TITLE_SCORE,
+                          section_trie=None):
+    """
+    align_chapters() as a monotone sequence alignment: OPS ids in order (reading_order() by
+    default) against the XML chapters in document order. Methods are 'number+title' and
+    'title' for matches, 'subsection' and 'shared' for merges; OPS files in gaps are left out.
+    """
+    if section_trie is None:
+        section_trie = build_section_trie(book_index)
+    ops_ids = [ops_id for ops_id in (order or reading_order(signatures)) if ops_id in signatures]
+    xml_ids = [ch_id for ch_id, chapter in book_index.chapters.items() if chapter['number'] and chapter['title']]
+
+    path = banded_alignment(ops_ids, signatures, xml_ids, book_index, section_trie, band, min_score)
+    if path is None:
+        return align_chapters(signatures, book_index, min_score, section_trie)
+
+    alignment = {}
+    for ops_id, ch_id, step in path:
+        if step == 'gap':
+            continue
+        number = signatures[ops_id]['chapter_num']
+        score = jaccard(title_tokens(signatures[ops_id]['chapter_title']), title_tokens(book_index.chapters[ch_id]['title']))
+        same_number = bool(number) and number == book_index.chapters[ch_id]['number']
+        if step == 'merge' and number and parent_chapter(number, section_trie) == ch_id:
+            alignment[ops_id] = {'chapter': ch_id, 'confidence': SUBSECTION_CONFIDENCE, 'method': 'subsection'}
+            continue
+        alignment[ops_id] = {
+            'chapter': ch_id,
+            'confidence': round((score + (NUMBER_BONUS if same_number else 0.0)) / (1.0 + NUMBER_BONUS), 3),
+            'method': ('shared' if step == 'merge' else 'number+title' if same_number else 'title'),
+        }
+    return alignment
+
+def align_book_chapters(ops, signatures, book_index, mode='global', section_trie=None, band=DEFAULT_BAND):
+    """Run the selected alignment mode ('global' or 'banded', in the OPS spine order)"""
+    if mode == 'banded':
+        order = reading_order(signatures, load_spine_order(ops))
+        return align_chapters_banded(signatures, book_index, order, band, section_trie=section_trie)
+    return align_chapters(signatures, book_index, section_trie=section_trie)
+
+def build_global_mapping(ops_location, xml_dir, isbn, min_confidence=0.0, mode='global'):
+    """ops id -> XML chapter id from the chapter alignment (the form get_correct_mapping returns)"""
+    ops = open_ops_source(ops_location)
+    book_index = load_book_index(Path(xml_dir) / f'book.{isbn}.xml')
+    alignment = align_book_chapters(
+        ops, load_ops_signatures(ops, isbn), book_index, mode, load_section_trie(xml_dir, isbn, book_index)
+    )
+    return {
+        ops_id: entry['chapter']
+        for ops_id, entry in alignment.items()
+        if entry['confidence'] >= min_confidence
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Align OPS chapter files to XML chapters")
+    parser.add_argument('--xml-dir', default='/workspace/extracted_final')
+    parser.add_argument('--ops', help="OPS.zip or extracted OPS directory (default: found next to the XML)")
+    parser.add_argument('--mode', choices=MODES, default='global',
+                        help="global assignment over all pairs, or banded sequence alignment in reading order")
+    parser.add_argument('--band', type=int, default=DEFAULT_BAND,
+                        help=f"banded mode: XML chapters either side of the diagonal (default: {DEFAULT_BAND})")
+    parser.add_argument('--json', help="write the alignment with confidence scores to this file")
+    args = parser.parse_args(argv)
+
+    book_path = find_book(args.xml_dir)
+    isbn = book_isbn(book_path)
+    ops = open_ops_source(args.ops or find_ops_location(args.xml_dir, isbn) or DEFAULT_OPS_LOCATION)
+    signatures = load_ops_signatures(ops, isbn)
+    book_index = load_book_index(book_path)
+    section_trie = load_section_trie(args.xml_dir, isbn, book_index)
+    if args.mode == 'banded':
+        alignment = align_chapters_banded(
+            signatures, book_index, reading_order(signatures, load_spine_order(ops)), args.band,
+            section_trie=section_trie,
+        )
+        heading = f"BANDED OPS TO XML ALIGNMENT (band {args.band})"
+    else:
+        alignment = align_chapters(signatures, book_index, section_trie=section_trie)
+        heading = "GLOBAL OPS TO XML ALIGNMENT" + ("" if np is not None else " (NumPy not installed, sparse scoring)")
+
+    print("=" * 80)
+    print(heading)
+    print("=" * 80)
+    for ops_id in sorted(signatures):
+        entry = alignment.get(ops_id)
+        signature = signatures[ops_id]
+        if entry:
+            print(f"✓ {ops_id} → {entry['chapter']} ({entry['method']}, confidence {entry['confidence']:.2f})")
+        else:
+            print(f"✗ {ops_id} - NO MATCH FOUND")
+        print(f"  OPS: {signature['chapter_num']} {signature['chapter_title']}")
+
+    print(f"\nAligned {len(alignment)} of {len(signatures)} OPS chapters")
+    aligned_chapters = {entry['chapter'] for entry in alignment.values()}
+    print(f"XML chapters with no OPS file: {sum(1 for ch_id in book_index.chapters if ch_id not in aligned_chapters)}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(alignment, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -1,74 +1,123 @@
 #!/usr/bin/env python3
 """
-Comprehensive link fixer for all 18 part-level sect1 files.
-Maps XHTML file IDs (9781683674832_v*_c*) to actual XML chapter/table/appendix IDs.
+Comprehensive link fixer for all part-level sect1 files of a book.
+Maps XHTML file IDs (<isbn>_v*_c*) to actual XML chapter/table/appendix IDs.
 """
 
+import argparse
 import re
 from pathlib import Path
 from collections import defaultdict
-import xml.etree.ElementTree as ET
 
-def extract_xhtml_to_chapter_mapping(ops_dir):
-    """Map XHTML files to their chapter numbers by reading titles"""
+import metrics
+from book_index import load_book_index
+from books import DEFAULT_ISBN, book_isbn, existing_part_files, find_book, find_ops_location
+from epub_nav import load_navigation
+from label_matcher import as_label_matcher
+from ops_source import DEFAULT_OPS_LOCATION, open_ops_source
+from resolution_cache import MISSING, ResolutionCache
+from rewrite import splice
+from scanner import scan_directory
+from section_trie import load_section_trie
+
+TITLE_PATTERN = re.compile(r'<title>([^<]+)</title>')
+TITLE_PREFIX_LIMIT = 5000
+# Chapter number at the start of a title (e.g., "1.1", "2.1", "3.7.2")
+CHAPTER_NUMBER_PATTERN = re.compile(r'^(\d+\.\d+(?:\.\d+)?)\s+')
+
+@metrics.timed('extract_xhtml_to_chapter_mapping')
+def extract_xhtml_to_chapter_mapping(ops_dir, isbn=DEFAULT_ISBN, use_nav=True):
+    """
+    Map XHTML files to their chapter numbers, titles and spine positions.
+    With use_nav, titles come from the EPUB navigation (OPF spine, nav.xhtml / toc.ncx) in one
+    read, and only files whose navigation label carries no chapter number are opened for their <title>.
+    """
     mapping = {}
+    ops = open_ops_source(ops_dir)
+    names = ops.glob(f'{isbn}_v*_c*.xhtml')
     
-    for xhtml_file in Path(ops_dir).glob('9781683674832_v*_c*.xhtml'):
+    navigation = {}
+    if use_nav:
         try:
-            # Read first few lines to get title
-            with open(xhtml_file, 'r', encoding='utf-8') as f:
-                content = f.read(5000)
+            navigation = load_navigation(ops)
+        except Exception as e:
+            print(f"Error reading EPUB navigation, reading titles from the files: {e}")
+    
+    titles = {}
+    for name in names:
+        entry = navigation.get(name)
+        if entry and entry.title and CHAPTER_NUMBER_PATTERN.match(entry.title):
+            titles[name] = entry.title
+    to_read = [name for name in names if name not in titles]
+    
+    # Read each remaining prefix only until </title>, all files concurrently
+    try:
+        contents = ops.read_prefixes(to_read, TITLE_PATTERN.search, TITLE_PREFIX_LIMIT)
+    except Exception:
+        contents = [None] * len(to_read)
+    
+    for name, content in zip(to_read, contents):
+        try:
+            if content is None:
+                content = ops.read_prefix(name, TITLE_PATTERN.search, TITLE_PREFIX_LIMIT)
             
             # Extract title
-            title_match = re.search(r'<title>([^<]+)</title>', content)
+            title_match = TITLE_PATTERN.search(content)
             if title_match:
-                title = title_match.group(1).strip()
-                
-                # Extract chapter number (e.g., "1.1", "2.1", etc.)
-                chapter_num_match = re.search(r'^(\d+\.\d+(?:\.\d+)?)\s+', title)
-                if chapter_num_match:
-                    chapter_num = chapter_num_match.group(1)
-                    xhtml_id = xhtml_file.stem  # e.g., "9781683674832_v1_c01"
-                    mapping[xhtml_id] = {
-                        'chapter_num': chapter_num,
-                        'title': title,
-                        'file': str(xhtml_file)
-                    }
+                titles[name] = title_match.group(1).strip()
         except Exception as e:
-            print(f"Error processing {xhtml_file}: {e}")
+            print(f"Error processing {ops.path(name)}: {e}")
+    
+    for name in names:
+        title = titles.get(name)
+        chapter_num_match = CHAPTER_NUMBER_PATTERN.match(title) if title else None
+        if chapter_num_match:
+            xhtml_id = Path(name).stem  # e.g., "9781683674832_v1_c01"
+            entry = navigation.get(name)
+            mapping[xhtml_id] = {
+                'chapter_num': chapter_num_match.group(1),
+                'title': title,
+                'file': ops.path(name),
+                'name': name,
+                'spine_index': entry.spine_index if entry else None,
+            }
     
     return mapping
 
-def find_xml_chapter_by_number(xml_dir, chapter_num):
-    """Find XML chapter ID by chapter number"""
-    book_file = Path(xml_dir) / 'book.9781683674832.xml'
+@metrics.timed('find_xml_chapter_by_number')
+def find_xml_chapter_by_number(xml_dir, chapter_num, isbn=DEFAULT_ISBN, prefix=True, title=''):
+    """
+    Find XML chapter ID by chapter number; with prefix, subsection numbers resolve to their owning
+    chapter, and title decides between chapters that share the number (see SectionTrie.lookup)
+    """
+    book_file = Path(xml_dir) / f'book.{isbn}.xml'
     
     if not book_file.exists():
         return None
     
     try:
-        with open(book_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Look for chapter with matching number
-        pattern = rf'<chapter id="(ch\d+)"[^>]*>.*?<emphasis role="chapterNumber">([^<]+)</emphasis>'
-        matches = re.findall(pattern, content, re.DOTALL)
-        
-        for ch_id, ch_num in matches:
-            if ch_num.strip() == chapter_num:
-                return ch_id
+        book_index = load_book_index(book_file)
+        chapter_id = book_index.chapter_id(chapter_num)
+        if chapter_id or not prefix:
+            return chapter_id
+        return load_section_trie(xml_dir, isbn, book_index).chapter_of(chapter_num, title)
     except Exception as e:
         print(f"Error finding chapter {chapter_num}: {e}")
     
     return None
 
-def extract_table_ids_from_xhtml(xhtml_file):
-    """Extract table IDs from XHTML file"""
+@metrics.timed('extract_table_ids_from_xhtml')
+def extract_table_ids_from_xhtml(xhtml_file, ops_source=None):
+    """Extract table IDs from XHTML file (a file name within ops_source, if given)"""
     table_ids = {}
     
     try:
-        with open(xhtml_file, 'r', encoding='utf-8') as f:
-            content = f.read()
+        if ops_source is not None:
+            content = ops_source.read_text(xhtml_file)
+        else:
+            with open(xhtml_file, 'r', encoding='utf-8') as f:
+                content = f.read()
+            metrics.record_read(content)
         
         # Find all table references with patterns like:
         # <a id="rt2-1-1" href="...#t2-1-1">Table 2.1–1</a>
@@ -108,7 +157,7 @@ def extract_table_ids_from_xhtml(xhtml_file):
     
     return table_ids
 
-def map_xhtml_id_to_xml_id(xhtml_id_fragment, xml_dir, xhtml_mapping, chapter_mapping):
+def map_xhtml_id_to_xml_id(xhtml_id_fragment, xml_dir, xhtml_mapping, chapter_mapping, isbn=DEFAULT_ISBN):
     """Map an XHTML ID fragment to XML chapter/table ID"""
     
     # Check if it's in the chapter mapping
@@ -119,24 +168,27 @@ def map_xhtml_id_to_xml_id(xhtml_id_fragment, xml_dir, xhtml_mapping, chapter_ma
     for xhtml_file_id, info in xhtml_mapping.items():
         if xhtml_file_id == xhtml_id_fragment:
             chapter_num = info['chapter_num']
-            xml_chapter_id = find_xml_chapter_by_number(xml_dir, chapter_num)
+            xml_chapter_id = find_xml_chapter_by_number(xml_dir, chapter_num, isbn)
             if xml_chapter_id:
                 chapter_mapping[xhtml_id_fragment] = xml_chapter_id
                 return xml_chapter_id
     
     return None
 
-def build_comprehensive_mapping(ops_dir, xml_dir):
+@metrics.timed('build_comprehensive_mapping')
+def build_comprehensive_mapping(ops_dir, xml_dir, isbn=DEFAULT_ISBN):
     """Build comprehensive mapping from XHTML IDs to XML IDs"""
     
+    ops = open_ops_source(ops_dir)
+    
     print("Step 1: Mapping XHTML files to chapter numbers...")
-    xhtml_mapping = extract_xhtml_to_chapter_mapping(ops_dir)
+    xhtml_mapping = extract_xhtml_to_chapter_mapping(ops, isbn)
     print(f"  Found {len(xhtml_mapping)} XHTML chapters")
     
     print("\nStep 2: Mapping chapter numbers to XML chapter IDs...")
     chapter_id_mapping = {}
     for xhtml_id, info in xhtml_mapping.items():
-        xml_chapter_id = find_xml_chapter_by_number(xml_dir, info['chapter_num'])
+        xml_chapter_id = find_xml_chapter_by_number(xml_dir, info['chapter_num'], isbn, title=info['title'])
         if xml_chapter_id:
             chapter_id_mapping[xhtml_id] = xml_chapter_id
             print(f"  {xhtml_id} → {xml_chapter_id} ({info['chapter_num']} {info['title'][:50]}...)")
@@ -146,8 +198,7 @@ def build_comprehensive_mapping(ops_dir, xml_dir):
     print("\nStep 3: Extracting table/appendix mappings from XHTML files...")
     table_mappings = {}
     for xhtml_id, info in xhtml_mapping.items():
-        xhtml_file = info['file']
-        tables = extract_table_ids_from_xhtml(xhtml_file)
+        tables = extract_table_ids_from_xhtml(info['name'], ops)
         if tables:
             print(f"  {xhtml_id}: {len(tables)} tables/appendices found")
             table_mappings.update(tables)
@@ -156,39 +207,41 @@ def build_comprehensive_mapping(ops_dir, xml_dir):
     
     return chapter_id_mapping, table_mappings, xhtml_mapping
 
-def extract_xml_table_ids(xml_dir):
+def extract_xml_table_ids(xml_dir, workers=None):
     """Extract all table IDs and their labels from XML files"""
-    table_map = {}
-    
-    for xml_file in Path(xml_dir).glob('sect1.*.xml'):
-        try:
-            with open(xml_file, 'r', encoding='utf-8') as f:
-                content = f.read()
-            
-            # Find tables with labels
-            for match in re.finditer(
-                r'<table id="([^"]+)">\s*<title>.*?Table\s+(\d+\.\d+)[–-](\d+)',
-                content,
-                re.DOTALL
-            ):
-                table_id = match.group(1)
-                section = match.group(2)
-                num = match.group(3)
-                table_key = f"Table {section}–{num}"
-                table_map[table_key] = table_id
-        except Exception as e:
-            pass
-    
-    return table_map
+    # Files are parsed in a process pool and merged in sorted name order
+    return scan_directory(xml_dir, 'sect1.*.xml', workers, fields=('tables',))['tables']
 
-def fix_part_level_sect1_file(file_path, chapter_mapping, xml_table_map, xhtml_mapping, xml_dir):
-    """Fix links in a single part-level sect1 file"""
+@metrics.timed('fix_part_level_sect1_file')
+def fix_part_level_sect1_file(file_path, chapter_mapping, xml_table_map, xhtml_mapping, xml_dir,
+                              resolutions=None, isbn=DEFAULT_ISBN):
+    """Fix links in a single part-level sect1 file of the book isbn"""
     
     with open(file_path, 'r', encoding='utf-8') as f:
         content = f.read()
+    metrics.record_read(content)
+    
+    new_content, fixes = fix_part_level_sect1_content(
+        content, chapter_mapping, xml_table_map, xhtml_mapping, xml_dir, isbn, resolutions
+    )
     
-    original_content = content
+    if fixes:
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(new_content)
+        metrics.record_write(new_content)
+    
+    return fixes
+
+@metrics.timed('fix_part_level_sect1_content')
+def fix_part_level_sect1_content(content, chapter_mapping, xml_table_map, xhtml_mapping, xml_dir,
+                                 isbn=DEFAULT_ISBN, resolutions=None):
+    """
+    Fix links in part-level sect1 content; return (new content, fixes).
+    resolutions is an optional ResolutionCache shared by every part file.
+    """
     fixes = []
+    edits = []
+    table_matcher = as_label_matcher(xml_table_map)
     
     # Find all links
     for match in re.finditer(r'<link linkend="([^"]+)">([^<]+)</link>', content):
@@ -196,95 +249,104 @@ def fix_part_level_sect1_file(file_path, chapter_mapping, xml_table_map, xhtml_m
         link_text = match.group(2).strip()
         
         # Skip if not a broken link
-        if not old_linkend.startswith('9781683674832_v'):
+        if not old_linkend.startswith(f'{isbn}_v'):
             continue
         
-        new_linkend = None
-        
-        # Try to find table/appendix mapping first
-        for key in xml_table_map:
-            if key in link_text:
-                new_linkend = xml_table_map[key]
-                break
-        
-        # If not found, try chapter mapping
-        if not new_linkend and old_linkend in chapter_mapping:
-            new_linkend = chapter_mapping[old_linkend]
-        
-        # If still not found, try to match by chapter number in XHTML
-        if not new_linkend:
-            for xhtml_id, info in xhtml_mapping.items():
-                if xhtml_id == old_linkend:
-                    chapter_num = info['chapter_num']
-                    new_linkend = find_xml_chapter_by_number(xml_dir, chapter_num)
-                    break
+        new_linkend = MISSING
+        if resolutions is not None:
+            new_linkend = resolutions.get('comprehensive', old_linkend, link_text)
+        if new_linkend is MISSING:
+            # Try to find table/appendix mapping first (longest exact label in the text)
+            new_linkend = table_matcher.get(link_text)
+            
+            # If not found, try chapter mapping
+            if not new_linkend and old_linkend in chapter_mapping:
+                new_linkend = chapter_mapping[old_linkend]
+            
+            # If still not found, try to match by chapter number in XHTML
+            if not new_linkend:
+                for xhtml_id, info in xhtml_mapping.items():
+                    if xhtml_id == old_linkend:
+                        chapter_num = info['chapter_num']
+                        # Prefix matches were already tried for the chapter mapping
+                        new_linkend = find_xml_chapter_by_number(xml_dir, chapter_num, isbn, prefix=False)
+                        break
+            
+            if resolutions is not None:
+                resolutions.put('comprehensive', old_linkend, link_text, new_linkend)
         
         if new_linkend and new_linkend != old_linkend:
-            # Replace the link
-            old_link = f'linkend="{old_linkend}"'
-            new_link = f'linkend="{new_linkend}"'
-            content = content.replace(old_link, new_link, 1)
+            # Replace this link's linkend value in place
+            edits.append((match.span(1), new_linkend))
             fixes.append({
                 'old': old_linkend,
                 'new': new_linkend,
                 'text': link_text[:60]
             })
     
-    if content != original_content:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-    
-    return fixes
+    return splice(content, edits), fixes
 
-def main():
-    ops_dir = '/workspace/OPS_extracted/OPS'
-    xml_dir = '/workspace/extracted_final'
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fix part-level links through the XHTML -> XML chapter mapping")
+    parser.add_argument('--xml-dir', default='/workspace/extracted_final')
+    parser.add_argument('--ops', help="OPS.zip, OPS directory or .epub (default: found next to the XML)")
+    metrics.add_argument(parser)
+    args = parser.parse_args(argv)
+    metrics.start(args.metrics)
+    
+    xml_dir = args.xml_dir
+    book_path = find_book(xml_dir)
+    isbn = book_isbn(book_path)
+    # OPS.zip is read directly, no extraction step
+    ops_dir = args.ops or find_ops_location(xml_dir, isbn) or DEFAULT_OPS_LOCATION
     
     print("="*80)
     print("COMPREHENSIVE LINK FIXER FOR ALL PART-LEVEL SECT1 FILES")
     print("="*80)
     
     # Build mappings
-    chapter_mapping, xhtml_table_mappings, xhtml_mapping = build_comprehensive_mapping(ops_dir, xml_dir)
+    chapter_mapping, xhtml_table_mappings, xhtml_mapping = build_comprehensive_mapping(ops_dir, xml_dir, isbn)
     
     print("\nStep 4: Extracting XML table IDs...")
     xml_table_map = extract_xml_table_ids(xml_dir)
     print(f"  Found {len(xml_table_map)} tables in XML files")
+    table_matcher = as_label_matcher(xml_table_map)
     
     print("\nStep 5: Fixing all part-level sect1 files...")
     print("-" * 80)
     
+    resolutions = ResolutionCache()
     total_fixes = 0
-    for i in range(1, 19):
-        part_id = f"pt{i:04d}"
-        file_path = Path(xml_dir) / f"sect1.9781683674832.{part_id}s0001.xml"
+    for _part_id, file_path in existing_part_files(xml_dir, isbn, load_book_index(book_path).parts):
+        fixes = fix_part_level_sect1_file(
+            file_path,
+            chapter_mapping,
+            table_matcher,
+            xhtml_mapping,
+            xml_dir,
+            resolutions,
+            isbn
+        )
         
-        if file_path.exists():
-            fixes = fix_part_level_sect1_file(
-                file_path,
-                chapter_mapping,
-                xml_table_map,
-                xhtml_mapping,
-                xml_dir
-            )
-            
-            if fixes:
-                print(f"\n{file_path.name}:")
-                for fix in fixes:
-                    print(f"  ✓ {fix['old']} → {fix['new']}")
-                    print(f"    Text: {fix['text']}...")
-                total_fixes += len(fixes)
-            else:
-                # Check for remaining broken links
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                remaining = len(re.findall(r'linkend="9781683674832_v[^"]*"', content))
-                if remaining > 0:
-                    print(f"\n{file_path.name}: No fixes applied, {remaining} broken links remain")
+        if fixes:
+            print(f"\n{file_path.name}:")
+            for fix in fixes:
+                print(f"  ✓ {fix['old']} → {fix['new']}")
+                print(f"    Text: {fix['text']}...")
+            total_fixes += len(fixes)
+        else:
+            # Check for remaining broken links
+            with open(file_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+            remaining = len(re.findall(rf'linkend="{re.escape(isbn)}_v[^"]*"', content))
+            if remaining > 0:
+                print(f"\n{file_path.name}: No fixes applied, {remaining} broken links remain")
     
     print("\n" + "="*80)
     print(f"TOTAL FIXES: {total_fixes}")
+    print(f"Resolution cache: {resolutions.summary()}")
     print("="*80)
+    metrics.finish(args.metrics)
 
 if __name__ == '__main__':
     main()
@@ -3,113 +3,149 @@
 Create correct OPS to XML mapping by comparing actual content
 """
 
+import argparse
 import re
 from pathlib import Path
 
-def get_ops_content_signature(ops_file):
+import metrics
+from book_index import load_book_index
+from books import DEFAULT_ISBN, book_isbn, existing_part_files, find_book, find_ops_location
+from mapping_store import open_mapping_store
+from ops_source import DEFAULT_IO_WORKERS, DEFAULT_OPS_LOCATION, open_ops_source
+from title_matcher import chapter_title_matcher, jaccard, title_tokens
+
+SIGNATURE_PREFIX_LIMIT = 5000
+
+OPS_TITLE_PATTERN = re.compile(r'<title>([^<]+)</title>')
+OPS_H1_PATTERN = re.compile(
+    r'<h1[^>]*>.*?<span class="chapterNumber">([^<]+)</span>.*?<span class="chapterTitle">([^<]+)</span>',
+    re.DOTALL
+)
+OPS_PARA_PATTERN = re.compile(r'<p[^>]*id="[^"]*">([^<]{50,200})')
+
+def signature_prefix_complete(content):
+    """
+    True once more text cannot change the signature: the title, the h1 chapter spans and the
+    first id-bearing paragraph have all matched (a paragraph match is final once text follows it)
+    """
+    if not OPS_TITLE_PATTERN.search(content) or not OPS_H1_PATTERN.search(content):
+        return False
+    para_match = OPS_PARA_PATTERN.search(content)
+    return para_match is not None and para_match.end() < len(content)
+
+def parse_ops_content_signature(content, ops_file):
+    """Build the signature dict from the first SIGNATURE_PREFIX_LIMIT characters of an OPS file"""
+    # Get title
+    title_match = OPS_TITLE_PATTERN.search(content)
+    title = title_match.group(1) if title_match else ""
+    
+    # Get h1 chapter info
+    h1_match = OPS_H1_PATTERN.search(content)
+    
+    if h1_match:
+        ch_num = h1_match.group(1).strip()
+        ch_title = h1_match.group(2).strip()
+    else:
+        ch_num = ""
+        ch_title = title
+    
+    # Get first paragraph text
+    para_match = OPS_PARA_PATTERN.search(content)
+    para_text = para_match.group(1) if para_match else ""
+    
+    return {
+        'title': title,
+        'chapter_num': ch_num,
+        'chapter_title': ch_title,
+        'para_text': para_text[:100],
+        'file': str(ops_file)
+    }
+
+def get_ops_content_signature(ops_file, ops_source=None):
     """Get a content signature from OPS file (title + first few paragraphs)"""
     try:
-        with open(ops_file, 'r', encoding='utf-8') as f:
-            content = f.read(5000)
-        
-        # Get title
-        title_match = re.search(r'<title>([^<]+)</title>', content)
-        title = title_match.group(1) if title_match else ""
-        
-        # Get h1 chapter info
-        h1_match = re.search(
-            r'<h1[^>]*>.*?<span class="chapterNumber">([^<]+)</span>.*?<span class="chapterTitle">([^<]+)</span>',
-            content,
-            re.DOTALL
-        )
-        
-        if h1_match:
-            ch_num = h1_match.group(1).strip()
-            ch_title = h1_match.group(2).strip()
+        if ops_source is not None:
+            # Only read until the title, h1 and first paragraph have been seen
+            content = ops_source.read_prefix(ops_file, signature_prefix_complete, SIGNATURE_PREFIX_LIMIT)
+            ops_file = ops_source.path(ops_file)
         else:
-            ch_num = ""
-            ch_title = title
-        
-        # Get first paragraph text
-        para_match = re.search(r'<p[^>]*id="[^"]*">([^<]{50,200})', content)
-        para_text = para_match.group(1) if para_match else ""
-        
-        return {
-            'title': title,
-            'chapter_num': ch_num,
-            'chapter_title': ch_title,
-            'para_text': para_text[:100],
-            'file': str(ops_file)
-        }
+            with open(ops_file, 'r', encoding='utf-8') as f:
+                content = f.read(SIGNATURE_PREFIX_LIMIT)
+        return parse_ops_content_signature(content, ops_file)
     except Exception as e:
         return None
 
-def get_xml_chapter_signature(book_content, ch_id):
+def load_ops_content_signatures(ops_source, names, workers=DEFAULT_IO_WORKERS):
+    """
+    Signatures for many OPS files, read concurrently (I/O-parallel on slow storage).
+    Returns {name: signature or None} in the order of names.
+    """
+    names = list(names)
+    try:
+        contents = ops_source.read_prefixes(names, signature_prefix_complete, SIGNATURE_PREFIX_LIMIT, workers)
+    except Exception:
+        # Fall back to one file at a time, so a single unreadable file only loses its own signature
+        return {name: get_ops_content_signature(name, ops_source) for name in names}
+    return {
+        name: parse_ops_content_signature(content, ops_source.path(name))
+        for name, content in zip(names, contents)
+    }
+
+def get_xml_chapter_signature(book_index, ch_id):
     """Get a content signature from XML chapter"""
-    # Find chapter in book
-    pattern = rf'<chapter id="{ch_id}"[^>]*>.*?<emphasis role="chapterNumber">([^<]+)</emphasis>.*?<emphasis role="chapterTitle">([^<]+)</emphasis>'
-    match = re.search(pattern, book_content, re.DOTALL)
+    chapter = book_index.chapter(ch_id)
     
-    if not match:
+    if not chapter or not chapter['number'] or not chapter['title']:
         return None
     
-    ch_num = match.group(1).strip()
-    ch_title = match.group(2).strip()
-    
     return {
-        'chapter_num': ch_num,
-        'chapter_title': ch_title
+        'chapter_num': chapter['number'],
+        'chapter_title': chapter['title']
     }
 
-def find_xml_chapter_by_content(ops_signature, xml_dir):
+def find_xml_chapter_by_content(ops_signature, xml_dir, isbn=DEFAULT_ISBN):
     """Find XML chapter that matches OPS content"""
-    # First try to match by chapter number and title in book.xml
-    with open(Path(xml_dir) / 'book.9781683674832.xml', 'r', encoding='utf-8') as f:
-        book_content = f.read()
+    # Chapter titles are tokenised once per book into an inverted index
+    book_index = load_book_index(Path(xml_dir) / f'book.{isbn}.xml')
+    matcher = chapter_title_matcher(book_index)
+    ops_title = ops_signature['chapter_title']
     
-    # Look for exact chapter number match
+    # First try the chapter with the same number, if its title also matches
     if ops_signature['chapter_num']:
-        pattern = rf'<chapter id="(ch\d+)"[^>]*>.*?<emphasis role="chapterNumber">{re.escape(ops_signature["chapter_num"])}</emphasis>'
-        match = re.search(pattern, book_content, re.DOTALL)
+        ch_id = book_index.chapter_id(ops_signature['chapter_num'])
         
-        if match:
-            ch_id = match.group(1)
-            # Verify the title also matches (at least partially)
-            xml_sig = get_xml_chapter_signature(book_content, ch_id)
-            if xml_sig:
-                # Check if titles match (allowing for minor differences)
-                ops_title_clean = re.sub(r'[^\w\s]', '', ops_signature['chapter_title'].lower())
-                xml_title_clean = re.sub(r'[^\w\s]', '', xml_sig['chapter_title'].lower())
-                
-                # Calculate similarity
-                ops_words = set(ops_title_clean.split())
-                xml_words = set(xml_title_clean.split())
-                
-                if ops_words and xml_words:
-                    common = len(ops_words & xml_words)
-                    total = len(ops_words | xml_words)
-                    similarity = common / total if total > 0 else 0
-                    
-                    if similarity > 0.5:  # At least 50% word overlap
-                        return ch_id, xml_sig
+        # At least 50% word overlap (Jaccard similarity of the title words)
+        if ch_id and matcher.similarity(ch_id, ops_title) > 0.5:
+            return ch_id, get_xml_chapter_signature(book_index, ch_id)
+    
+    # Otherwise take the best title match among all chapters
+    for ch_id, score in matcher.rank(ops_title, limit=1, min_score=0.5):
+        if score > 0.5:
+            return ch_id, get_xml_chapter_signature(book_index, ch_id)
     
     return None, None
 
-def main():
-    ops_dir = '/workspace/OPS_extracted/OPS'
-    xml_dir = '/workspace/extracted_final'
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Map OPS chapter files to XML chapters by their content")
+    parser.add_argument('--xml-dir', default='/workspace/extracted_final')
+    parser.add_argument('--ops', help="OPS.zip, OPS directory or .epub (default: found next to the XML)")
+    metrics.add_argument(parser)
+    args = parser.parse_args(argv)
+    metrics.start(args.metrics)
+    
+    xml_dir = args.xml_dir
+    book_path = find_book(xml_dir)
+    isbn = book_isbn(book_path)
+    ops = open_ops_source(args.ops or find_ops_location(xml_dir, isbn) or DEFAULT_OPS_LOCATION)
     
     # Get all broken link IDs from part-level files
     broken_links = set()
-    for i in range(1, 19):
-        part_id = f"pt{i:04d}"
-        file_path = Path(xml_dir) / f"sect1.9781683674832.{part_id}s0001.xml"
-        
-        if file_path.exists():
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-            links = re.findall(r'linkend="(9781683674832_v\d+_c\d+)"', content)
-            broken_links.update(links)
+    link_pattern = re.compile(rf'linkend="({re.escape(isbn)}_v\d+_c\d+)"')
+    for _part_id, file_path in existing_part_files(xml_dir, isbn, load_book_index(book_path).parts):
+        with open(file_path, 'r', encoding='utf-8') as f:
+            content = f.read()
+        metrics.record_read(content)
+        broken_links.update(link_pattern.findall(content))
     
     print("=" * 80)
     print("CORRECT OPS TO XML MAPPING")
@@ -118,18 +154,27 @@ def main():
     
     # Create mapping
     mapping = {}
+    confidences = {}
+    
+    # Read every OPS prefix up front, concurrently
+    signatures = load_ops_content_signatures(
+        ops, [f"{ops_id}.xhtml" for ops_id in sorted(broken_links) if ops.exists(f"{ops_id}.xhtml")]
+    )
     
     for ops_id in sorted(broken_links):
-        ops_file = Path(ops_dir) / f"{ops_id}.xhtml"
+        ops_file = f"{ops_id}.xhtml"
         
-        if ops_file.exists():
-            ops_sig = get_ops_content_signature(ops_file)
+        if ops.exists(ops_file):
+            ops_sig = signatures.get(ops_file)
             
             if ops_sig:
-                xml_ch_id, xml_sig = find_xml_chapter_by_content(ops_sig, xml_dir)
+                xml_ch_id, xml_sig = find_xml_chapter_by_content(ops_sig, xml_dir, isbn)
                 
                 if xml_ch_id:
                     mapping[ops_id] = xml_ch_id
+                    confidences[ops_id] = round(
+                        jaccard(title_tokens(ops_sig['chapter_title']), title_tokens(xml_sig['chapter_title'])), 3
+                    )
                     print(f"✓ {ops_id} → {xml_ch_id}")
                     print(f"  OPS: {ops_sig['chapter_num']} {ops_sig['chapter_title']}")
                     print(f"  XML: {xml_sig['chapter_num']} {xml_sig['chapter_title']}")
@@ -148,6 +193,15 @@ def main():
     for ops_id, xml_id in sorted(mapping.items()):
         print(f"{ops_id} → {xml_id}")
     
+    # Stored under its own provenance, so it never clobbers the pipeline's alignment (or vice
+    # versa); manual entries in mappings/<isbn>.jsonl still win when applied
+    with open_mapping_store(xml_dir, isbn) as store:
+        store.replace(isbn, 'chapter', 'content', {
+            ops_id: (xml_id, confidences[ops_id]) for ops_id, xml_id in sorted(mapping.items())
+        })
+        print(f"\nSaved to {store.path} (version {store.version(isbn)})")
+    
+    metrics.finish(args.metrics)
     return mapping
 
 if __name__ == '__main__':
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+EPUB navigation for an OPS source: the OPF package spine plus the table-of-contents
+labels from nav.xhtml (EPUB 3) and toc.ncx (EPUB 2).
+The package and navigation documents are small and read once, and they name every
+content file with its spine position and title, so callers only need to open the
+XHTML files the navigation does not cover.
+"""
+
+import posixpath
+import weakref
+import xml.etree.ElementTree as ElementTree
+from collections import namedtuple
+from urllib.parse import unquote
+
+EPUB_NAMESPACE = 'http://www.idpf.org/2007/ops'
+NCX_MEDIA_TYPE = 'application/x-dtbncx+xml'
+
+# title is the table-of-contents label (None if the file is only in the spine);
+# spine_index is the file's position in reading order (None if it is not in the spine)
+NavEntry = namedtuple('NavEntry', 'title spine_index')
+
+_NAV_CACHE = weakref.WeakKeyDictionary()  # OpsSource -> its navigation
+
+def _local(tag):
+    return tag.rsplit('}', 1)[-1]
+
+def _resolve(base, href):
+    """OPS-root-relative file name for an href relative to the document at base (fragment dropped)"""
+    path = unquote(href.split('#', 1)[0])
+    if not path:
+        return None
+    return posixpath.normpath(posixpath.join(posixpath.dirname(base), path))
+
+def _has_fragment(href):
+    return '#' in href and not href.endswith('#')
+
+def parse_package(content, opf_name):
+    """Return (manifest items {id: {'href', 'media_type', 'properties'}}, spine file names, NCX item id)"""
+    root = ElementTree.fromstring(content)
+    items = {}
+    spine = []
+    toc_id = None
+    for element in root.iter():
+        tag = _local(element.tag)
+        if tag == 'item':
+            items[element.get('id')] = {
+                'href': _resolve(opf_name, element.get('href', '')),
+                'media_type': element.get('media-type', ''),
+                'properties': element.get('properties', '').split(),
+            }
+        elif tag == 'spine':
+            toc_id = element.get('toc')
+        elif tag == 'itemref':
+            item = items.get(element.get('idref'))
+            if item and item['href']:
+                spine.append(item['href'])
+    return items, spine, toc_id
+
+def _add_label(labels, name, title, href):
+    """Keep one label per file: the first one, unless a later one points at the file itself"""
+    title = ' '.join(title.split())
+    if not name or not title:
+        return
+    if name not in labels or (labels[name][1] and not _has_fragment(href)):
+        labels[name] = (title, _has_fragment(href))
+
+def parse_nav_document(content, nav_name):
+    """file name -> label from the toc <nav> of an EPUB 3 navigation document"""
+    root = ElementTree.fromstring(content)
+    labels = {}
+    for nav in root.iter():
+        if _local(nav.tag) != 'nav' or 'toc' not in nav.get(f'{{{EPUB_NAMESPACE}}}type', '').split():
+            continue
+        for link in nav.iter():
+            if _local(link.tag) == 'a' and link.get('href'):
+                _add_label(labels, _resolve(nav_name, link.get('href')), ''.join(link.itertext()), link.get('href'))
+    return {name: title for name, (title, _fragment) in labels.items()}
+
+def parse_ncx(content, ncx_name):
+    """file name -> label from the navPoints of an EPUB 2 toc.ncx, in document order"""
+    root = ElementTree.fromstring(content)
+    labels = {}
+    for point in root.iter():
+        if _local(point.tag) != 'navPoint':
+            continue
+        title = ''
+        src = ''
+        for child in point:
+            if _local(child.tag) == 'navLabel':
+                title = ''.join(child.itertext())
+            elif _local(child.tag) == 'content':
+                src = child.get('src', '')
+        if src:
+            _add_label(labels, _resolve(ncx_name, src), title, src)
+    return {name: title for name, (title, _fragment) in labels.items()}
+
+def build_navigation(ops):
+    """
+    file name (relative to the OPS root) -> NavEntry for every file in the spine or the
+    table of contents; empty when the source has no package document. The labels come
+    from nav.xhtml, or from toc.ncx when there is no nav document or it does not parse.
+    """
+    opf_names = ops.glob('*.opf')
+    if not opf_names:
+        return {}
+    items, spine, toc_id = parse_package(ops.read_text(opf_names[0]), opf_names[0])
+
+    # The EPUB 3 nav document first, the EPUB 2 NCX as the fallback
+    candidates = [(item['href'], parse_nav_document) for item in items.values() if 'nav' in item['properties']]
+    candidates += [
+        (item['href'], parse_ncx) for item_id, item in items.items()
+        if item_id == toc_id or item['media_type'] == NCX_MEDIA_TYPE
+    ]
+    labels = {}
+    for href, parse in candidates:
+        try:
+            labels = parse(ops.read_text(href), href)
+        except (ElementTree.ParseError, KeyError, OSError) as e:
+            print(f"Skipping navigation document {href}: {e}")
+            continue
+        if labels:
+            break
+
+    spine_index = {}
+    for index, name in enumerate(spine):
+        spine_index.setdefault(name, index)
+    return {
+        name: NavEntry(labels.get(name), spine_index.get(name))
+        for name in sorted(set(labels) | set(spine_index))
+    }
+
+def load_navigation(ops):
+    """Return the (cached) navigation of an OPS source; see build_navigation()"""
+    navigation = _NAV_CACHE.get(ops)
+    if navigation is None:
+        navigation = _NAV_CACHE[ops] = build_navigation(ops)
+    return navigation
@@ -4,35 +4,35 @@ Script to fix broken links in part-level sect1 files.
 Analyzes the content and creates intelligent mappings for broken linkend references.
 """
 
+import argparse
 import re
 import os
 from pathlib import Path
 from collections import defaultdict
 
+import metrics
+from book_index import load_book_index
+from books import DEFAULT_ISBN, book_isbn, existing_part_files, find_book
+from id_index import load_id_index
+from resolution_cache import MISSING, ResolutionCache
+from rewrite import splice
+from scanner import ORDINAL_FIELDS, build_chapter_ordinals, scan_directory
+from section_trie import load_section_trie
+
+LINK_PATTERN = re.compile(r'<link linkend="([^"]+)">(.*?)</link>', re.DOTALL)
+
 def extract_all_ids_from_book(book_path):
-    """Extract all IDs from the book XML and its referenced files"""
-    with open(book_path, 'r', encoding='utf-8') as f:
-        book_content = f.read()
-    
-    # Find all IDs in the book
-    ids = set(re.findall(r'id="([^"]+)"', book_content))
-    return ids
+    """Extract all IDs from the book XML (streamed by the shared book model)"""
+    return set(load_book_index(book_path).ids)
 
 def extract_all_ids_from_directory(directory):
-    """Extract all IDs from all XML files in directory"""
-    all_ids = {}
-    
-    for xml_file in Path(directory).glob('*.xml'):
-        with open(xml_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        ids = re.findall(r'id="([^"]+)"', content)
-        for id_val in ids:
-            if id_val not in all_ids:
-                all_ids[id_val] = []
-            all_ids[id_val].append(str(xml_file))
-    
-    return all_ids
+    """Extract all IDs from all XML files in directory (via the persistent ID index)"""
+    with load_id_index(directory) as id_index:
+        return id_index.id_files()
+
+def find_broken_link_matches(content, all_ids):
+    """Return the <link> matches in content whose linkend is not a known ID"""
+    return [match for match in LINK_PATTERN.finditer(content) if match.group(1) not in all_ids]
 
 def analyze_broken_links_in_file(sect1_file, all_ids):
     """Analyze broken links in a specific part-level sect1 file"""
@@ -40,7 +40,7 @@ def analyze_broken_links_in_file(sect1_file, all_ids):
         content = f.read()
     
     # Find all linkend references
-    linkends = re.findall(r'<link linkend="([^"]+)">(.*?)</link>', content, re.DOTALL)
+    linkends = LINK_PATTERN.findall(content)
     
     broken = []
     valid = []
@@ -72,72 +72,65 @@ def find_chapter_number_from_link_text(link_text):
     
     return None
 
-def find_chapter_id_by_number(book_content, chapter_num_str, part_id):
-    """Find chapter ID by chapter number string within a specific part"""
-    # Extract part content
-    part_pattern = rf'<part id="{part_id}">(.*?)(?=<part id=|</book>)'
-    part_match = re.search(part_pattern, book_content, re.DOTALL)
-    
-    if not part_match:
-        return None
-    
-    part_content = part_match.group(1)
-    
-    # Look for chapter with matching number
-    # Pattern: <chapter ... <title> ... <emphasis role="chapterNumber">X.Y</emphasis>
-    chapter_pattern = r'<chapter id="(ch\d+)"[^>]*>.*?<emphasis role="chapterNumber">([^<]+)</emphasis>'
-    chapters = re.findall(chapter_pattern, part_content, re.DOTALL)
-    
-    for ch_id, ch_num in chapters:
-        if ch_num.strip() == chapter_num_str:
-            return ch_id
-    
+def find_chapter_id_by_number(book_index, chapter_num_str, part_id, section_trie=None, title=''):
+    """
+    Find chapter ID by chapter number string within a specific part.
+    With a section trie, a number no chapter carries (3.7.2) resolves to the chapter owning it;
+    title (the link text) decides between chapters that share the number (see SectionTrie.lookup).
+    """
+    chapter_id = book_index.chapter_id(chapter_num_str, part_id)
+    if chapter_id or section_trie is None:
+        return chapter_id
+    owner = section_trie.chapter_of(chapter_num_str, title)
+    if owner and book_index.chapters[owner]['part'] == part_id:
+        return owner
+    return None
+
+def load_chapter_ordinals(extracted_dir, isbn=DEFAULT_ISBN, chapter_id=None):
+    """Scan the chapter sect1 files (all of them, or one chapter's) into the table/appendix ordinal index"""
+    pattern = f'sect1.{isbn}.{chapter_id}s*.xml' if chapter_id else f'sect1.{isbn}.*.xml'
+    return build_chapter_ordinals(scan_directory(extracted_dir, pattern, fields=ORDINAL_FIELDS)['files'], isbn)
+
+def ordinal_id(ids, number):
+    """The number-th (1-based) id of a list, the first for 0, or None when out of range"""
+    if ids and number <= len(ids):
+        return ids[number - 1] if number > 0 else ids[0]
     return None
 
-def find_table_or_appendix_id(extracted_dir, link_text, chapter_id):
-    """Find table or appendix ID based on link text and chapter"""
-    # If it's a table or appendix reference, we need to search in the chapter files
+@metrics.timed('find_table_or_appendix_id')
+def find_table_or_appendix_id(extracted_dir, link_text, chapter_id, isbn=DEFAULT_ISBN, ordinals=None):
+    """
+    Find table or appendix ID based on link text and chapter.
+    ordinals is the index from load_chapter_ordinals(); without it only this chapter's files are scanned.
+    """
     if not chapter_id:
         return None
-    
-    # Search in all sect1 files for this chapter
-    sect1_files = list(Path(extracted_dir).glob(f'sect1.9781683674832.{chapter_id}*.xml'))
-    
-    for sect1_file in sect1_files:
-        with open(sect1_file, 'r', encoding='utf-8') as f:
-            content = f.read()
-        
-        # Look for matching table title
+
+    if ordinals is None:
+        ordinals = load_chapter_ordinals(extracted_dir, isbn, chapter_id)
+    chapter = ordinals.get(chapter_id)
+    if chapter:
+        # "Table X.Y–N" is the Nth table of the chapter
         if 'Table' in link_text:
-            # Extract table number from link text
             table_match = re.search(r'Table\s+\d+\.\d+[–-](\d+)', link_text)
             if table_match:
-                table_num = int(table_match.group(1))
-                # Look for table IDs in the file
-                table_ids = re.findall(r'<table id="([^"]+)"', content)
-                if table_ids and table_num <= len(table_ids):
-                    return table_ids[table_num - 1] if table_num > 0 else table_ids[0]
-        
-        # Look for matching appendix
+                table_id = ordinal_id(chapter['tables'], int(table_match.group(1)))
+                if table_id:
+                    return table_id
+
         if 'Appendix' in link_text:
-            # For appendices, they might be in separate files or sections
-            # Try to find by searching for the text
             appendix_match = re.search(r'Appendix\s+\d+\.\d+[–-](\d+)', link_text)
             if appendix_match:
-                appendix_num = int(appendix_match.group(1))
-                # Look for appendix IDs
-                appendix_ids = re.findall(r'id="([^"]*appendix[^"]*)"', content, re.IGNORECASE)
-                if not appendix_ids:
-                    # Try to find by section
-                    appendix_ids = re.findall(r'<sect2 id="([^"]+)"', content)
-                if appendix_ids and appendix_num <= len(appendix_ids):
-                    return appendix_ids[appendix_num - 1] if appendix_num > 0 else appendix_ids[0]
-    
+                appendix_id = ordinal_id(chapter['appendices'], int(appendix_match.group(1)))
+                if appendix_id:
+                    return appendix_id
+
     # If we can't find a specific table/appendix, return the chapter ID as fallback
     return chapter_id
 
-def fix_broken_links_in_file(sect1_file, book_path, extracted_dir, all_ids):
-    """Fix broken links in a part-level sect1 file"""
+def fix_broken_links_in_file(sect1_file, book_path, extracted_dir, all_ids, ordinals=None, resolutions=None,
+                             isbn=DEFAULT_ISBN):
+    """Fix broken links in a part-level sect1 file of the book isbn"""
     # Extract part ID from filename
     filename = Path(sect1_file).name
     part_match = re.search(r'pt(\d+)s0001', filename)
@@ -146,88 +139,139 @@ def fix_broken_links_in_file(sect1_file, book_path, extracted_dir, all_ids):
     
     part_id = f"pt{part_match.group(1)}"
     
-    with open(book_path, 'r', encoding='utf-8') as f:
-        book_content = f.read()
+    book_index = load_book_index(book_path)
     
     with open(sect1_file, 'r', encoding='utf-8') as f:
         content = f.read()
+    metrics.record_read(content)
+    
+    new_content, fixes_made = fix_broken_links_in_content(
+        content, filename, part_id, book_index, extracted_dir, all_ids, isbn, ordinals=ordinals,
+        resolutions=resolutions
+    )
+    
+    if fixes_made:
+        # Write the fixed content
+        with open(sect1_file, 'w', encoding='utf-8') as f:
+            f.write(new_content)
+        metrics.record_write(new_content)
+        return fixes_made
     
-    broken, valid = analyze_broken_links_in_file(sect1_file, all_ids)
+    return None
+
+@metrics.timed('fix_broken_links_in_content')
+def fix_broken_links_in_content(content, filename, part_id, book_index, extracted_dir, all_ids,
+                                isbn=DEFAULT_ISBN, ordinals=None, section_trie=None, resolutions=None):
+    """
+    Fix broken links in part-level sect1 content; return (new content, fixes).
+    ordinals is the chapter table/appendix index (load_chapter_ordinals) and section_trie the
+    book's SectionTrie; both are built here on first need if omitted. A subsection number whose
+    link text matches none of the chapters carrying it is left unresolved.
+    resolutions is an optional ResolutionCache; links are resolved per part, since chapter
+    numbers are looked up within the link's part.
+    """
+    broken = find_broken_link_matches(content, all_ids)
     
     if not broken:
-        return None
+        return content, []
     
     print(f"\nProcessing {filename} (part {part_id}):")
     print(f"  Found {len(broken)} broken links")
     
     fixes_made = []
-    new_content = content
+    edits = []
     
-    for broken_link, link_text in broken:
-        # Try to find the correct ID
-        chapter_num = find_chapter_number_from_link_text(link_text)
+    for match in broken:
+        broken_link = match.group(1)
+        link_text = match.group(2).strip()
         
-        if chapter_num:
-            # Find the chapter ID
-            chapter_id = find_chapter_id_by_number(book_content, chapter_num, part_id)
+        target_id = MISSING
+        if resolutions is not None:
+            target_id = resolutions.get('broken', broken_link, link_text, part_id)
+        if target_id is MISSING:
+            target_id = None
+            
+            # Try to find the correct ID
+            chapter_num = find_chapter_number_from_link_text(link_text)
             
-            if chapter_id:
-                # If it's a table/appendix reference, try to find the specific ID
-                if 'Table' in link_text or 'Appendix' in link_text:
-                    target_id = find_table_or_appendix_id(extracted_dir, link_text, chapter_id)
-                else:
-                    target_id = chapter_id
+            if chapter_num:
+                # Find the chapter ID: by exact number, else by the longest numbered prefix
+                chapter_id = find_chapter_id_by_number(book_index, chapter_num, part_id)
+                if not chapter_id:
+                    if section_trie is None:
+                        section_trie = load_section_trie(extracted_dir, isbn, book_index)
+                    # Table and appendix labels carry no title of their own
+                    title = link_text if link_text.startswith(chapter_num) else ''
+                    chapter_id = find_chapter_id_by_number(book_index, chapter_num, part_id, section_trie, title)
                 
-                if target_id:
-                    # Replace the broken link
-                    old_link = f'linkend="{broken_link}"'
-                    new_link = f'linkend="{target_id}"'
-                    new_content = new_content.replace(old_link, new_link)
-                    fixes_made.append({
-                        'old': broken_link,
-                        'new': target_id,
-                        'text': link_text
-                    })
-                    print(f"    ✓ Fixed: {broken_link} → {target_id}")
-                    print(f"      Link text: {link_text[:60]}...")
-    
-    if fixes_made:
-        # Write the fixed content
-        with open(sect1_file, 'w', encoding='utf-8') as f:
-            f.write(new_content)
-        return fixes_made
-    
-    return None
+                if chapter_id:
+                    # If it's a table/appendix reference, try to find the specific ID
+                    if 'Table' in link_text or 'Appendix' in link_text:
+                        if ordinals is None:
+                            ordinals = load_chapter_ordinals(extracted_dir, isbn)
+                        target_id = find_table_or_appendix_id(extracted_dir, link_text, chapter_id, isbn, ordinals)
+                    else:
+                        target_id = chapter_id
+            
+            if resolutions is not None:
+                resolutions.put('broken', broken_link, link_text, target_id, part_id)
+        
+        if target_id:
+            # Replace this link's linkend value in place
+            edits.append((match.span(1), target_id))
+            fixes_made.append({
+                'old': broken_link,
+                'new': target_id,
+                'text': link_text
+            })
+            print(f"    ✓ Fixed: {broken_link} → {target_id}")
+            print(f"      Link text: {link_text[:60]}...")
+    
+    return splice(content, edits), fixes_made
 
-def main():
-    extracted_dir = '/workspace/extracted_final'
-    book_path = f'{extracted_dir}/book.9781683674832.xml.new'
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fix broken links in part-level sect1 files from their link text")
+    parser.add_argument('--xml-dir', default='/workspace/extracted_final')
+    metrics.add_argument(parser)
+    args = parser.parse_args(argv)
+    metrics.start(args.metrics)
+    
+    extracted_dir = args.xml_dir
+    book = find_book(extracted_dir)
+    isbn = book_isbn(book)
+    # The book with the part entities added by fix_xml_references.py, when it has been run
+    book_path = Path(f'{book}.new')
+    if not book_path.exists():
+        book_path = book
     
     print("=" * 70)
     print("ANALYZING AND FIXING BROKEN LINKS IN PART-LEVEL SECT1 FILES")
     print("=" * 70)
     
-    # Extract all IDs from all files
-    print("\nStep 1: Extracting all IDs from XML files...")
-    all_ids = extract_all_ids_from_directory(extracted_dir)
+    # Load the persistent ID index, re-reading only files changed since the last run
+    print("\nStep 1: Loading ID index for XML files...")
+    all_ids = load_id_index(extracted_dir)
     print(f"  Found {len(all_ids)} unique IDs across all files")
+    ordinals = load_chapter_ordinals(extracted_dir, isbn)
+    print(f"  Indexed tables and appendices of {len(ordinals)} chapters")
     
     # Process each part-level sect1 file
     print("\nStep 2: Fixing broken links in part-level sect1 files...")
     
+    resolutions = ResolutionCache()
     total_fixes = 0
-    for i in range(1, 19):
-        part_id = f"pt{i:04d}"
-        sect1_file = Path(extracted_dir) / f"sect1.9781683674832.{part_id}s0001.xml"
-        
-        if sect1_file.exists():
-            fixes = fix_broken_links_in_file(str(sect1_file), book_path, extracted_dir, all_ids)
-            if fixes:
-                total_fixes += len(fixes)
+    for _part_id, sect1_file in existing_part_files(extracted_dir, isbn, load_book_index(book_path).parts):
+        fixes = fix_broken_links_in_file(
+            str(sect1_file), book_path, extracted_dir, all_ids, ordinals, resolutions, isbn
+        )
+        if fixes:
+            total_fixes += len(fixes)
     
     print("\n" + "=" * 70)
     print(f"SUMMARY: Fixed {total_fixes} broken links")
+    print(f"Resolution cache: {resolutions.summary()}")
     print("=" * 70)
+    metrics.finish(args.metrics)
 
 if __name__ == '__main__':
     main()
@@ -1,20 +1,40 @@
 #!/usr/bin/env python3
 """
-Script to fix XML references in book.9781683674832.xml:
+Script to fix XML references in book.<isbn>.xml:
 1. Add entity declarations for part-level sect1 files (pt00*s0001.xml)
 2. Add entity references at the beginning of each part element
 3. Fix broken links in part-level sect1 files
 """
 
+import argparse
 import re
 import os
 from pathlib import Path
 
+import metrics
+from book_index import BookIndex, load_book_index
+from books import DEFAULT_ISBN, book_isbn, find_book, part_file_name
+
+# The internal subset (group 1) is optional
+DOCTYPE_PATTERN = re.compile(r'<!DOCTYPE[^\[>]*(?:\[(.*?)\]\s*)?>', re.DOTALL)
+ROOT_ELEMENT_PATTERN = re.compile(r'<([A-Za-z_][\w.:-]*)')
+ENTITY_NAME_PATTERN = re.compile(r'<!ENTITY\s+(?:%\s+)?(\S+)')
+PART_ID_PATTERN = re.compile(r'<part id="([^"]+)"')
+# A part's title and partintro; the tempered dots keep a match from running into the next part
+PART_HEAD_PATTERN = re.compile(
+    r'<part id="[^"]+">\s*<title>(?:(?!</title>).)*</title>\s*<partintro>(?:(?!</partintro>).)*</partintro>\s*',
+    re.DOTALL,
+)
+
 def extract_entity_declarations(book_path):
     """Extract the DOCTYPE entity declarations section from the book XML"""
     with open(book_path, 'r', encoding='utf-8') as f:
         content = f.read()
     
+    return content, find_entity_declarations(content)
+
+def find_entity_declarations(content):
+    """Return the DOCTYPE internal subset (entity declarations) of book XML content"""
     # Find DOCTYPE declaration
     doctype_match = re.search(r'<!DOCTYPE.*?\[', content, re.DOTALL)
     if not doctype_match:
@@ -25,105 +45,176 @@ def extract_entity_declarations(book_path):
     if not entity_section_match:
         raise ValueError("No entity declarations found")
     
-    return content, entity_section_match.group(1)
+    return entity_section_match.group(1)
 
 def add_part_entity_declarations(book_path, output_path):
     """Add entity declarations for part-level sect1 files"""
-    content, entity_declarations = extract_entity_declarations(book_path)
-    
-    # Create entity declarations for part-level sect1 files
-    part_entities = []
-    for i in range(1, 19):  # pt0001 to pt0018
-        part_id = f"pt{i:04d}"
-        entity_name = f"sect1.9781683674832.{part_id}s0001"
-        entity_decl = f'<!ENTITY {entity_name} SYSTEM "{entity_name}.xml">'
-        part_entities.append(entity_decl)
-    
-    # Insert part entities at the beginning of the entity declarations
-    # Find the position after the DOCTYPE opening bracket
-    doctype_start = content.find('[') + 1
-    doctype_end = content.find(']>')
-    
-    # Get existing entities
-    existing_entities = content[doctype_start:doctype_end]
-    
-    # Combine new entities with existing ones
-    new_entities = '\n'.join(part_entities) + existing_entities
+    with open(book_path, 'r', encoding='utf-8') as f:
+        content = f.read()
     
-    # Reconstruct the content
-    new_content = content[:doctype_start] + new_entities + content[doctype_end:]
+    new_content, count = insert_part_entity_declarations(
+        content, book_isbn(book_path) or DEFAULT_ISBN, xml_dir=Path(book_path).parent
+    )
     
     with open(output_path, 'w', encoding='utf-8') as f:
         f.write(new_content)
     
-    print(f"Added {len(part_entities)} entity declarations for part-level sect1 files")
+    print(f"Added {count} entity declarations for part-level sect1 files")
     return new_content
 
+def insert_part_entity_declarations(content, isbn=DEFAULT_ISBN, part_ids=None, xml_dir=None):
+    """Return (content with missing part-level sect1 entity declarations added, number added)"""
+    new_content, declared, _referenced = transform_part_entities(
+        content, isbn, part_ids, references=False, xml_dir=xml_dir
+    )
+    return new_content, declared
+
 def add_part_entity_references(book_path, output_path):
     """Add entity references at the beginning of each part element"""
     with open(book_path, 'r', encoding='utf-8') as f:
         content = f.read()
     
-    # Find all part elements and add the entity reference
-    part_pattern = r'(<part id="(pt\d{4})">\s*<title>.*?</title>\s*<partintro>.*?</partintro>\s*)'
-    
-    def add_entity_ref(match):
-        part_block = match.group(1)
-        part_id = match.group(2)
-        entity_ref = f"&sect1.9781683674832.{part_id}s0001;\n"
-        return part_block + entity_ref
-    
-    new_content = re.sub(part_pattern, add_entity_ref, content, flags=re.DOTALL)
+    new_content, count = insert_part_entity_references(
+        content, book_isbn(book_path) or DEFAULT_ISBN, xml_dir=Path(book_path).parent
+    )
     
     with open(output_path, 'w', encoding='utf-8') as f:
         f.write(new_content)
     
-    # Count how many replacements were made
-    count = len(re.findall(part_pattern, content, re.DOTALL))
     print(f"Added entity references to {count} part elements")
     return new_content
 
-def find_chapter_ids_for_part(book_content, part_id):
-    """Find all chapter IDs that belong to a specific part"""
-    # Find the part section
-    part_pattern = rf'<part id="{part_id}">(.*?)(?=<part id=|</book>)'
-    part_match = re.search(part_pattern, book_content, re.DOTALL)
-    
-    if not part_match:
-        return []
-    
-    part_content = part_match.group(1)
-    
-    # Find all chapter IDs in this part
-    chapter_ids = re.findall(r'<chapter id="(ch\d+)"', part_content)
-    return chapter_ids
+def add_part_entities(book_path, output_path, isbn=DEFAULT_ISBN, part_ids=None):
+    """Add the missing part entity declarations and references with one read and one write"""
+    with open(book_path, 'r', encoding='utf-8') as f:
+        content = f.read()
+    metrics.record_read(content)
+
+    new_content, declared, referenced = transform_part_entities(
+        content, isbn, part_ids, xml_dir=Path(book_path).parent
+    )
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        f.write(new_content)
+    metrics.record_write(new_content)
+
+    print(f"Added {declared} entity declarations and {referenced} entity references")
+    return new_content
+
+def insert_part_entity_references(content, isbn=DEFAULT_ISBN, part_ids=None, xml_dir=None):
+    """Return (content with an entity reference after each part's partintro, parts updated)"""
+    new_content, _declared, referenced = transform_part_entities(
+        content, isbn, part_ids, declarations=False, xml_dir=xml_dir
+    )
+    return new_content, referenced
+
+def transform_part_entities(content, isbn=DEFAULT_ISBN, part_ids=None, declarations=True, references=True,
+                            xml_dir=None):
+    """
+    Add the part-level sect1 entity declarations and references in one pass over book content.
+    Parts come from the document, restricted to part_ids or, without them, to the parts whose
+    sect1 file exists in xml_dir. A missing internal subset (or DOCTYPE) is created; declarations
+    and references already present are left alone, so running it again changes nothing.
+    Return (new content, declarations added, references added).
+    """
+    if part_ids is None and xml_dir is None:
+        raise ValueError("part_ids or xml_dir is required")
+    doctype = DOCTYPE_PATTERN.search(content)
+    subset = doctype.group(1) if doctype else None
+    declared_names = set(ENTITY_NAME_PATTERN.findall(subset)) if subset else set()
+    wanted = None if part_ids is None else set(part_ids)
+
+    pieces = []
+    position = 0
+    missing = []
+    referenced = 0
+    for part in PART_ID_PATTERN.finditer(content, doctype.end() if doctype else 0):
+        part_id = part.group(1)
+        if wanted is None:
+            if not (Path(xml_dir) / part_file_name(isbn, part_id)).exists():
+                continue
+        elif part_id not in wanted:
+            continue
+        entity_name = f"sect1.{isbn}.{part_id}s0001"
+
+        if declarations and entity_name not in declared_names:
+            declared_names.add(entity_name)
+            missing.append(f'<!ENTITY {entity_name} SYSTEM "{entity_name}.xml">')
+
+        head = PART_HEAD_PATTERN.match(content, part.start()) if references else None
+        if head and not content.startswith(f"&{entity_name};", head.end()):
+            pieces.append(content[position:head.end()])
+            pieces.append(f"&{entity_name};\n")
+            position = head.end()
+            referenced += 1
+    pieces.append(content[position:])
+
+    if missing:
+        # New declarations go at the beginning of the internal subset, which is created if need be
+        first = pieces[0]
+        if subset is not None:
+            at, text = doctype.start(1), '\n'.join(missing)
+        elif doctype:
+            at, text = doctype.end() - 1, ' [\n' + '\n'.join(missing) + '\n]'
+        else:
+            root = ROOT_ELEMENT_PATTERN.search(first)
+            at, text = root.start(), f'<!DOCTYPE {root.group(1)} [\n' + '\n'.join(missing) + '\n]>\n'
+        pieces[0] = first[:at] + text + first[at:]
 
-def analyze_and_fix_links(extracted_dir, book_path):
+    return ''.join(pieces), len(missing), referenced
+
+def find_chapter_ids_for_part(book_index, part_id):
+    """Find all chapter IDs that belong to a specific part (from the book index, no regex over the book)"""
+    return [ch_id for ch_id, _number in book_index.part_chapter_numbers(part_id) if re.fullmatch(r'ch\d+', ch_id)]
+
+def analyze_and_fix_links(extracted_dir, book_path, isbn=DEFAULT_ISBN):
     """Analyze broken links in part-level sect1 files and create a mapping"""
     with open(book_path, 'r', encoding='utf-8') as f:
         book_content = f.read()
+    metrics.record_read(book_content)
     
+    return analyze_part_links(
+        book_content, extracted_dir, read_part_file, isbn, book_index=load_book_index(book_path, book_content)
+    )
+
+def read_part_file(sect1_file):
+    """Return the content of a part-level sect1 file, or None if it is missing"""
+    if not sect1_file.exists():
+        return None
+    with open(sect1_file, 'r', encoding='utf-8') as f:
+        content = f.read()
+    metrics.record_read(content)
+    return content
+
+def analyze_part_links(book_content, extracted_dir, read_part, isbn=DEFAULT_ISBN, part_ids=None,
+                       book_index=None):
+    """
+    Analyze broken links in part-level sect1 files; read_part(path) returns content or None.
+    book_index is the book's BookIndex; it is built from book_content when not given.
+    part_ids default to every part of the book.
+    """
+    if book_index is None:
+        book_index = BookIndex(None, book_content)
+    if part_ids is None:
+        part_ids = book_index.parts
     issues = []
     fixes = []
     
     # Process each part-level sect1 file
-    for i in range(1, 19):
-        part_id = f"pt{i:04d}"
-        sect1_file = Path(extracted_dir) / f"sect1.9781683674832.{part_id}s0001.xml"
+    for part_id in part_ids:
+        sect1_file = Path(extracted_dir) / f"sect1.{isbn}.{part_id}s0001.xml"
+        sect1_content = read_part(sect1_file)
         
-        if not sect1_file.exists():
+        if sect1_content is None:
             issues.append(f"Missing file: {sect1_file}")
             continue
         
-        with open(sect1_file, 'r', encoding='utf-8') as f:
-            sect1_content = f.read()
-        
-        # Find all broken links (9781683674832_v1_c* pattern)
-        broken_links = re.findall(r'linkend="(9781683674832_v1_c\d+)"', sect1_content)
+        # Find all broken links (<isbn>_v1_c* pattern)
+        broken_links = re.findall(rf'linkend="({re.escape(isbn)}_v1_c\d+)"', sect1_content)
         
         if broken_links:
             # Get chapter IDs for this part
-            chapter_ids = find_chapter_ids_for_part(book_content, part_id)
+            chapter_ids = find_chapter_ids_for_part(book_index, part_id)
             
             issues.append(f"\nPart {part_id}:")
             issues.append(f"  Broken links found: {len(set(broken_links))} unique")
@@ -143,25 +234,30 @@ def analyze_and_fix_links(extracted_dir, book_path):
     
     return issues, fixes
 
-def main():
-    extracted_dir = '/workspace/extracted_final'
-    book_path = f'{extracted_dir}/book.9781683674832.xml'
-    output_path = f'{extracted_dir}/book.9781683674832.xml.new'
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Add part-level entities to book.xml and report broken part links")
+    parser.add_argument('--xml-dir', default='/workspace/extracted_final')
+    metrics.add_argument(parser)
+    args = parser.parse_args(argv)
+    metrics.start(args.metrics)
     
-    print("=" * 60)
-    print("STEP 1: Adding entity declarations for part-level sect1 files")
-    print("=" * 60)
-    add_part_entity_declarations(book_path, output_path)
+    extracted_dir = args.xml_dir
+    book_path = find_book(extracted_dir)
+    isbn = book_isbn(book_path)
+    output_path = f'{book_path}.new'
     
-    print("\n" + "=" * 60)
-    print("STEP 2: Adding entity references to part elements")
+    # Steps 1 and 2 are one pass over the book; existing entities are not added twice
+    print("=" * 60)
+    print("STEPS 1-2: Adding entity declarations and references for part-level sect1 files")
     print("=" * 60)
-    add_part_entity_references(output_path, output_path)
+    book_content = add_part_entities(book_path, output_path, isbn)
     
     print("\n" + "=" * 60)
     print("STEP 3: Analyzing broken links in part-level sect1 files")
     print("=" * 60)
-    issues, fixes = analyze_and_fix_links(extracted_dir, output_path)
+    issues, fixes = analyze_part_links(
+        book_content, extracted_dir, read_part_file, isbn, book_index=load_book_index(book_path)
+    )
     
     for issue in issues:
         print(issue)
@@ -180,6 +276,7 @@ def main():
         files_to_fix[file_path].append(fix)
     
     print(f"Files with broken links: {len(files_to_fix)}")
+    metrics.finish(args.metrics)
     
     return output_path, fixes
 
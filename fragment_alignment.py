@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Fragment-level OPS -> XML id translation.
+Each OPS XHTML chapter document is aligned with the sect1 files of the XML chapter it
+maps to, in one linear pass over both element sequences: elements with a label
+("Table 2.1–1", a heading's words) anchor the alignment in document order, the
+unlabelled elements between two anchors are paired by kind and position (the third
+paragraph after a heading with the third para after the matching section), and
+whatever is left maps to the enclosing XML section. Label-bearing references such as
+<a id="rt2-1-1">Table 2.1–1</a> resolve straight to the labelled XML element.
+The result is a complete fragment id -> XML id table, so a link at any granularity
+(file, section, table, paragraph, anchor) is resolved by lookup.
+
+Usage:
+    python fragment_alignment.py [--xml-dir DIR] [--ops OPS.zip] [--json table.json]
+"""
+
+import argparse
+import json
+import re
+from collections import namedtuple
+
+from books import book_isbn, find_book, find_ops_location
+from chapter_alignment import build_global_mapping
+from mapping_store import manual_mappings
+from ops_source import DEFAULT_IO_WORKERS, DEFAULT_OPS_LOCATION, open_ops_source
+from scanner import ID_TAG, SECT1_FILE_PATTERN, scan_directory
+from title_matcher import title_tokens
+
+# Whole id-bearing start tag (the scanner's ID_TAG); group 1 is the tag, group 3 the id value
+ELEMENT_PATTERN = re.compile(ID_TAG + r'[^>]*>')
+NUMBERED_LABEL_PATTERN = re.compile(r'\b(Table|Figure|Appendix|Box|Exhibit)\s+(\d+(?:\.\d+)*)[–-](\d+)', re.IGNORECASE)
+TAG_PATTERN = re.compile(r'<[^>]+>')
+OPS_HEADING_PATTERN = re.compile(r'\s*<h([1-6])\b[^>]*>(.*?)</h\1>', re.DOTALL)
+XML_TITLE_PATTERN = re.compile(r'\s*<title\b[^>]*>(.*?)</title>', re.DOTALL)
+
+LABEL_SEARCH_LIMIT = 1000  # characters after a table/figure start tag searched for its caption label
+
+OPS_KINDS = {
+    'h1': 'section', 'h2': 'section', 'h3': 'section', 'h4': 'section', 'h5': 'section', 'h6': 'section',
+    'section': 'section', 'p': 'para', 'table': 'table', 'figure': 'figure', 'img': 'figure',
+}
+XML_KINDS = {
+    'sect1': 'section', 'sect2': 'section', 'sect3': 'section', 'sect4': 'section', 'sect5': 'section',
+    'section': 'section', 'simplesect': 'section', 'appendix': 'section',
+    'para': 'para', 'simpara': 'para', 'formalpara': 'para',
+    'table': 'table', 'informaltable': 'table', 'figure': 'figure', 'informalfigure': 'figure',
+}
+# Kinds paired by position between two label anchors
+SEQUENCE_KINDS = ('section', 'para', 'table', 'figure')
+
+# reference: resolved by its label alone, outside the document-order alignment
+Element = namedtuple('Element', 'id kind label reference')
+
+def numbered_labels(text):
+    """Canonical numbered labels ('table 2.1–1') in a text, in order"""
+    return [
+        f"{word.lower()} {number}–{ordinal}"
+        for word, number, ordinal in NUMBERED_LABEL_PATTERN.findall(text)
+    ]
+
+def element_label(text):
+    """Label of an element from its title or heading text: its numbered label, else its title words"""
+    text = TAG_PATTERN.sub(' ', text)
+    labels = numbered_labels(text)
+    if labels:
+        return labels[0]
+    tokens = title_tokens(text)
+    return 'heading: ' + ' '.join(sorted(tokens)) if tokens else None
+
+def _inner_text(content, tag, start):
+    end = content.find(f'</{tag}>', start)
+    return content[start:end] if end >= 0 else content[start:start + LABEL_SEARCH_LIMIT]
+
+def _caption_label(content, start):
+    labels = numbered_labels(TAG_PATTERN.sub(' ', content[start:start + LABEL_SEARCH_LIMIT]))
+    return labels[0] if labels else None
+
+def extract_ops_elements(content):
+    """Id-bearing elements of an OPS XHTML document, in document order"""
+    elements = []
+    for match in ELEMENT_PATTERN.finditer(content):
+        tag = match.group(1).lower()
+        kind = OPS_KINDS.get(tag)
+        label = None
+        reference = False
+
+        if tag in ('table', 'figure', 'img'):
+            label = _caption_label(content, match.end())
+        elif kind == 'section' and tag != 'section':
+            label = element_label(_inner_text(content, tag, match.end()))
+        else:
+            heading = OPS_HEADING_PATTERN.match(content, match.end())
+            if heading:
+                # A container opened by a heading is that heading's section
+                kind = 'section'
+                label = element_label(heading.group(2))
+            elif tag != 'p':
+                # Anchors and caption spans carrying "Table 2.1–1" stand for the labelled element
+                labels = numbered_labels(TAG_PATTERN.sub(' ', _inner_text(content, tag, match.end())))
+                if labels:
+                    label = labels[0]
+                    reference = True
+
+        elements.append(Element(match.group(3), kind or 'other', label, reference))
+    return elements
+
+def extract_xml_elements(content):
+    """Id-bearing elements of XML chapter content (one or more sect1 files), in document order"""
+    elements = []
+    for match in ELEMENT_PATTERN.finditer(content):
+        tag = match.group(1)
+        kind = XML_KINDS.get(tag, 'other')
+        label = None
+        if kind in ('section', 'table', 'figure'):
+            title = XML_TITLE_PATTERN.match(content, match.end())
+            if title:
+                label = element_label(title.group(1))
+        elements.append(Element(match.group(3), kind, label, False))
+    return elements
+
+def chapter_labels(xml_elements):
+    """numbered label -> XML id (first occurrence) for a chapter's labelled elements"""
+    labels = {}
+    for element in xml_elements:
+        if element.label and not element.label.startswith('heading: '):
+            labels.setdefault(element.label, element.id)
+    return labels
+
+def align_fragments(ops_elements, xml_elements, chapter_id):
+    """
+    Return {OPS fragment id: (XML id, method)} for every element of one OPS document.
+    method is 'label' (same label, in document order, or a label reference), 'sequence'
+    (same kind and position between two label anchors) or 'enclosing' (the XML section
+    around the last aligned element, or the chapter).
+    """
+    # Pass 1: label anchors, taken greedily in document order on both sides
+    xml_by_label = {}
+    for position, element in enumerate(xml_elements):
+        if element.label:
+            xml_by_label.setdefault(element.label, []).append(position)
+    label_cursor = {}
+    matched = {}  # OPS position -> (XML position, method)
+    anchors = [(-1, -1)]
+    for ops_position, element in enumerate(ops_elements):
+        if element.reference or not element.label or element.label not in xml_by_label:
+            continue
+        positions = xml_by_label[element.label]
+        cursor = label_cursor.get(element.label, 0)
+        while cursor < len(positions) and positions[cursor] <= anchors[-1][1]:
+            cursor += 1
+        if cursor < len(positions):
+            matched[ops_position] = (positions[cursor], 'label')
+            anchors.append((ops_position, positions[cursor]))
+            cursor += 1
+        label_cursor[element.label] = cursor
+    anchors.append((len(ops_elements), len(xml_elements)))
+
+    # Pass 2: between consecutive anchors, pair each kind's elements in order
+    for (ops_start, xml_start), (ops_end, xml_end) in zip(anchors, anchors[1:]):
+        xml_window = {}
+        for xml_position in range(xml_start + 1, xml_end):
+            element = xml_elements[xml_position]
+            if element.kind in SEQUENCE_KINDS:
+                xml_window.setdefault(element.kind, []).append(xml_position)
+        taken = {}
+        for ops_position in range(ops_start + 1, ops_end):
+            element = ops_elements[ops_position]
+            candidates = xml_window.get(element.kind)
+            if element.reference or not candidates:
+                continue
+            index = taken.get(element.kind, 0)
+            if index < len(candidates):
+                matched[ops_position] = (candidates[index], 'sequence')
+                taken[element.kind] = index + 1
+
+    # XML section around each position, for what is left over
+    enclosing = []
+    section_id = chapter_id
+    for element in xml_elements:
+        if element.kind == 'section':
+            section_id = element.id
+        enclosing.append(section_id)
+
+    # Pass 3: label references and fallbacks, in document order
+    labels = chapter_labels(xml_elements)
+    fragments = {}
+    fallback = chapter_id
+    for ops_position, element in enumerate(ops_elements):
+        if ops_position in matched:
+            xml_position, method = matched[ops_position]
+            fragments[element.id] = (xml_elements[xml_position].id, method)
+            fallback = enclosing[xml_position]
+        elif element.reference and element.label in labels:
+            fragments[element.id] = (labels[element.label], 'label')
+        else:
+            fragments[element.id] = (fallback, 'enclosing')
+    return fragments
+
+class FragmentTable:
+    """OPS id (file or file#fragment) -> XML id translation for a book; resolve() looks a link up"""
+
+    def __init__(self):
+        self.entries = {}  # 'ops id' or 'ops id#fragment' -> (XML id, method)
+        self.labels = {}   # ops id -> {numbered label: XML id} of its chapter
+        self._bare = {}    # fragment -> XML id, None when the fragment id occurs in several files
+
+    def add_document(self, ops_id, chapter_id, fragments, labels=None):
+        self.entries[ops_id] = (chapter_id, 'file')
+        self.labels[ops_id] = labels or {}
+        for fragment, entry in fragments.items():
+            self.entries[f"{ops_id}#{fragment}"] = entry
+            if fragment in self._bare and self._bare[fragment] != entry[0]:
+                self._bare[fragment] = None
+            else:
+                self._bare.setdefault(fragment, entry[0])
+
+    def resolve(self, linkend, text=''):
+        """
+        XML id for a linkend: an OPS file id (narrowed to a table/appendix named in the
+        link text), 'file#fragment', or a bare fragment id unique in the book; else None
+        """
+        if linkend in self.labels:
+            file_labels = self.labels[linkend]
+            for label in numbered_labels(text):
+                if label in file_labels:
+                    return file_labels[label]
+            return self.entries[linkend][0]
+        entry = self.entries.get(linkend)
+        if entry:
+            return entry[0]
+        return self._bare.get(linkend)
+
+    def methods(self):
+        """method -> number of entries resolved that way"""
+        counts = {}
+        for _target, method in self.entries.values():
+            counts[method] = counts.get(method, 0) + 1
+        return counts
+
+    def __len__(self):
+        return len(self.entries)
+
+def sect1_file_elements(name, content):
+    """scan_files() extract function: the elements of a sect1 file (None for other files)"""
+    return extract_xml_elements(content) if SECT1_FILE_PATTERN.match(name) else None
+
+def group_chapter_elements(scan_results, isbn):
+    """chapter id -> its elements, from scan results made with extract=sect1_file_elements"""
+    elements = {}
+    for result in sorted(scan_results, key=lambda result: result['name']):
+        name_match = SECT1_FILE_PATTERN.match(result['name'])
+        if name_match and name_match.group(1) == isbn:
+            elements.setdefault(name_match.group(2), []).extend(result['extracted'])
+    return elements
+
+def build_fragment_table(ops, chapter_mapping, chapter_elements, workers=DEFAULT_IO_WORKERS):
+    """
+    Align every mapped OPS document with its XML chapter. chapter_mapping is ops id -> XML
+    chapter id, and chapter_elements maps XML chapter id -> the elements of its sect1 files.
+    """
+    ops_ids = [ops_id for ops_id in sorted(chapter_mapping) if ops.exists(f"{ops_id}.xhtml")]
+    contents = ops.read_texts([f"{ops_id}.xhtml" for ops_id in ops_ids], workers)
+
+    table = FragmentTable()
+    xml_cache = {}  # chapter id -> (elements, labels); several OPS files can share a chapter
+    for ops_id, content in zip(ops_ids, contents):
+        chapter_id = chapter_mapping[ops_id]
+        if chapter_id not in xml_cache:
+            xml_elements = chapter_elements.get(chapter_id, [])
+            xml_cache[chapter_id] = (xml_elements, chapter_labels(xml_elements))
+        xml_elements, labels = xml_cache[chapter_id]
+        fragments = align_fragments(extract_ops_elements(content), xml_elements, chapter_id)
+        table.add_document(ops_id, chapter_id, fragments, labels)
+    return table
+
+def load_chapter_elements(xml_dir, isbn, workers=None):
+    """chapter id -> elements for build_fragment_table, from one scan of the sect1 files on disk"""
+    scan = scan_directory(xml_dir, f'sect1.{isbn}.*.xml', workers, extract=sect1_file_elements, fields=())
+    return group_chapter_elements(scan['files'], isbn)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the fragment-level OPS -> XML id translation table")
+    parser.add_argument('--xml-dir', default='/workspace/extracted_final')
+    parser.add_argument('--ops', help="OPS.zip or extracted OPS directory (default: found next to the XML)")
+    parser.add_argument('--json', help="write the table ({ops id[#fragment]: [XML id, method]}) to this file")
+    args = parser.parse_args(argv)
+
+    isbn = book_isbn(find_book(args.xml_dir))
+    ops_location = args.ops or find_ops_location(args.xml_dir, isbn) or DEFAULT_OPS_LOCATION
+    # Global alignment, with the hand-verified chapter mapping merged over it
+    chapter_mapping = build_global_mapping(ops_location, args.xml_dir, isbn)
+    chapter_mapping.update(manual_mappings(isbn, 'chapter'))
+
+    table = build_fragment_table(
+        open_ops_source(ops_location), chapter_mapping, load_chapter_elements(args.xml_dir, isbn)
+    )
+
+    print("=" * 80)
+    print("FRAGMENT TRANSLATION TABLE")
+    print("=" * 80)
+    print(f"  OPS documents: {len(table.labels)}")
+    print(f"  Entries: {len(table)}")
+    for method, count in sorted(table.methods().items()):
+        print(f"    {method}: {count}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({key: list(entry) for key, entry in table.entries.items()}, f, indent=2, sort_keys=True)
+        print(f"  Written to {args.json}")
+
+if __name__ == '__main__':
+    main()
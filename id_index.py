@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Persistent ID index for an extracted XML directory.
+Stores id -> (file, element tag, byte offset) in a SQLite file next to the XML files
+and only re-reads files whose mtime or size changed since the last refresh.
+"""
+
+import sqlite3
+from pathlib import Path
+
+import metrics
+from scanner import scan_files
+
+INDEX_FILENAME = '.id_index.sqlite'
+MEMORY_INDEX = ':memory:'
+SCHEMA_VERSION = 2  # 2: single-quoted ids and xml:id are indexed
+
+class IdIndex:
+    """On-disk id -> (file, tag, offset) index with incremental refresh"""
+
+    def __init__(self, directory, pattern='*.xml', index_path=None, workers=None):
+        self.directory = Path(directory)
+        self.pattern = pattern
+        self.workers = workers
+        self.index_path = Path(index_path) if index_path else self.directory / INDEX_FILENAME
+        self.conn = sqlite3.connect(str(self.index_path))
+        self._ensure_schema()
+
+    def _ensure_schema(self):
+        """Create the tables, dropping an index written by an older schema"""
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.conn.executescript("""
+                DROP TABLE IF EXISTS files;
+                DROP TABLE IF EXISTS ids;
+            """)
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS files (
+                name TEXT PRIMARY KEY,
+                mtime_ns INTEGER NOT NULL,
+                size INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS ids (
+                id TEXT NOT NULL,
+                file TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                offset INTEGER NOT NULL,
+                PRIMARY KEY (id, file, offset)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS ids_by_file ON ids (file);
+            PRAGMA user_version = {SCHEMA_VERSION};
+        """)
+        self.conn.commit()
+
+    @metrics.timed('id_index.refresh')
+    def refresh(self, preloaded=None, scan_cache=None, extract=None, fields=('ids',)):
+        """
+        Re-index new or changed files and drop deleted ones; return files re-indexed.
+        preloaded and scan_cache let callers supply bytes or scan results they already have.
+        Only ids are extracted unless fields (which must include 'ids') asks for more, to fill a
+        shared scan_cache; extract and fields are passed on to scan_files() for the files read.
+        """
+        known = {
+            name: (mtime_ns, size)
+            for name, mtime_ns, size in self.conn.execute('SELECT name, mtime_ns, size FROM files')
+        }
+
+        changed = []
+        seen = set()
+        for path in sorted(self.directory.glob(self.pattern)):
+            stat = path.stat()
+            seen.add(path.name)
+            if known.get(path.name) != (stat.st_mtime_ns, stat.st_size):
+                changed.append((path, stat))
+
+        removed = [name for name in known if name not in seen]
+        results = scan_files(
+            [path for path, _stat in changed], self.workers, preloaded=preloaded, cache=scan_cache,
+            extract=extract, fields=fields,
+        )
+
+        with self.conn:
+            for name in removed:
+                self.conn.execute('DELETE FROM ids WHERE file = ?', (name,))
+                self.conn.execute('DELETE FROM files WHERE name = ?', (name,))
+
+            for (path, stat), result in zip(changed, results):
+                self.conn.execute('DELETE FROM ids WHERE file = ?', (path.name,))
+                self.conn.executemany(
+                    'INSERT OR IGNORE INTO ids (id, file, tag, offset) VALUES (?, ?, ?, ?)',
+                    [(id_val, path.name, tag, offset) for id_val, tag, offset in result['ids']]
+                )
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO files (name, mtime_ns, size) VALUES (?, ?, ?)',
+                    (path.name, stat.st_mtime_ns, stat.st_size)
+                )
+
+        return len(changed)
+
+    def __contains__(self, id_val):
+        row = self.conn.execute('SELECT 1 FROM ids WHERE id = ? LIMIT 1', (id_val,)).fetchone()
+        return row is not None
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(DISTINCT id) FROM ids').fetchone()[0]
+
+    def ids(self):
+        """Return the set of every id defined anywhere in the directory"""
+        return {id_val for (id_val,) in self.conn.execute('SELECT DISTINCT id FROM ids')}
+
+    def lookup(self, id_val):
+        """Return [(file path, tag, byte offset), ...] for every definition of id_val"""
+        rows = self.conn.execute(
+            'SELECT file, tag, offset FROM ids WHERE id = ? ORDER BY file, offset', (id_val,)
+        )
+        return [(str(self.directory / name), tag, offset) for name, tag, offset in rows]
+
+    def id_files(self):
+        """Return {id: [file path, ...]} for the whole directory"""
+        all_ids = {}
+        for id_val, name in self.conn.execute('SELECT id, file FROM ids ORDER BY file, offset'):
+            files = all_ids.setdefault(id_val, [])
+            path = str(self.directory / name)
+            if path not in files:
+                files.append(path)
+        return all_ids
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def load_id_index(directory, pattern='*.xml', workers=None, preloaded=None, scan_cache=None, extract=None,
+                  index_path=None, fields=('ids',)):
+    """
+    Open the persistent ID index for directory and bring it up to date.
+    Pass index_path=MEMORY_INDEX for an index that is built from scratch and never written.
+    """
+    index = IdIndex(directory, pattern, index_path, workers)
+    index.refresh(preloaded, scan_cache, extract, fields)
+    return index
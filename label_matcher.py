@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Multi-pattern label matcher (Aho-Corasick) for link text -> table/appendix id resolution.
+All labels are compiled into one automaton, so a link text is resolved in a single
+pass regardless of how many labels exist, and "Table 2.1–1" never matches inside
+"Table 2.1–10".
+"""
+
+from collections import deque
+
+DASHES = ('–', '-')
+
+def canonical_label(label):
+    """Return the label spelled with en dashes, the form all its dash variants share"""
+    return label.replace('-', '–')
+
+def dash_variants(label):
+    """Return the label spelled with each dash variant (en dash and hyphen)"""
+    variants = {label}
+    for dash in DASHES:
+        for other in DASHES:
+            variants.add(label.replace(other, dash))
+    return variants
+
+class LabelMatcher:
+    """Aho-Corasick automaton mapping labels to ids; find() returns the longest exact label"""
+
+    def __init__(self, labels=None):
+        self._goto = [{}]
+        self._fail = [0]
+        self._own = [None]    # per node: (length, label, value) if a label ends exactly there
+        self._outputs = [[]]  # per node: own output plus those of its suffix chain, longest first
+        self._labels = {}     # canonical label -> value
+        self._built = False
+        if labels:
+            for label, value in labels.items():
+                self.add(label, value)
+            self.build()
+
+    def add(self, label, value):
+        """Add a label (and its dash variants); later additions win on identical labels"""
+        for variant in dash_variants(label):
+            node = 0
+            for char in variant:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._own.append(None)
+                    self._outputs.append([])
+                node = next_node
+            self._own[node] = (len(variant), label, value)
+        self._labels[canonical_label(label)] = value
+        self._built = False
+
+    def build(self):
+        """Compute failure links and merge suffix outputs (breadth-first)"""
+        queue = deque()
+        for node in self._goto[0].values():
+            self._fail[node] = 0
+            self._outputs[node] = [self._own[node]] if self._own[node] else []
+            queue.append(node)
+
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                own = [self._own[child]] if self._own[child] else []
+                self._outputs[child] = own + self._outputs[self._fail[child]]
+
+        self._built = True
+
+    def find(self, text):
+        """Return (label, value) for the longest label in text (leftmost on ties), or None"""
+        if not self._built:
+            self.build()
+
+        best = None
+        node = 0
+        for end, char in enumerate(text, 1):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+
+            for length, label, value in self._outputs[node]:
+                start = end - length
+                # Reject partial numbers: "Table 2.1–1" inside "Table 2.1–10"
+                if end < len(text) and text[end].isdigit() and label[-1].isdigit():
+                    continue
+                if start > 0 and text[start - 1].isalnum() and label[0].isalnum():
+                    continue
+                if best is None or length > best[0]:
+                    best = (length, label, value)
+                break  # outputs are longest-first; shorter ones here cannot win
+
+        return (best[1], best[2]) if best else None
+
+    def get(self, text, default=None):
+        """Return the id for the longest label in text, or default"""
+        match = self.find(text)
+        return match[1] if match else default
+
+    def __len__(self):
+        """Number of distinct labels; dash variants of one label count once"""
+        return len(self._labels)
+
+def as_label_matcher(labels):
+    """Return labels as a LabelMatcher, compiling a plain dict if needed"""
+    if isinstance(labels, LabelMatcher):
+        return labels
+    return LabelMatcher(labels)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Content-hash manifest for incremental pipeline runs.
+Records the hash of every pipeline input and output plus the fixes each file last
+received, so a re-run can skip files whose inputs and content are unchanged.
+Hashes are cached by (mtime_ns, size) and a file is only re-hashed when its stat changes.
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+
+MANIFEST_FILENAME = '.pipeline_manifest.json'
+MANIFEST_VERSION = 1
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+def hash_json(value):
+    """Stable hash of a JSON-serialisable value (e.g. a mapping table)"""
+    return hash_bytes(json.dumps(value, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+
+class Manifest:
+    """Input fingerprint, output hashes and per-file fixes from the last run"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.data = self._empty()
+        if self.path.exists():
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get('version') == MANIFEST_VERSION:
+                    self.data = data
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable manifest {self.path}: {e}")
+
+    @staticmethod
+    def _empty():
+        return {
+            'version': MANIFEST_VERSION,
+            'inputs': None,  # combined hash of everything that is not a tracked output
+            'outputs': {},   # output path -> content hash after the last run
+            'fixes': {},     # file name -> {stage: fixes produced by the last run that processed it}
+            'results': {},   # stage -> total fixes from the last run
+            'hashes': {},    # path -> {'mtime_ns', 'size', 'sha256'}
+        }
+
+    def file_hash(self, path, data=None):
+        """Content hash of a file; reuses the recorded hash while its stat is unchanged"""
+        key = os.path.abspath(path)
+        stat = os.stat(key)
+        entry = self.data['hashes'].get(key)
+        if data is None and entry and (entry['mtime_ns'], entry['size']) == (stat.st_mtime_ns, stat.st_size):
+            return entry['sha256']
+
+        if data is None:
+            with open(key, 'rb') as f:
+                data = f.read()
+        digest = hash_bytes(data)
+        self.data['hashes'][key] = {'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size, 'sha256': digest}
+        return digest
+
+    def unchanged_outputs(self, inputs, paths):
+        """Return the paths whose content still matches the last run, given the current input hash"""
+        if inputs != self.data['inputs']:
+            return set()
+        unchanged = set()
+        for path in paths:
+            recorded = self.data['outputs'].get(os.path.abspath(path))
+            if recorded and os.path.exists(path) and self.file_hash(path) == recorded:
+                unchanged.add(str(path))
+        return unchanged
+
+    def record(self, inputs, outputs, fixes, results):
+        """Store the state after a run; outputs maps path -> hash, fixes maps name -> {stage: n}"""
+        self.data['inputs'] = inputs
+        self.data['outputs'] = {os.path.abspath(path): digest for path, digest in outputs.items()}
+        self.data['fixes'].update(fixes)
+        self.data['results'] = results
+
+    def save(self):
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.data, f, indent=1, sort_keys=True, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
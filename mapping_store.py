@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+Versioned on-disk store for OPS -> XML chapter mappings and table label mappings.
+One SQLite file per XML directory holds, per book (ISBN) and kind ('chapter' or
+'table'), every mapping with its provenance, confidence and the hash of the inputs
+it was derived from; each change bumps the book's version. Provenances are 'auto'
+(the pipeline's alignment and table scan), 'content' (correct_mapping.py's content
+signatures) and 'manual'; each producer owns its own slot.
+Manual overrides live in mappings/<isbn>.jsonl (one {"kind", "source", "target"}
+object per line) and are merged in whenever that file changes; manual entries
+win over auto ones.
+
+Usage:
+    python mapping_store.py [--xml-dir DIR] show [--kind chapter|table]
+    python mapping_store.py [--xml-dir DIR] export FILE.jsonl
+"""
+
+import argparse
+import json
+import sqlite3
+from pathlib import Path
+
+from books import book_isbn, find_book
+from manifest import hash_bytes
+
+STORE_FILENAME = '.mapping_store.sqlite'
+SCHEMA_VERSION = 1
+KINDS = ('chapter', 'table')
+PROVENANCES = ('auto', 'content', 'manual')  # later entries win when merging
+
+MANUAL_MAPPING_DIR = Path(__file__).resolve().parent / 'mappings'
+
+_MANUAL_CACHE = {}  # path -> ((mtime_ns, size) or None if missing, {kind: {source: target}})
+
+def manual_mapping_path(isbn):
+    return MANUAL_MAPPING_DIR / f'{isbn}.jsonl'
+
+def read_mapping_file(path):
+    """Return [{'kind', 'source', 'target', ...}, ...] from a JSON Lines mapping file (empty if missing)"""
+    path = Path(path)
+    if not path.exists():
+        return []
+    entries = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            entry = json.loads(line)
+            if entry.get('kind') not in KINDS or not entry.get('source') or not entry.get('target'):
+                raise ValueError(f"{path}:{line_number}: expected kind ({'/'.join(KINDS)}), source and target")
+            entries.append(entry)
+    return entries
+
+def manual_mappings(isbn, kind):
+    """
+    source -> target for one kind of a book's manual overrides, in file order (a new dict
+    on each call); the file is parsed again only when its mtime or size changes
+    """
+    path = manual_mapping_path(isbn)
+    try:
+        stat = path.stat()
+        key = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        key = None
+    cached = _MANUAL_CACHE.get(path)
+    if cached is None or cached[0] != key:
+        by_kind = {name: {} for name in KINDS}
+        for entry in read_mapping_file(path):
+            by_kind[entry['kind']][entry['source']] = entry['target']
+        cached = _MANUAL_CACHE[path] = (key, by_kind)
+    return dict(cached[1][kind])
+
+class MappingStore:
+    """SQLite mapping store keyed by (isbn, kind, source, provenance)"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.conn = sqlite3.connect(str(self.path))
+        self._ensure_schema()
+
+    def _ensure_schema(self):
+        """Create the tables, dropping a store written by an older schema"""
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.conn.executescript("""
+                DROP TABLE IF EXISTS books;
+                DROP TABLE IF EXISTS mappings;
+                DROP TABLE IF EXISTS inputs;
+            """)
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS books (
+                isbn TEXT PRIMARY KEY,
+                version INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS mappings (
+                isbn TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                source TEXT NOT NULL,
+                provenance TEXT NOT NULL,
+                target TEXT NOT NULL,
+                confidence REAL,
+                position INTEGER NOT NULL,
+                PRIMARY KEY (isbn, kind, source, provenance)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS inputs (
+                isbn TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                provenance TEXT NOT NULL,
+                hash TEXT,
+                PRIMARY KEY (isbn, kind, provenance)
+            ) WITHOUT ROWID;
+            PRAGMA user_version = {SCHEMA_VERSION};
+        """)
+        self.conn.commit()
+
+    def version(self, isbn):
+        """Number of changes recorded for a book (0 if it has never been stored)"""
+        row = self.conn.execute('SELECT version FROM books WHERE isbn = ?', (isbn,)).fetchone()
+        return row[0] if row else 0
+
+    def inputs(self, isbn, kind, provenance='auto'):
+        """Hash of the inputs the stored entries were derived from, or None"""
+        row = self.conn.execute(
+            'SELECT hash FROM inputs WHERE isbn = ? AND kind = ? AND provenance = ?', (isbn, kind, provenance)
+        ).fetchone()
+        return row[0] if row else None
+
+    def replace(self, isbn, kind, provenance, entries, inputs=None):
+        """
+        Replace every (isbn, kind, provenance) entry; entries maps source -> target or
+        source -> (target, confidence). Returns True when anything changed.
+        """
+        rows = []
+        for position, (source, value) in enumerate(entries.items()):
+            target, confidence = value if isinstance(value, tuple) else (value, None)
+            rows.append((isbn, kind, source, provenance, target, confidence, position))
+
+        current = self.conn.execute(
+            'SELECT isbn, kind, source, provenance, target, confidence, position FROM mappings '
+            'WHERE isbn = ? AND kind = ? AND provenance = ? ORDER BY position', (isbn, kind, provenance)
+        ).fetchall()
+        if current == rows and self.inputs(isbn, kind, provenance) == inputs:
+            return False
+
+        with self.conn:
+            self.conn.execute(
+                'DELETE FROM mappings WHERE isbn = ? AND kind = ? AND provenance = ?', (isbn, kind, provenance)
+            )
+            self.conn.executemany('INSERT INTO mappings VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+            self.conn.execute('INSERT OR REPLACE INTO inputs VALUES (?, ?, ?, ?)', (isbn, kind, provenance, inputs))
+            self.conn.execute(
+                'INSERT INTO books (isbn, version) VALUES (?, 1) '
+                'ON CONFLICT (isbn) DO UPDATE SET version = version + 1', (isbn,)
+            )
+        return True
+
+    def entries(self, isbn, kind=None):
+        """Every stored entry of a book as dicts, in kind, provenance and insertion order"""
+        query = 'SELECT kind, source, target, provenance, confidence FROM mappings WHERE isbn = ?'
+        params = [isbn]
+        if kind:
+            query += ' AND kind = ?'
+            params.append(kind)
+        rows = self.conn.execute(query + ' ORDER BY kind, provenance, position', params)
+        return [
+            {'kind': kind, 'source': source, 'target': target, 'provenance': provenance, 'confidence': confidence}
+            for kind, source, target, provenance, confidence in rows
+        ]
+
+    def mapping(self, isbn, kind, provenances=PROVENANCES):
+        """source -> target for one kind; manual entries win over auto ones"""
+        merged = {}
+        for provenance in provenances:
+            rows = self.conn.execute(
+                'SELECT source, target FROM mappings WHERE isbn = ? AND kind = ? AND provenance = ? ORDER BY position',
+                (isbn, kind, provenance),
+            )
+            merged.update(rows)
+        return merged
+
+    def import_entries(self, isbn, entries, provenance='manual', inputs=None):
+        """Replace a book's entries of this provenance with read_mapping_file() entries; return kinds changed"""
+        changed = []
+        for kind in KINDS:
+            kind_entries = {
+                entry['source']: (entry['target'], entry.get('confidence'))
+                for entry in entries if entry['kind'] == kind
+            }
+            if self.replace(isbn, kind, provenance, kind_entries, inputs):
+                changed.append(kind)
+        return changed
+
+    def sync_manual(self, isbn):
+        """Merge in mappings/<isbn>.jsonl if it changed since it was last imported"""
+        path = manual_mapping_path(isbn)
+        data = path.read_bytes() if path.exists() else b''
+        file_hash = hash_bytes(data)
+        if all(self.inputs(isbn, kind, 'manual') == file_hash for kind in KINDS):
+            return []
+        return self.import_entries(isbn, read_mapping_file(path), 'manual', file_hash)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_mapping_store(directory, isbn=None):
+    """Open the mapping store of an XML directory, merging in the book's manual overrides"""
+    store = MappingStore(Path(directory) / STORE_FILENAME)
+    if isbn:
+        store.sync_manual(isbn)
+    return store
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and edit the OPS/table mapping store")
+    parser.add_argument('--xml-dir', default='/workspace/extracted_final')
+    commands = parser.add_subparsers(dest='command', required=True)
+    show = commands.add_parser('show', help="print the book's stored mappings")
+    show.add_argument('--kind', choices=KINDS)
+    export = commands.add_parser('export', help="write the stored mappings as JSON Lines")
+    export.add_argument('file')
+    args = parser.parse_args(argv)
+
+    isbn = book_isbn(find_book(args.xml_dir))
+    with open_mapping_store(args.xml_dir, isbn) as store:
+        if args.command == 'show':
+            print("=" * 80)
+            print(f"MAPPING STORE: {isbn} (version {store.version(isbn)})")
+            print("=" * 80)
+            for entry in store.entries(isbn, args.kind):
+                confidence = '' if entry['confidence'] is None else f", confidence {entry['confidence']:.2f}"
+                print(f"  [{entry['kind']}] {entry['source']} → {entry['target']} ({entry['provenance']}{confidence})")
+        else:
+            entries = store.entries(isbn)
+            with open(args.file, 'w', encoding='utf-8') as f:
+                for entry in entries:
+                    f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            print(f"Exported {len(entries)} mappings for {isbn} to {args.file}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Lightweight instrumentation: named timers and counters, dumped as JSON.
+Disabled by default; while disabled every hook returns after a single flag check,
+so instrumented code runs at full speed unless --metrics is given.
+"""
+
+import functools
+import json
+import threading
+import time
+
+_enabled = False
+_timers = {}    # name -> [calls, seconds]
+_counters = {}  # name -> total
+_lock = threading.Lock()  # hooks may be called from I/O threads
+_started = None  # perf_counter() at start(), for the run's total time
+
+def enable():
+    global _enabled
+    _enabled = True
+
+def disable():
+    global _enabled
+    _enabled = False
+
+def is_enabled():
+    return _enabled
+
+def reset():
+    _timers.clear()
+    _counters.clear()
+
+def add_time(name, seconds):
+    with _lock:
+        entry = _timers.get(name)
+        if entry is None:
+            entry = _timers[name] = [0, 0.0]
+        entry[0] += 1
+        entry[1] += seconds
+
+def count(name, value=1):
+    """Add value to a named counter"""
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + value
+
+def _size(data):
+    if isinstance(data, int):
+        return data
+    return len(data) if isinstance(data, bytes) else len(data.encode('utf-8'))
+
+def record_read(data):
+    """Count one file read; data is bytes, text (counted as UTF-8) or a byte count"""
+    if _enabled:
+        count('io.files_read')
+        count('io.bytes_read', _size(data))
+
+def record_write(data):
+    """Count one file write; data is bytes, text (counted as UTF-8) or a byte count"""
+    if _enabled:
+        count('io.files_written')
+        count('io.bytes_written', _size(data))
+
+class Timer:
+    """Context manager adding the wall time of its block to a named timer"""
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        if _enabled:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.start is not None:
+            add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+def timed(name):
+    """Decorator timing every call of a function under name"""
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add_time(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+def start(path):
+    """Enable metrics for a script run with --metrics PATH (nothing to do without a path)"""
+    global _started
+    if path:
+        enable()
+        _started = time.perf_counter()
+
+def finish(path, name='total'):
+    """Record the run's total time under name and write the metrics to path (if given)"""
+    if not path:
+        return
+    if _started is not None:
+        add_time(name, time.perf_counter() - _started)
+    dump(path)
+    print(f"Metrics written to {path}")
+
+def add_argument(parser):
+    """Add the --metrics option shared by the command-line scripts"""
+    parser.add_argument('--metrics', help="write timings, call counts and I/O counters to this JSON file")
+
+def snapshot():
+    """Current timers and counters as a JSON-serialisable dict"""
+    return {
+        'timers': {
+            name: {'calls': calls, 'seconds': round(seconds, 6)}
+            for name, (calls, seconds) in sorted(_timers.items())
+        },
+        'counters': dict(sorted(_counters.items())),
+    }
+
+def dump(path):
+    """Write the current metrics to a JSON file"""
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot(), f, indent=2)
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+"""
+Read-only access to OPS XHTML content, either from an extracted OPS directory
+or straight from OPS.zip without unpacking it.
+For zips, the member index is built once and only the requested members (and
+only the requested prefix of each) are decompressed.
+"""
+
+import fnmatch
+import io
+import posixpath
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import metrics
+
+DEFAULT_OPS_LOCATION = '/workspace/OPS.zip'
+DEFAULT_IO_WORKERS = 16     # concurrent reads; latency-bound on network storage
+PREFIX_CHUNK_SIZE = 1024    # first read of an adaptive prefix; doubled until done
+
+class OpsSource:
+    """OPS content addressed by file name relative to the OPS root"""
+
+    def __init__(self, location, cache=False):
+        self.location = str(location)
+        self.is_zip = zipfile.is_zipfile(self.location)
+        self._zip = zipfile.ZipFile(self.location) if self.is_zip else None
+        self._members = None
+        self._root = ''
+        # With cache=True, text already read is kept: name -> (text, is_complete)
+        self._text_cache = {} if cache else None
+
+    @property
+    def members(self):
+        """name -> ZipInfo for every member under the OPS root (zip sources only)"""
+        if self._members is None:
+            infos = self._zip.infolist()
+            self._root = self._find_root([info.filename for info in infos])
+            self._members = {
+                info.filename[len(self._root):]: info
+                for info in infos
+                if info.filename.startswith(self._root) and not info.is_dir()
+            }
+        return self._members
+
+    @property
+    def root(self):
+        """Path prefix of the OPS root inside the zip ('' for directories)"""
+        if self.is_zip:
+            self.members
+        return self._root
+
+    def _find_root(self, names):
+        """Locate the OPS root inside the zip: the OPF directory, else OPS/, else the top level"""
+        if 'META-INF/container.xml' in names:
+            container = self._zip.read('META-INF/container.xml').decode('utf-8')
+            opf_match = re.search(r'full-path="([^"]+)"', container)
+            if opf_match:
+                opf_dir = posixpath.dirname(opf_match.group(1))
+                return f"{opf_dir}/" if opf_dir else ''
+        if any(name.startswith('OPS/') for name in names):
+            return 'OPS/'
+        return ''
+
+    def glob(self, pattern):
+        """Return sorted file names in the OPS root matching a glob pattern"""
+        if self.is_zip:
+            return sorted(name for name in self.members if '/' not in name and fnmatch.fnmatch(name, pattern))
+        return sorted(path.name for path in Path(self.location).glob(pattern))
+
+    def exists(self, name):
+        if self.is_zip:
+            return name in self.members
+        return (Path(self.location) / name).is_file()
+
+    def path(self, name):
+        """Human-readable location of a file, for reports"""
+        if self.is_zip:
+            return f"{self.location}/{self.members[name].filename}"
+        return str(Path(self.location) / name)
+
+    def _cached(self, name, limit=None, done=None):
+        """The cached text of a file if it covers the request (see read_prefix), else None"""
+        if self._text_cache is None or name not in self._text_cache:
+            return None
+        text, complete = self._text_cache[name]
+        if complete or (limit is not None and (len(text) >= limit or (done is not None and done(text)))):
+            metrics.count('ops.cache_hits')
+            return text if limit is None else text[:limit]
+        return None
+
+    def _remember(self, name, text, complete):
+        """Keep the longest text read so far for a file (the whole text once its end was reached)"""
+        if self._text_cache is None:
+            return
+        cached = self._text_cache.get(name)
+        if cached is None or complete or (not cached[1] and len(text) > len(cached[0])):
+            self._text_cache[name] = (text, complete)
+
+    def read_text(self, name, limit=None):
+        """Read a file as text; with limit, read (and decompress) only the first limit characters"""
+        cached = self._cached(name, limit)
+        if cached is not None:
+            return cached
+
+        size = -1 if limit is None else limit
+        if self.is_zip:
+            with self._zip.open(self.members[name]) as raw:
+                text = io.TextIOWrapper(raw, encoding='utf-8').read(size)
+        else:
+            with open(Path(self.location) / name, 'r', encoding='utf-8') as f:
+                text = f.read(size)
+        metrics.record_read(text)
+        self._remember(name, text, limit is None or len(text) < limit)
+        return text
+
+    def read_prefix(self, name, done, limit):
+        """
+        Read at most limit characters, stopping as soon as done(text) is true for the text so far.
+        Chunks start at PREFIX_CHUNK_SIZE and double, so most files need one or two small reads.
+        """
+        cached = self._cached(name, limit, done)
+        if cached is not None:
+            return cached
+
+        if self.is_zip:
+            f = io.TextIOWrapper(self._zip.open(self.members[name]), encoding='utf-8')
+        else:
+            f = open(Path(self.location) / name, 'r', encoding='utf-8')
+        with f:
+            pieces = []
+            length = 0
+            chunk_size = PREFIX_CHUNK_SIZE
+            complete = False
+            while length < limit:
+                wanted = min(chunk_size, limit - length)
+                chunk = f.read(wanted)
+                pieces.append(chunk)
+                length += len(chunk)
+                chunk_size *= 2
+                if len(chunk) < wanted:
+                    complete = True  # a short read is the end of the file
+                    break
+                if done(''.join(pieces)):
+                    break
+            text = ''.join(pieces)
+        metrics.record_read(text)
+        self._remember(name, text, complete)
+        return text
+
+    def read_prefixes(self, names, done, limit, workers=DEFAULT_IO_WORKERS):
+        """read_prefix() for many files on a thread pool; texts are returned in the order of names"""
+        return self._read_many(
+            names, lambda name: self._cached(name, limit, done), lambda name: self.read_prefix(name, done, limit),
+            workers,
+        )
+
+    def read_texts(self, names, workers=DEFAULT_IO_WORKERS):
+        """read_text() of whole files on a thread pool; texts are returned in the order of names"""
+        return self._read_many(names, self._cached, self.read_text, workers)
+
+    def _read_many(self, names, cached, read, workers):
+        """read(name) for every name; files the cache already covers are answered without the pool"""
+        names = list(names)
+        texts = {}
+        uncached = []
+        for name in dict.fromkeys(names):
+            text = cached(name)
+            if text is None:
+                uncached.append(name)
+            else:
+                texts[name] = text
+        if workers is None or workers <= 1 or len(uncached) <= 1:
+            texts.update((name, read(name)) for name in uncached)
+        else:
+            with ThreadPoolExecutor(max_workers=min(workers, len(uncached))) as executor:
+                texts.update(zip(uncached, executor.map(read, uncached)))
+        return [texts[name] for name in names]
+
+    def close(self):
+        if self._zip:
+            self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_ops_source(location=DEFAULT_OPS_LOCATION, cache=False):
+    """Return an OpsSource for a directory or zip path (an OpsSource is returned unchanged)"""
+    if isinstance(location, OpsSource):
+        return location
+    return OpsSource(location, cache)
@@ -0,0 +1,548 @@
+#!/usr/bin/env python3
+"""
+Unified link-fixing pipeline for one book (see batch.py for many books).
+Runs the entity, link-fixing and mapping stages in a single process over a shared
+in-memory model: book.xml, the part-level sect1 files and the OPS content are each
+read at most once, and every changed file is written once at the end of the run.
+
+Usage:
+    python pipeline.py [--xml-dir DIR] [--ops OPS.zip] [--stages entities,broken,...]
+"""
+
+import argparse
+import hashlib
+from pathlib import Path
+
+from apply_correct_mapping_final import fix_content_with_mapping
+from apply_correct_mappings import fix_content_with_mappings
+from book_index import load_book_index
+from books import book_isbn, existing_part_files, find_book, find_ops_location
+from chapter_alignment import MODES as ALIGNMENT_MODES, align_book_chapters, load_ops_signatures
+from comprehensive_link_fixer import build_comprehensive_mapping, fix_part_level_sect1_content
+from fix_broken_links import LINK_PATTERN, fix_broken_links_in_content
+from fix_xml_references import (
+    analyze_part_links,
+    transform_part_entities,
+)
+from fragment_alignment import build_fragment_table, group_chapter_elements, sect1_file_elements
+from id_index import MEMORY_INDEX, load_id_index
+from label_matcher import LabelMatcher
+import metrics
+from manifest import MANIFEST_FILENAME, Manifest, hash_bytes, hash_json
+from rewrite import splice
+from mapping_store import manual_mappings, open_mapping_store
+from ops_source import DEFAULT_OPS_LOCATION, open_ops_source
+from resolution_cache import DEFAULT_MAX_ENTRIES, ResolutionCache, open_resolution_cache
+from scanner import ALL_FIELDS, build_chapter_ordinals, scan_directory
+from section_trie import load_section_trie
+
+DEFAULT_XML_DIR = '/workspace/extracted_final'
+
+# Default order follows the original workflow: entity setup, initial chapter-number
+# fixes, XHTML mapping fixes, table mappings, verified OPS mapping, final report;
+# links into OPS fragments are looked up first; whole-file links keep the chapter-level order
+STAGES = ['entities', 'fragments', 'broken', 'comprehensive', 'tables', 'mapping', 'report']
+
+class PipelineContext:
+    """Shared state for one pipeline run; every file is read lazily, at most once"""
+
+    def __init__(self, xml_dir, ops_location=None, workers=None, isbn=None, auto_mapping=False,
+                 alignment='global', resolution_cache_size=DEFAULT_MAX_ENTRIES, persist_resolutions=False,
+                 dry_run=False, fragments=False):
+        self.xml_dir = Path(xml_dir)
+        self.book_path = self.xml_dir / f'book.{isbn}.xml' if isbn else find_book(self.xml_dir)
+        self.isbn = book_isbn(self.book_path)
+        self.ops_location = (
+            ops_location or find_ops_location(self.xml_dir, self.isbn) or DEFAULT_OPS_LOCATION
+        )
+        self.workers = workers
+        self.auto_mapping = auto_mapping  # align OPS -> XML chapters even when a manual mapping exists
+        self.alignment = alignment        # chapter alignment mode: 'global' or 'banded' (spine order)
+        self.resolution_cache_size = resolution_cache_size
+        self.persist_resolutions = persist_resolutions  # keep link resolutions on disk between runs
+        self.dry_run = dry_run  # nothing is written: no files, no stored mappings
+        # The fragments stage runs: directory scans also collect sect1 elements, so no file is read twice
+        self.scan_extract = sect1_file_elements if fragments else None
+        self.raw = {}        # file name -> bytes as read from disk
+        self.contents = {}   # file name -> current (possibly modified) text
+        self.dirty = set()   # file names whose text changed
+        self.scan_cache = {} # file name -> scanner result, shared by the ID index and table scan
+        self.skipped = set() # part file names left untouched because nothing they depend on changed
+        self.fixes = {}      # file name -> {stage: fixes made in this run}
+        self._cache = {}
+
+    def read(self, name):
+        """Return the current text of a file in the XML directory, reading it on first use"""
+        if name not in self.contents:
+            path = self.xml_dir / name
+            if not path.exists():
+                return None
+            with open(path, 'rb') as f:
+                self.raw[name] = f.read()
+            metrics.record_read(self.raw[name])
+            self.contents[name] = self.raw[name].decode('utf-8')
+        return self.contents[name]
+
+    def update(self, name, content):
+        """Replace the in-memory text of a file; it is written at the end of the run"""
+        if content != self.contents.get(name):
+            self.contents[name] = content
+            self.dirty.add(name)
+
+    def record(self, name, stage, count):
+        self.fixes.setdefault(name, {})[stage] = count
+
+    def active_parts(self):
+        """(part id, file name) for every part file this run has to process"""
+        return [(part_id, name) for part_id, name in self.part_files.items() if name not in self.skipped]
+
+    def _cached(self, key, build):
+        if key not in self._cache:
+            self._cache[key] = build()
+        return self._cache[key]
+
+    @property
+    def book_name(self):
+        return self.book_path.name
+
+    @property
+    def part_files(self):
+        """part id -> part-level sect1 file name, for the book's parts that have one"""
+        def build():
+            return {
+                part_id: path.name
+                for part_id, path in existing_part_files(self.xml_dir, self.isbn, self.book_index.parts)
+            }
+        return self._cached('part_files', build)
+
+    @property
+    def book_index(self):
+        # Built from the bytes already read, and shared with load_book_index() callers
+        self.read(self.book_name)
+        return self._cached(
+            'book_index', lambda: load_book_index(self.book_path, self.raw[self.book_name])
+        )
+
+    @property
+    def ops(self):
+        return self._cached('ops', lambda: open_ops_source(self.ops_location, cache=True))
+
+    @property
+    def mapping_store(self):
+        return self._cached('mapping_store', lambda: open_mapping_store(self.xml_dir, self.isbn))
+
+    @property
+    def chapter_mapping(self):
+        """
+        OPS id -> XML chapter id: the manual mapping, or (when there is none, or with auto_mapping)
+        the stored global alignment with manual entries merged over it. The alignment is only
+        recomputed when book.xml or the OPS content changed since it was stored.
+        """
+        def build():
+            mapping = curated_mappings(self.isbn)[1]
+            if mapping and not self.auto_mapping:
+                return mapping
+            return self.aligned_chapter_mapping
+        return self._cached('chapter_mapping', build)
+
+    @property
+    def aligned_chapter_mapping(self):
+        """
+        The stored OPS -> XML chapter alignment with the manual mapping merged over it;
+        a dry run computes it without opening the store
+        """
+        def build():
+            self.read(self.book_name)
+            manifest = Manifest(self.xml_dir / MANIFEST_FILENAME)
+            sections = [result['sections'] for result in self.table_scan['files']]
+            inputs = hash_json([
+                'alignment', self.alignment, hash_bytes(self.raw[self.book_name]),
+                ops_fingerprint(self.ops, manifest), sections,
+            ])
+            store = None if self.dry_run else self.mapping_store
+            if store is None or store.inputs(self.isbn, 'chapter') != inputs:
+                alignment = align_book_chapters(
+                    self.ops, load_ops_signatures(self.ops, self.isbn), self.book_index, self.alignment,
+                    self.section_trie,
+                )
+                if store is None:
+                    mapping = {ops_id: entry['chapter'] for ops_id, entry in sorted(alignment.items())}
+                    mapping.update(curated_mappings(self.isbn)[1])
+                    return mapping
+                store.replace(self.isbn, 'chapter', 'auto', {
+                    ops_id: (entry['chapter'], entry['confidence']) for ops_id, entry in sorted(alignment.items())
+                }, inputs)
+            # Content-signature entries from correct_mapping.py are not covered by the inputs hash
+            return store.mapping(self.isbn, 'chapter', ('auto', 'manual'))
+        return self._cached('aligned_chapter_mapping', build)
+
+    @property
+    def fragment_table(self):
+        """Fragment-level OPS -> XML id translation for every aligned OPS document"""
+        def build():
+            # Whole OPS chapters are read before the alignment, which then takes its prefixes from them
+            self.ops.read_texts(self.ops.glob(f'{self.isbn}_v*_c*.xhtml'))
+            # Served from the shared scan when it already collected the elements
+            scan = scan_directory(
+                self.xml_dir, 'sect1.*.xml', self.workers, preloaded=self.raw, cache=self.scan_cache,
+                extract=sect1_file_elements,
+            )
+            chapters = group_chapter_elements(scan['files'], self.isbn)
+            return build_fragment_table(self.ops, self.aligned_chapter_mapping, chapters)
+        return self._cached('fragment_table', build)
+
+    @property
+    def all_ids(self):
+        def build():
+            for name in self.part_files.values():
+                self.read(name)
+            self.read(self.book_name)
+            return load_id_index(
+                self.xml_dir, workers=self.workers, preloaded=self.raw, scan_cache=self.scan_cache,
+                extract=self.scan_extract, index_path=MEMORY_INDEX if self.dry_run else None,
+                fields=ALL_FIELDS,  # the scans also serve table_scan, so no file is read twice
+            )
+        return self._cached('all_ids', build)
+
+    @property
+    def table_scan(self):
+        def build():
+            for name in self.part_files.values():
+                self.read(name)
+            return scan_directory(
+                self.xml_dir, 'sect1.*.xml', self.workers, preloaded=self.raw, cache=self.scan_cache,
+                extract=self.scan_extract,
+            )
+        return self._cached('table_scan', build)
+
+    @property
+    def chapter_ordinals(self):
+        """chapter id -> ordered table and appendix ids, from the shared directory scan"""
+        return self._cached(
+            'chapter_ordinals', lambda: build_chapter_ordinals(self.table_scan['files'], self.isbn)
+        )
+
+    @property
+    def section_trie(self):
+        """Chapter and numbered section titles by dotted number, from the shared directory scan"""
+        # Also primes the per-book cache used by the number lookups in the fixer modules
+        return self._cached(
+            'section_trie',
+            lambda: load_section_trie(self.xml_dir, self.isbn, self.book_index, self.table_scan['files'])
+        )
+
+    @property
+    def comprehensive_mapping(self):
+        """(chapter mapping, XHTML table mappings, XHTML mapping) from the OPS content"""
+        # Prime the shared book index and section trie so find_xml_chapter_by_number does not re-read them
+        self.section_trie
+        return self._cached(
+            'comprehensive_mapping',
+            lambda: build_comprehensive_mapping(self.ops, self.xml_dir, self.isbn)
+        )
+
+    @property
+    def resolutions(self):
+        """Link resolution cache shared by the broken and comprehensive stages (on disk when persistent)"""
+        def build():
+            if not self.persist_resolutions:
+                return ResolutionCache(self.resolution_cache_size)
+            inputs = resolution_inputs(self, Manifest(self.xml_dir / MANIFEST_FILENAME))
+            return open_resolution_cache(self.xml_dir, inputs, self.resolution_cache_size)
+        return self._cached('resolutions', build)
+
+    def close_resolutions(self):
+        """Save the resolution cache (if this run used it) and report its statistics"""
+        resolutions = self._cache.pop('resolutions', None)
+        if resolutions is None:
+            return
+        resolutions.close()
+        print(f"\nResolution cache: {resolutions.summary()}")
+
+    def write(self, book_output=None):
+        """Write every changed file once; the book goes to book_output if given"""
+        written = []
+        for name in sorted(self.dirty):
+            path = self.xml_dir / name
+            if name == self.book_name and book_output:
+                path = Path(book_output)
+            data = self.contents[name].encode('utf-8')
+            with open(path, 'wb') as f:
+                f.write(data)
+            metrics.record_write(data)
+            written.append(str(path))
+        return written
+
+def run_entities(ctx):
+    """Add part-level entity declarations and references to book.xml"""
+    content, declared, referenced = transform_part_entities(
+        ctx.read(ctx.book_name), ctx.isbn, list(ctx.part_files)
+    )
+    ctx.update(ctx.book_name, content)
+    ctx.record(ctx.book_name, 'entities', declared + referenced)
+    print(f"  Added {declared} entity declarations and {referenced} entity references")
+    return declared + referenced
+
+def run_fragments(ctx):
+    """Resolve broken links to OPS fragments (tables, sections, anchors) from the fragment translation table"""
+    # Links that are XML ids or whole OPS files do not need the table (nor the chapter alignment behind it)
+    if not any(
+        linkend not in ctx.all_ids and not ctx.ops.exists(f"{linkend}.xhtml")
+        for _part_id, name in ctx.active_parts()
+        for linkend, _text in LINK_PATTERN.findall(ctx.read(name))
+    ):
+        print("  No links into OPS fragments; skipped")
+        for _part_id, name in ctx.active_parts():
+            ctx.record(name, 'fragments', 0)
+        return 0
+
+    table = ctx.fragment_table
+    print(f"  {len(table)} entries for {len(table.labels)} OPS documents: {table.methods()}")
+
+    total = 0
+    for _part_id, name in ctx.active_parts():
+        content = ctx.read(name)
+        edits = []
+        for match in LINK_PATTERN.finditer(content):
+            # Whole-file ids are left to the chapter-level stages that follow
+            if match.group(1) in ctx.all_ids or match.group(1) in table.labels:
+                continue
+            new_linkend = table.resolve(match.group(1), match.group(2))
+            if new_linkend and new_linkend != match.group(1) and new_linkend in ctx.all_ids:
+                edits.append((match.span(1), new_linkend))
+        ctx.update(name, splice(content, edits))
+        ctx.record(name, 'fragments', len(edits))
+        total += len(edits)
+    return total
+
+def run_broken(ctx):
+    """Fix broken links from the chapter numbers in their link text"""
+    total = 0
+    for part_id, name in ctx.active_parts():
+        content, fixes = fix_broken_links_in_content(
+            ctx.read(name), name, part_id, ctx.book_index, ctx.xml_dir, ctx.all_ids, ctx.isbn,
+            ctx.chapter_ordinals, ctx.section_trie, ctx.resolutions,
+        )
+        ctx.update(name, content)
+        ctx.record(name, 'broken', len(fixes))
+        total += len(fixes)
+    return total
+
+def run_comprehensive(ctx):
+    """Fix links using the XHTML -> XML chapter mapping and XML table labels"""
+    chapter_mapping, _table_mappings, xhtml_mapping = ctx.comprehensive_mapping
+    table_matcher = LabelMatcher(ctx.table_scan['tables'])
+
+    total = 0
+    for _part_id, name in ctx.active_parts():
+        content, fixes = fix_part_level_sect1_content(
+            ctx.read(name), chapter_mapping, table_matcher, xhtml_mapping, ctx.xml_dir, ctx.isbn,
+            ctx.resolutions,
+        )
+        ctx.update(name, content)
+        ctx.record(name, 'comprehensive', len(fixes))
+        for fix in fixes:
+            print(f"  {name}: {fix['old']} → {fix['new']} ({fix['text']})")
+        total += len(fixes)
+    return total
+
+def run_tables(ctx):
+    """Apply the table label mappings"""
+    # Labels found in the document take precedence over the manual ones; they are stored as auto entries
+    if not ctx.dry_run:
+        ctx.mapping_store.replace(ctx.isbn, 'table', 'auto', ctx.table_scan['tables'])
+    mappings = curated_mappings(ctx.isbn)[0]
+    mappings.update(ctx.table_scan['tables'])
+    matcher = LabelMatcher(mappings)
+
+    total = 0
+    for _part_id, name in ctx.active_parts():
+        content, fixes = fix_content_with_mappings(ctx.read(name), matcher, ctx.isbn)
+        ctx.update(name, content)
+        ctx.record(name, 'tables', fixes)
+        if fixes:
+            print(f"  Fixed {fixes} links in {name}")
+        total += fixes
+    return total
+
+def run_mapping(ctx):
+    """Apply the OPS -> XML chapter mapping"""
+    mapping = ctx.chapter_mapping
+
+    total = 0
+    for _part_id, name in ctx.active_parts():
+        content, fixes = fix_content_with_mapping(ctx.read(name), mapping)
+        ctx.update(name, content)
+        ctx.record(name, 'mapping', fixes)
+        total += fixes
+    return total
+
+def run_report(ctx):
+    """Report part-level links that still point at OPS ids"""
+    def read_part(sect1_file):
+        return ctx.read(Path(sect1_file).name)
+
+    issues, fixes = analyze_part_links(
+        ctx.read(ctx.book_name), ctx.xml_dir, read_part, ctx.isbn, ctx.book_index.parts, ctx.book_index
+    )
+    for issue in issues:
+        print(issue)
+    print(f"  Remaining broken link instances: {len(fixes)}")
+    ctx.record(ctx.book_name, 'report', len(fixes))
+    return len(fixes)
+
+STAGE_FUNCTIONS = {
+    'entities': run_entities,
+    'fragments': run_fragments,
+    'broken': run_broken,
+    'comprehensive': run_comprehensive,
+    'tables': run_tables,
+    'mapping': run_mapping,
+    'report': run_report,
+}
+
+def curated_mappings(isbn):
+    """(table label mappings, OPS -> XML chapter mapping) verified by hand, from mappings/<isbn>.jsonl"""
+    return manual_mappings(isbn, 'table'), manual_mappings(isbn, 'chapter')
+
+def ops_fingerprint(ops, manifest):
+    """Content hash of the OPS source: member CRCs for a zip, file hashes for a directory"""
+    if ops.is_zip:
+        return hash_json(sorted((name, info.CRC, info.file_size) for name, info in ops.members.items()))
+    root = Path(ops.location)
+    return hash_json([
+        (path.relative_to(root).as_posix(), manifest.file_hash(path))
+        for path in sorted(root.rglob('*')) if path.is_file()
+    ])
+
+def input_fingerprint(ctx, manifest, stages):
+    """Hash of every input other than the part files: the other XML files, OPS, mapping tables, stages"""
+    digest = hashlib.sha256()
+    part_names = set(ctx.part_files.values())
+    for path in sorted(ctx.xml_dir.glob('*.xml')):
+        if path.name not in part_names:
+            digest.update(f"{path.name}\0{manifest.file_hash(path)}\n".encode('utf-8'))
+    digest.update(ops_fingerprint(ctx.ops, manifest).encode('utf-8'))
+    digest.update(hash_json([
+        curated_mappings(ctx.isbn), ctx.auto_mapping, ctx.alignment, sorted(stages)
+    ]).encode('utf-8'))
+    return digest.hexdigest()
+
+def resolution_inputs(ctx, manifest):
+    """
+    Hash of everything a link resolution depends on: the inputs other than the part files,
+    and the table labels of every scanned file (part files included)
+    """
+    return hash_json([
+        'resolutions', input_fingerprint(ctx, manifest, []), sorted(ctx.table_scan['tables'].items())
+    ])
+
+def run_pipeline(xml_dir, ops_location=None, stages=STAGES, book_output=None, dry_run=False, workers=None,
+                 incremental=True, auto_mapping=False, alignment='global',
+                 resolution_cache_size=DEFAULT_MAX_ENTRIES):
+    """
+    Run the selected stages in pipeline order; return {stage: count} and written files.
+    With incremental=True, part files are skipped when neither they nor any shared input
+    changed since the last run recorded in the manifest. With auto_mapping=True the mapping
+    stage uses the OPS -> XML alignment, with the manual chapter mapping merged over it;
+    alignment selects its mode ('global', or 'banded' for the spine-order sequence alignment).
+    Link resolutions are memoized in an LRU of resolution_cache_size entries, kept on disk
+    between incremental runs that are not dry runs.
+    """
+    ctx = PipelineContext(
+        xml_dir, ops_location, workers, auto_mapping=auto_mapping, alignment=alignment,
+        # A dry run keeps its link resolutions in memory only
+        resolution_cache_size=resolution_cache_size, persist_resolutions=incremental and not dry_run,
+        dry_run=dry_run, fragments='fragments' in stages,
+    )
+    results = {}
+
+    outputs = [ctx.xml_dir / name for name in ctx.part_files.values()]
+    if 'entities' in stages:
+        outputs.append(Path(book_output) if book_output else ctx.book_path)
+
+    manifest = Manifest(ctx.xml_dir / MANIFEST_FILENAME) if incremental else None
+    if manifest:
+        unchanged = manifest.unchanged_outputs(input_fingerprint(ctx, manifest, stages), outputs)
+        if len(unchanged) == len(outputs):
+            print("Nothing changed since the last run; skipping all stages")
+            print(f"  Last run: {manifest.data['results']}")
+            return {}, []
+        ctx.skipped = {Path(path).name for path in unchanged} & set(ctx.part_files.values())
+        if ctx.skipped:
+            print(f"Skipping {len(ctx.skipped)} unchanged part files")
+
+    for stage in STAGES:
+        if stage not in stages:
+            continue
+        print("\n" + "=" * 80)
+        print(f"STAGE: {stage} - {STAGE_FUNCTIONS[stage].__doc__}")
+        print("=" * 80)
+        with metrics.Timer(f'stage.{stage}'):
+            results[stage] = STAGE_FUNCTIONS[stage](ctx)
+    ctx.close_resolutions()
+
+    if dry_run:
+        return results, []
+
+    written = ctx.write(book_output)
+    if manifest:
+        # Recomputed after writing, in case book.xml is itself the book output
+        inputs = input_fingerprint(ctx, manifest, stages)
+        output_hashes = {str(path): manifest.file_hash(path) for path in outputs if path.exists()}
+        manifest.record(inputs, output_hashes, ctx.fixes, results)
+        manifest.save()
+    return results, written
+
+def parse_stages(value):
+    stages = [stage.strip() for stage in value.split(',') if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGE_FUNCTIONS]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown stage(s): {', '.join(unknown)}")
+    return stages
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fix entity references and broken links for a book")
+    parser.add_argument('--xml-dir', default=DEFAULT_XML_DIR, help="extracted XML directory")
+    parser.add_argument('--ops', help="OPS.zip or extracted OPS directory (default: found next to the XML)")
+    parser.add_argument('--stages', type=parse_stages, default=STAGES,
+                        help=f"comma-separated stages to run (default: {','.join(STAGES)})")
+    parser.add_argument('--book-output', help="where to write book.xml (default: <book>.xml.new)")
+    parser.add_argument('--workers', type=int, help="process pool size for directory scans")
+    parser.add_argument('--dry-run', action='store_true', help="run all stages but write nothing")
+    parser.add_argument('--full', action='store_true',
+                        help=f"ignore {MANIFEST_FILENAME} and cached link resolutions; process every part file")
+    parser.add_argument('--auto-mapping', action='store_true',
+                        help="map OPS files to XML chapters by global alignment (manual mappings still override it)")
+    parser.add_argument('--alignment', choices=ALIGNMENT_MODES, default='global',
+                        help="chapter alignment mode: global assignment, or banded sequence alignment in spine order")
+    parser.add_argument('--resolution-cache-size', type=int, default=DEFAULT_MAX_ENTRIES,
+                        help=f"link resolutions kept in memory (default: {DEFAULT_MAX_ENTRIES})")
+    parser.add_argument('--metrics', help="write per-stage timings, call counts and I/O counters to this JSON file")
+    args = parser.parse_args(argv)
+
+    if args.metrics:
+        metrics.enable()
+
+    book_output = args.book_output or f"{find_book(args.xml_dir)}.new"
+    with metrics.Timer('pipeline.total'):
+        results, written = run_pipeline(
+            args.xml_dir, args.ops, args.stages, book_output, args.dry_run, args.workers, not args.full,
+            args.auto_mapping, args.alignment, args.resolution_cache_size,
+        )
+
+    print("\n" + "=" * 80)
+    print("PIPELINE SUMMARY")
+    print("=" * 80)
+    for stage, count in results.items():
+        print(f"  {stage}: {count}")
+    print(f"  Files written: {len(written)}")
+    for path in written:
+        print(f"    {path}")
+
+    if args.metrics:
+        metrics.dump(args.metrics)
+        print(f"  Metrics written to {args.metrics}")
+
+if __name__ == '__main__':
+    main()
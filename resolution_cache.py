@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Memoized link resolution: (stage, context, linkend, link text) -> resolved id.
+The same broken targets recur across part files and across runs, so each stage asks
+the cache before walking its resolution chain (table labels, chapter mapping, XHTML
+chapter numbers). Results are held in a bounded LRU in memory and, optionally, in a
+SQLite file next to the XML files; the file is keyed by the hash of the inputs the
+resolutions depend on and is emptied whenever that hash changes. Unresolved links are
+cached too (as None).
+"""
+
+import sqlite3
+from collections import OrderedDict
+from pathlib import Path
+
+import metrics
+
+CACHE_FILENAME = '.resolution_cache.sqlite'
+SCHEMA_VERSION = 1
+DEFAULT_MAX_ENTRIES = 65536
+
+# Returned by get() for keys that have never been resolved (None is a cached "unresolved")
+MISSING = object()
+
+def normalize_link_text(text):
+    """
+    Link text as the resolvers read it: only the ends are trimmed, since inner whitespace
+    is significant to the label matcher ("Table 2.1–1" does not match "Table  2.1–1")
+    """
+    return text.strip()
+
+class ResolutionCache:
+    """Bounded LRU of link resolutions with an optional persistent tier and hit/miss statistics"""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, path=None, inputs=None):
+        self.max_entries = max_entries
+        self.path = Path(path) if path else None
+        self.inputs = inputs
+        self._entries = OrderedDict()
+        self._pending = {}  # resolutions not yet written to the persistent tier
+        self.stats = {'hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        self.conn = None
+        if self.path:
+            self.conn = sqlite3.connect(str(self.path))
+            self._ensure_schema()
+
+    def _ensure_schema(self):
+        """Create the tables; drop every entry if the schema or the input hash changed"""
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.conn.executescript("""
+                DROP TABLE IF EXISTS resolutions;
+                DROP TABLE IF EXISTS inputs;
+            """)
+        self.conn.executescript(f"""
+            CREATE TABLE IF NOT EXISTS resolutions (
+                stage TEXT NOT NULL,
+                context TEXT NOT NULL,
+                linkend TEXT NOT NULL,
+                text TEXT NOT NULL,
+                target TEXT,
+                PRIMARY KEY (stage, context, linkend, text)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS inputs (
+                hash TEXT
+            );
+            PRAGMA user_version = {SCHEMA_VERSION};
+        """)
+        row = self.conn.execute('SELECT hash FROM inputs').fetchone()
+        if row is None or row[0] != self.inputs:
+            with self.conn:
+                self.conn.execute('DELETE FROM resolutions')
+                self.conn.execute('DELETE FROM inputs')
+                self.conn.execute('INSERT INTO inputs VALUES (?)', (self.inputs,))
+        self.conn.commit()
+
+    def get(self, stage, linkend, text, context=''):
+        """The cached resolution (an id or None), or MISSING"""
+        key = (stage, context, linkend, normalize_link_text(text))
+        target = self._entries.get(key, MISSING)
+        if target is not MISSING:
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            metrics.count('resolution_cache.hits')
+            return target
+
+        if self.conn is not None:
+            row = self.conn.execute(
+                'SELECT target FROM resolutions WHERE stage = ? AND context = ? AND linkend = ? AND text = ?', key
+            ).fetchone()
+            if row is not None:
+                self.stats['disk_hits'] += 1
+                metrics.count('resolution_cache.disk_hits')
+                self._remember(key, row[0])
+                return row[0]
+
+        self.stats['misses'] += 1
+        metrics.count('resolution_cache.misses')
+        return MISSING
+
+    def put(self, stage, linkend, text, target, context=''):
+        """Record a resolution (None for a link that could not be resolved)"""
+        key = (stage, context, linkend, normalize_link_text(text))
+        self._remember(key, target)
+        if self.conn is not None:
+            self._pending[key] = target
+
+    def _remember(self, key, target):
+        self._entries[key] = target
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.stats['evictions'] += 1
+            metrics.count('resolution_cache.evictions')
+
+    def save(self):
+        """Write new resolutions to the persistent tier; return how many were written"""
+        if self.conn is None or not self._pending:
+            return 0
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO resolutions VALUES (?, ?, ?, ?, ?)',
+                [key + (target,) for key, target in self._pending.items()]
+            )
+        written = len(self._pending)
+        self._pending.clear()
+        return written
+
+    def summary(self):
+        """One line of hit/miss statistics"""
+        hits = self.stats['hits'] + self.stats['disk_hits']
+        lookups = hits + self.stats['misses']
+        rate = f"{100.0 * hits / lookups:.1f}%" if lookups else "n/a"
+        return (
+            f"{hits} hits ({self.stats['disk_hits']} from disk), {self.stats['misses']} misses, "
+            f"{self.stats['evictions']} evictions, hit rate {rate}"
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def close(self):
+        self.save()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def open_resolution_cache(directory, inputs, max_entries=DEFAULT_MAX_ENTRIES):
+    """Open the persistent resolution cache of an XML directory for the given input hash"""
+    return ResolutionCache(max_entries, Path(directory) / CACHE_FILENAME, inputs)
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+Position-based rewrite engine for linkend replacement.
+Fixers collect ((start, end), new value) edits while scanning a file and the
+output is assembled with a single join, so a file is copied once no matter how
+many links change, and each edit lands exactly on the match that produced it.
+"""
+
+def splice(content, edits):
+    """Return content with every ((start, end), value) edit applied; spans must not overlap"""
+    if not edits:
+        return content
+
+    pieces = []
+    position = 0
+    for (start, end), value in sorted(edits, key=lambda edit: edit[0]):
+        if start < position:
+            raise ValueError(f"Overlapping edit at {start}-{end}")
+        pieces.append(content[position:start])
+        pieces.append(value)
+        position = end
+    pieces.append(content[position:])
+
+    return ''.join(pieces)
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Parallel scanner for the extracted XML directory.
+Parses sect1/*.xml files in a process pool (chunked work units) and merges the
+per-file ids, table labels, appendix ids and numbered section titles in sorted
+file order, so the merged result is identical for any worker count. Callers name
+the fields they need, and only those extractors run.
+"""
+
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import metrics
+
+DEFAULT_CHUNK_SIZE = 32
+
+# Start tag carrying an id; group 1 is the tag, group 3 the id value. Either quote style is
+# accepted, and xml:id counts as an id: linkend and endterm resolve against both attributes.
+# Shared with fragment_alignment, which matches the text form up to the end of the tag.
+ID_TAG = r'<([A-Za-z_][\w.:-]*)\b[^>]*?\s(?:xml:)?id\s*=\s*(["\'])([^"\'<>]+)\2'
+ID_TAG_PATTERN = re.compile(ID_TAG.encode('ascii'))
+
+TABLE_TITLE_PATTERN = re.compile(r'<table id="([^"]+)"[^>]*>\s*<title>(.*?)</title>', re.DOTALL)
+TABLE_LABEL_PATTERN = re.compile(r'Table\s+(\d+\.\d+)[–-](\d+)')
+TABLE_ID_PATTERN = re.compile(r'<table id="([^"]+)"')
+APPENDIX_ID_PATTERN = re.compile(r'id="([^"]*appendix[^"]*)"', re.IGNORECASE)
+SECT2_ID_PATTERN = re.compile(r'<sect2 id="([^"]+)"')
+# sect1/sect2 whose title starts with a dotted number; group 1 is the id, group 2 the number,
+# group 3 the rest of the title (markup included)
+SECTION_NUMBER_PATTERN = re.compile(
+    r'<sect[12]\b[^>]*?\sid="([^"]+)"[^>]*>\s*<title\b[^>]*>\s*(?:<[^>]+>\s*)*(\d+(?:\.\d+)+)\.?(?=[\s<])'
+    r'([^<]*(?:<(?!/title>)[^<]*)*)</title>'
+)
+TAG_PATTERN = re.compile(r'<[^>]+>')
+# sect1.<isbn>.<chapter id>s<NNNN>.xml; group 1 is the ISBN, group 2 the chapter (or part) id
+SECT1_FILE_PATTERN = re.compile(r'^sect1\.([^.]+)\.(\w+?)s\d+\.xml$')
+
+def extract_ids_from_bytes(data):
+    """Return (id, tag, byte offset) for every id-bearing start tag in raw XML bytes"""
+    return [
+        (match.group(3).decode('utf-8'), match.group(1).decode('utf-8'), match.start())
+        for match in ID_TAG_PATTERN.finditer(data)
+    ]
+
+def extract_table_labels(content):
+    """[("Table X.Y–N", table id), ...] for the tables whose title carries a label"""
+    tables = []
+    for match in TABLE_TITLE_PATTERN.finditer(content):
+        label_match = TABLE_LABEL_PATTERN.search(match.group(2))
+        if label_match:
+            tables.append((f"Table {label_match.group(1)}–{label_match.group(2)}", match.group(1)))
+    return tables
+
+def extract_sections(content):
+    """[(dotted number, section id, title text), ...] for the numbered sect1/sect2 titles"""
+    return [
+        (number, section_id, ' '.join(TAG_PATTERN.sub(' ', title).split()))
+        for section_id, number, title in SECTION_NUMBER_PATTERN.findall(content)
+    ]
+
+# Result field -> extractor over the decoded text ('ids' is taken from the raw bytes)
+TEXT_EXTRACTORS = {
+    'tables': extract_table_labels,
+    'table_ids': TABLE_ID_PATTERN.findall,
+    'appendix_ids': APPENDIX_ID_PATTERN.findall,
+    'sect2_ids': SECT2_ID_PATTERN.findall,
+    'sections': extract_sections,
+}
+ALL_FIELDS = ('ids',) + tuple(TEXT_EXTRACTORS)
+ORDINAL_FIELDS = ('table_ids', 'appendix_ids', 'sect2_ids')  # what build_chapter_ordinals() reads
+
+def scan_file(path, extract=None, fields=ALL_FIELDS):
+    """Parse one XML file into the requested fields (see scan_content)"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    result = scan_content(Path(path).name, data, extract, fields)
+    # Reads happen in worker processes; the parent records them from this byte count
+    result['bytes_read'] = len(data)
+    return result
+
+def scan_content(name, data, extract=None, fields=ALL_FIELDS):
+    """
+    Parse the raw bytes of one XML file into the requested fields (ALL_FIELDS by default);
+    extract(name, text), if given, is stored as result['extracted'] so callers get more
+    out of the same read. The bytes are only decoded when a text field or extract needs them.
+    """
+    result = {'name': name}
+    if 'ids' in fields:
+        result['ids'] = extract_ids_from_bytes(data)
+    text_fields = [field for field in fields if field != 'ids']
+    if text_fields or extract is not None:
+        content = data.decode('utf-8')
+        for field in text_fields:
+            result[field] = TEXT_EXTRACTORS[field](content)
+        if extract is not None:
+            result['extracted'] = extract(name, content)
+    return result
+
+def scan_files(paths, workers=None, chunk_size=DEFAULT_CHUNK_SIZE, preloaded=None, cache=None, extract=None,
+               fields=ALL_FIELDS):
+    """
+    Scan paths (in the given order) for the requested fields and return the per-file results
+    in that order. preloaded maps file name -> raw bytes for files already in memory, and cache
+    maps file name -> earlier result (filled in as files are scanned); neither is read again.
+    extract is a module-level function of (file name, text), run in the worker processes;
+    its value is kept as result['extracted']. Cached results missing a requested field (or
+    the extracted value) are rescanned and the new fields added to them.
+    """
+    preloaded = preloaded or {}
+    cache = {} if cache is None else cache
+    paths = [str(path) for path in paths]
+    names = [Path(path).name for path in paths]
+
+    def cached(name):
+        return name in cache and all(field in cache[name] for field in fields) and (
+            extract is None or 'extracted' in cache[name]
+        )
+
+    def remember(result):
+        cache[result['name']] = {**cache.get(result['name'], {}), **result}
+
+    for name in names:
+        if not cached(name) and name in preloaded:
+            remember(scan_content(name, preloaded[name], extract, fields))
+    to_read = [path for path, name in zip(paths, names) if not cached(name)]
+    metrics.count('scanner.files_read', len(to_read))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, max(1, len(to_read) // chunk_size + 1))
+
+    scan = partial(scan_file, extract=extract, fields=fields)
+    if workers <= 1:
+        read_results = [scan(path) for path in to_read]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            read_results = list(executor.map(scan, to_read, chunksize=chunk_size))
+
+    for result in read_results:
+        metrics.record_read(result.pop('bytes_read'))
+        remember(result)
+    return [cache[name] for name in names]
+
+def merge_scan_results(results):
+    """
+    Merge per-file results; later files (in sorted name order) win label collisions.
+    Fields the results were not scanned for stay empty.
+    """
+    merged = {
+        'files': results,
+        'ids': {},
+        'tables': {},
+        'appendix_ids': {},
+    }
+
+    for result in results:
+        for id_val, _tag, _offset in result.get('ids', ()):
+            files = merged['ids'].setdefault(id_val, [])
+            if result['name'] not in files:
+                files.append(result['name'])
+        for label, table_id in result.get('tables', ()):
+            merged['tables'][label] = table_id
+        if result.get('appendix_ids'):
+            merged['appendix_ids'][result['name']] = result['appendix_ids']
+
+    return merged
+
+def build_chapter_ordinals(results, isbn):
+    """
+    Return chapter id -> {'tables', 'appendices'}: the chapter's table ids and appendix ids
+    in document order across its sect1 files (results in sorted file name order).
+    Appendices are the ids containing "appendix", or the sect2 ids when a chapter has none.
+    """
+    chapters = {}
+    for result in results:
+        name_match = SECT1_FILE_PATTERN.match(result['name'])
+        if not name_match or name_match.group(1) != isbn:
+            continue
+        chapter = chapters.setdefault(name_match.group(2), {'tables': [], 'appendices': [], 'sect2': []})
+        chapter['tables'].extend(result['table_ids'])
+        chapter['appendices'].extend(result['appendix_ids'])
+        chapter['sect2'].extend(result['sect2_ids'])
+
+    for chapter in chapters.values():
+        sect2_ids = chapter.pop('sect2')
+        if not chapter['appendices']:
+            chapter['appendices'] = sect2_ids
+    return chapters
+
+def scan_directory(directory, pattern='sect1.*.xml', workers=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                   preloaded=None, cache=None, extract=None, fields=ALL_FIELDS):
+    """Scan every file matching pattern in directory for the requested fields and return the merged result"""
+    paths = sorted(Path(directory).glob(pattern))
+    return merge_scan_results(scan_files(paths, workers, chunk_size, preloaded, cache, extract, fields))
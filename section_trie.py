@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Trie over dotted section numbers (3, 3.7, 3.7.2, ...) for a book.
+Chapters are added from the book index and numbered sect1/sect2 titles from the
+directory scan, so one pass over the files is enough; a lookup walks the number's
+pieces and returns the deepest XML element on its path (longest-prefix match), with
+the chapter that owns it. A subsection number that no chapter carries (3.7.2) thus
+resolves to its section, or to its parent chapter (3.7), without a hand-kept table.
+Numbers are not unique in every book (a 3.7.2 subsection in one chapter, a chapter
+titled "3.7.2 ..." elsewhere), so each number keeps one entry per owning chapter, and
+the title given with a lookup picks between them; a number whose title points at
+another chapter resolves to that chapter when its title is unambiguous, else to nothing.
+
+Usage:
+    python section_trie.py [--xml-dir DIR] [--title TITLE] NUMBER [NUMBER ...]
+"""
+
+import argparse
+import re
+import weakref
+from collections import namedtuple
+from pathlib import Path
+
+from book_index import load_book_index
+from books import book_isbn, find_book
+from scanner import SECT1_FILE_PATTERN, scan_directory
+from title_matcher import MIN_TITLE_SCORE, chapter_title_matcher, jaccard, title_tokens
+
+_TRIE_CACHE = weakref.WeakKeyDictionary()
+
+# Dotted number at the start of a title ("3.7.2. Campylobacter")
+LEADING_NUMBER_PATTERN = re.compile(r'^\s*\d+(?:\.\d+)*\.?')
+
+# number is the matched prefix in canonical form ('3.7' for a lookup of 3.7.2.), None for a title match
+Match = namedtuple('Match', 'id chapter number')
+
+def number_pieces(number):
+    """Canonical pieces of a dotted number: '3.07.2.' -> ['3', '7', '2'] (empty for non-numbers)"""
+    pieces = number.strip().rstrip('.').split('.')
+    if not all(piece.isdigit() for piece in pieces):
+        return []
+    return [str(int(piece)) for piece in pieces]
+
+def strip_number(title):
+    """A title without its leading dotted number"""
+    return LEADING_NUMBER_PATTERN.sub('', title, count=1)
+
+class SectionTrie:
+    """Dotted section number -> XML ids and their owning chapters; lookup() is longest-prefix"""
+
+    def __init__(self, titles=None):
+        self._root = {}   # piece -> node; a node is [children, [(XML id, chapter id, title tokens), ...]]
+        self._size = 0
+        self.titles = titles  # TitleMatcher over chapter titles, for titles that contradict their number
+
+    def add(self, number, xml_id, chapter_id, title=''):
+        """
+        Add an element under its number; the first element of each chapter keeps the number,
+        so chapters (added first) win over a section titled with their own number
+        """
+        pieces = number_pieces(number)
+        if not pieces:
+            return False
+        children = self._root
+        for piece in pieces:
+            node = children.get(piece)
+            if node is None:
+                node = children[piece] = [{}, []]
+            children = node[0]
+        if any(entry[1] == chapter_id for entry in node[1]):
+            return False
+        node[1].append((xml_id, chapter_id, title_tokens(strip_number(title))))
+        self._size += 1
+        return True
+
+    def lookup(self, number, title='', max_depth=None):
+        """
+        The deepest entry on number's path (at most max_depth pieces deep) as a Match, or None.
+        title (with or without the number in front) picks between entries of several chapters;
+        when it names none of the number's own entries but matches one chapter title, that
+        chapter is returned instead. A number shared by several chapters that the title does
+        not settle is unresolved (None).
+        """
+        pieces = number_pieces(number)
+        if max_depth is not None:
+            pieces = pieces[:max_depth]
+        best = None
+        children = self._root
+        for depth, piece in enumerate(pieces, 1):
+            node = children.get(piece)
+            if node is None:
+                break
+            if node[1]:
+                best = (node[1], depth)
+            children = node[0]
+        if best is None:
+            return None
+        entries, depth = best
+
+        tokens = title_tokens(strip_number(title))
+        if tokens:
+            scores = [jaccard(tokens, entry[2]) for entry in entries]
+            if depth == len(pieces):
+                if not any(scores) and any(entry[2] for entry in entries):
+                    # The title names something other than the elements carrying this number
+                    return self.title_match(title)
+            else:
+                # A subsection below the deepest entry: its title only counts if it is another chapter's
+                other = self.title_match(title)
+                if other and all(entry[1] != other.chapter for entry in entries):
+                    return other
+            top = max(scores)
+            entries = [entry for entry, score in zip(entries, scores) if score == top]
+        if len({entry[1] for entry in entries}) > 1:
+            return None
+        xml_id, chapter_id, _tokens = entries[0]
+        return Match(xml_id, chapter_id, '.'.join(pieces[:depth]))
+
+    def title_match(self, title):
+        """The one chapter whose title matches title (without its number) at MIN_TITLE_SCORE, or None"""
+        if self.titles is None:
+            return None
+        ranked = self.titles.rank(strip_number(title), 2, MIN_TITLE_SCORE)
+        if not ranked or (len(ranked) > 1 and ranked[1][1] == ranked[0][1]):
+            return None
+        return Match(ranked[0][0], ranked[0][0], None)
+
+    def resolve(self, number, title=''):
+        """Deepest XML id for a number (section, else chapter), or None"""
+        match = self.lookup(number, title)
+        return match.id if match else None
+
+    def chapter_of(self, number, title=''):
+        """The chapter owning the deepest element for a number, or None"""
+        match = self.lookup(number, title)
+        return match.chapter if match else None
+
+    def parent_chapter(self, number):
+        """The owning chapter of number's longest proper prefix (3.7.2 -> the chapter of 3.7), or None"""
+        pieces = number_pieces(number)
+        match = self.lookup(number, max_depth=len(pieces) - 1) if len(pieces) > 1 else None
+        return match.chapter if match else None
+
+    def __len__(self):
+        return self._size
+
+def build_section_trie(book_index, scan_results=(), isbn=None):
+    """
+    Trie of the book's chapter numbers and the numbered sect1/sect2 titles in scan_results
+    (scanner results, in sorted file order); sections are owned by the chapter in their file name
+    """
+    trie = SectionTrie(chapter_title_matcher(book_index))
+    for ch_id, chapter in book_index.chapters.items():
+        if chapter['number']:
+            trie.add(chapter['number'], ch_id, ch_id, chapter['title'])
+    for result in scan_results:
+        name_match = SECT1_FILE_PATTERN.match(result['name'])
+        if not name_match or (isbn and name_match.group(1) != isbn):
+            continue
+        chapter_id = name_match.group(2)
+        if chapter_id not in book_index.chapters:
+            continue
+        for number, section_id, title in result.get('sections', ()):
+            trie.add(number, section_id, chapter_id, title)
+    return trie
+
+def load_section_trie(xml_dir, isbn, book_index=None, scan_results=None):
+    """Return the (cached) SectionTrie of a book, scanning its sect1 files unless scan_results is given"""
+    if book_index is None:
+        book_index = load_book_index(Path(xml_dir) / f'book.{isbn}.xml')
+    trie = _TRIE_CACHE.get(book_index)
+    if trie is None:
+        if scan_results is None:
+            scan_results = scan_directory(xml_dir, f'sect1.{isbn}.*.xml', fields=('sections',))['files']
+        trie = build_section_trie(book_index, scan_results, isbn)
+        _TRIE_CACHE[book_index] = trie
+    return trie
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resolve dotted section numbers to XML ids")
+    parser.add_argument('--xml-dir', default='/workspace/extracted_final')
+    parser.add_argument('--title', default='', help="link or OPS title the numbers come with")
+    parser.add_argument('numbers', nargs='+')
+    args = parser.parse_args(argv)
+
+    isbn = book_isbn(find_book(args.xml_dir))
+    trie = load_section_trie(args.xml_dir, isbn)
+    print(f"Section trie: {len(trie)} numbered chapters and sections")
+    for number in args.numbers:
+        match = trie.lookup(number, args.title)
+        if match:
+            matched = f"matched {match.number}" if match.number else "matched by title"
+            print(f"  {number} → {match.id} (chapter {match.chapter}, {matched})")
+        else:
+            print(f"  {number} → no match")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Synthetic book generator for benchmarks.
+Writes a book in the same layout as the real extracted corpus: book.<isbn>.xml with
+sect1 entity declarations, one sect1 file per chapter (with tables and an appendix
+sect2), one part-level sect1 file per part whose links point at OPS XHTML ids, and
+OPS/<isbn>_v<volume>_c<nn>.xhtml chapter files with the EPUB package (content.opf,
+toc.ncx, nav.xhtml), optionally packed into OPS.zip.
+
+Usage:
+    python synthetic_corpus.py OUT_DIR [--parts 18] [--chapters 26] [--tables 4] [--broken-density 0.9]
+                               [--fragment-links 0.0]
+"""
+
+import argparse
+import random
+import zipfile
+from pathlib import Path
+
+from books import DEFAULT_ISBN
+
+WORDS = (
+    'Blood Urine Respiratory Wound Tissue Body Fluid Cultures Specimen Collection Transport '
+    'Processing Aerobic Anaerobic Bacteria Fungi Mycobacteria Viruses Parasites Identification '
+    'Susceptibility Testing Molecular Methods Quality Control Safety Media Stains Reagents'
+).split()
+
+DOCTYPE = (
+    '<!DOCTYPE book PUBLIC "-//RIS Dev//DTD DocBook V4.3 -Based Variant V1.1//EN" '
+    '"http://LOCALHOST/dtd/V1.1/RittDocBook.dtd" ['
+)
+
+def chapter_title(rng):
+    return ' '.join(rng.sample(WORDS, rng.randint(2, 5)))
+
+def package_documents(isbn, toc):
+    """content.opf, toc.ncx and nav.xhtml for the chapter files in toc ([(file name, label)], in reading order)"""
+    items = ''.join(
+        f'<item id="c{index}" href="{name}" media-type="application/xhtml+xml"/>'
+        for index, (name, _label) in enumerate(toc, 1)
+    )
+    itemrefs = ''.join(f'<itemref idref="c{index}"/>' for index in range(1, len(toc) + 1))
+    nav_points = ''.join(
+        f'<navPoint id="np{index}" playOrder="{index}"><navLabel><text>{label}</text></navLabel>'
+        f'<content src="{name}"/></navPoint>'
+        for index, (name, label) in enumerate(toc, 1)
+    )
+    nav_links = ''.join(f'<li><a href="{name}">{label}</a></li>' for name, label in toc)
+    return {
+        'content.opf': (
+            '<?xml version="1.0" encoding="UTF-8"?>\n<package xmlns="http://www.idpf.org/2007/opf" version="3.0">'
+            f'<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:identifier>{isbn}</dc:identifier></metadata>'
+            '<manifest><item id="ncx" href="toc.ncx" media-type="application/x-dtbncx+xml"/>'
+            '<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>'
+            f'{items}</manifest><spine toc="ncx">{itemrefs}</spine></package>\n'
+        ),
+        'toc.ncx': (
+            '<?xml version="1.0" encoding="UTF-8"?>\n<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">'
+            f'<navMap>{nav_points}</navMap></ncx>\n'
+        ),
+        'nav.xhtml': (
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops"><body>'
+            f'<nav epub:type="toc"><ol>{nav_links}</ol></nav></body></html>\n'
+        ),
+    }
+
+def generate_corpus(out_dir, parts=18, chapters_per_part=26, tables_per_chapter=4, broken_density=0.9,
+                    links_per_chapter=2, isbn=DEFAULT_ISBN, ops_zip=False, seed=0, fragment_links=0.0):
+    """
+    Write a synthetic book under out_dir (xml/ and OPS/ or OPS.zip); return a summary dict.
+    fragment_links is the fraction of broken table links that point at the OPS table's
+    fragment id (t2.1-1) rather than at its file id.
+    """
+    rng = random.Random(seed)
+    out_dir = Path(out_dir)
+    xml_dir = out_dir / 'xml'
+    xml_dir.mkdir(parents=True, exist_ok=True)
+    ops_files = {}
+    toc = []
+
+    entities = []
+    body = []
+    chapter_count = 0
+    link_count = 0
+    broken_count = 0
+
+    for p in range(1, parts + 1):
+        part_id = f"pt{p:04d}"
+        volume = (p - 1) // 4 + 1
+        part_links = []
+        body.append(
+            f'<part id="{part_id}">\n   <title>\n'
+            f'      <emphasis role="partNumber">SECTION {p}</emphasis><?lb?>\n'
+            f'      <emphasis role="partTitle">{chapter_title(rng)} &amp; More</emphasis>\n'
+            f'   </title>\n   <partintro>\n      <para>Introduction to section {p}.</para>\n   </partintro>\n'
+        )
+
+        for k in range(1, chapters_per_part + 1):
+            chapter_count += 1
+            ch_id = f"ch{chapter_count:04d}"
+            number = f"{p}.{k}"
+            title = chapter_title(rng)
+            entity = f"sect1.{isbn}.{ch_id}s0001"
+            ops_id = f"{isbn}_v{volume}_c{chapter_count:02d}"
+            entities.append(f'<!ENTITY {entity} SYSTEM "{entity}.xml">')
+            body.append(
+                f'   <chapter id="{ch_id}" label="{chapter_count}">\n'
+                f'      <title><emphasis role="chapterNumber">{number}</emphasis><?lb?>'
+                f'<emphasis role="chapterTitle">{title}</emphasis></title>\n'
+                f'      &{entity};\n   </chapter>\n'
+            )
+
+            tables = ''.join(
+                f'<table id="{ch_id}s0001ta{t:02d}"><title>Table {number}–{t} {chapter_title(rng)}</title>'
+                f'<tgroup cols="1"><tbody><row><entry>{t}</entry></row></tbody></tgroup></table>\n'
+                for t in range(1, tables_per_chapter + 1)
+            )
+            (xml_dir / f"{entity}.xml").write_text(
+                f'<sect1 id="{ch_id}s0001"><title>{number} {title}</title>\n'
+                f'<para id="{ch_id}s0001p0001">{title} overview. See <link linkend="{ch_id}">{number}</link>.</para>\n'
+                f'{tables}<sect2 id="{ch_id}s0001s0001"><title>Appendix {number}–1</title><para>Notes.</para></sect2>\n'
+                f'</sect1>\n',
+                encoding='utf-8'
+            )
+
+            table_links = ''.join(
+                f'<a id="r{number}-{t}" href="{ops_id}.xhtml#t{number}-{t}">Table {number}–{t}</a> '
+                for t in range(1, tables_per_chapter + 1)
+            )
+            ops_tables = ''.join(
+                f'<table id="t{number}-{t}"><caption><span class="figureLabel" id="c{chapter_count:02d}-tbl-{t:04d}">'
+                f'Table {number}–{t}</span></caption><tr><td>{t}</td></tr></table>'
+                for t in range(1, tables_per_chapter + 1)
+            )
+            toc.append((f"{ops_id}.xhtml", f"{number} {title}"))
+            ops_files[f"{ops_id}.xhtml"] = (
+                f'<?xml version="1.0" encoding="UTF-8"?>\n<html xmlns="http://www.w3.org/1999/xhtml">'
+                f'<head><title>{number} {title}</title></head><body>'
+                f'<h1><span class="chapterNumber">{number}</span> <span class="chapterTitle">{title}</span></h1>'
+                f'<p id="{ops_id}-p1">{(title + " is described in this chapter. ") * 3}</p>'
+                f'<p>{table_links}</p>{ops_tables}'
+                f'<section id="{ops_id}-app1"><h2>Appendix {number}–1</h2><p id="{ops_id}-app1-p1">Notes.</p></section>'
+                f'</body></html>\n'
+            )
+
+            # Links from the part file: the chapter itself, then some of its tables
+            targets = [(ch_id, f"{number}. {title}", None)]
+            table_link_count = max(0, min(links_per_chapter - 1, tables_per_chapter))
+            for t in rng.sample(range(1, tables_per_chapter + 1), table_link_count):
+                targets.append((f"{ch_id}s0001ta{t:02d}", f"Table {number}–{t}", f"t{number}-{t}"))
+            for xml_id, text, fragment in targets:
+                link_count += 1
+                if rng.random() < broken_density:
+                    broken_count += 1
+                    linkend = ops_id
+                    if fragment_links and fragment and rng.random() < fragment_links:
+                        linkend = fragment
+                    part_links.append(f'<para><link linkend="{linkend}">{text}</link></para>')
+                else:
+                    part_links.append(f'<para><link linkend="{xml_id}">{text}</link></para>')
+
+        body.append('</part>\n')
+        (xml_dir / f"sect1.{isbn}.{part_id}s0001.xml").write_text(
+            f'<sect1 id="{part_id}s0001"><title>Section {p}</title>\n' + '\n'.join(part_links) + '\n</sect1>\n',
+            encoding='utf-8'
+        )
+
+    ops_files.update(package_documents(isbn, toc))
+
+    (xml_dir / f"book.{isbn}.xml").write_text(
+        f'<?xml version="1.0" encoding="UTF-8"?>\n{DOCTYPE}\n' + '\n'.join(entities) + '\n]>\n'
+        f'<book id="b{isbn}">\n' + ''.join(body) + '</book>\n',
+        encoding='utf-8'
+    )
+
+    if ops_zip:
+        ops_location = out_dir / 'OPS.zip'
+        with zipfile.ZipFile(ops_location, 'w', zipfile.ZIP_DEFLATED) as zf:
+            zf.writestr('META-INF/container.xml', (
+                '<?xml version="1.0" encoding="UTF-8"?>\n'
+                '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container"><rootfiles>'
+                '<rootfile full-path="OPS/content.opf" media-type="application/oebps-package+xml"/>'
+                '</rootfiles></container>\n'
+            ))
+            for name, content in ops_files.items():
+                zf.writestr(f"OPS/{name}", content)
+    else:
+        ops_location = out_dir / 'OPS'
+        ops_location.mkdir(exist_ok=True)
+        for name, content in ops_files.items():
+            (ops_location / name).write_text(content, encoding='utf-8')
+
+    return {
+        'xml_dir': str(xml_dir),
+        'ops_location': str(ops_location),
+        'isbn': isbn,
+        'parts': parts,
+        'chapters': chapter_count,
+        'tables': chapter_count * tables_per_chapter,
+        'links': link_count,
+        'broken_links': broken_count,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic book corpus for benchmarks")
+    parser.add_argument('out_dir')
+    parser.add_argument('--parts', type=int, default=18)
+    parser.add_argument('--chapters', type=int, default=26, help="chapters per part")
+    parser.add_argument('--tables', type=int, default=4, help="tables per chapter")
+    parser.add_argument('--broken-density', type=float, default=0.9,
+                        help="fraction of part-level links that point at OPS ids")
+    parser.add_argument('--links', type=int, default=2, help="part-level links per chapter")
+    parser.add_argument('--isbn', default=DEFAULT_ISBN)
+    parser.add_argument('--ops-zip', action='store_true', help="pack the OPS files into OPS.zip")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fragment-links', type=float, default=0.0,
+                        help="fraction of broken table links that point at OPS fragment ids")
+    args = parser.parse_args(argv)
+
+    summary = generate_corpus(
+        args.out_dir, args.parts, args.chapters, args.tables, args.broken_density,
+        args.links, args.isbn, args.ops_zip, args.seed, args.fragment_links
+    )
+    for key, value in summary.items():
+        print(f"{key}: {value}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from batch import LOG_FILENAME, aggregate, run_batch, run_book
+from synthetic_corpus import generate_corpus
+
+def snapshot(root):
+    """relative path -> bytes for every file under root, hidden files included"""
+    return {
+        path.relative_to(root): path.read_bytes() for path in sorted(Path(root).rglob('*')) if path.is_file()
+    }
+
+class BatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.books = [
+            generate_corpus(self.root / isbn, parts=2, chapters_per_part=3, isbn=isbn)
+            for isbn in ('9780000000001', '9780000000002')
+        ]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_quietly(self, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return run_batch(self.root, workers=1, **kwargs)
+
+    def test_dry_run_leaves_no_files(self):
+        before = snapshot(self.root)
+        summaries = self.run_quietly(dry_run=True)
+        self.assertEqual(snapshot(self.root), before)
+
+        self.assertEqual([summary['status'] for summary in summaries], ['ok', 'ok'])
+        for summary in summaries:
+            self.assertEqual(summary['written'], [])
+            self.assertGreater(summary['results']['broken'], 0)
+            # The log still exists, outside the book directory
+            self.assertFalse(Path(summary['log']).is_relative_to(self.root))
+            self.assertIn('STAGE: broken', Path(summary['log']).read_text(encoding='utf-8'))
+            os.unlink(summary['log'])
+
+    def test_run_writes_log_and_fixes(self):
+        summaries = self.run_quietly()
+        self.assertEqual([summary['isbn'] for summary in summaries], ['9780000000001', '9780000000002'])
+        for book, summary in zip(self.books, summaries):
+            self.assertEqual(summary['log'], str(Path(book['xml_dir']) / LOG_FILENAME))
+            self.assertTrue(Path(summary['log']).exists())
+            self.assertTrue(summary['written'])
+
+        totals = aggregate(summaries, 1.0)
+        self.assertEqual(totals['books'], 2)
+        self.assertEqual(totals['status'], {'ok': 2})
+        self.assertEqual(totals['files_written'], sum(len(summary['written']) for summary in summaries))
+
+        # Nothing left to fix on the second run
+        again = self.run_quietly()
+        self.assertEqual(aggregate(again, 1.0)['files_written'], 0)
+
+    def test_book_errors_are_contained(self):
+        empty = self.root / 'empty'
+        empty.mkdir()
+        with contextlib.redirect_stdout(io.StringIO()):
+            summary = run_book(empty, dry_run=True)
+        self.assertEqual(summary['status'], 'error')
+        self.assertIsNotNone(summary['error'])
+        self.assertEqual(list(empty.iterdir()), [])
+        os.unlink(summary['log'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+
+from book_index import BookIndex
+from fix_xml_references import find_chapter_ids_for_part
+
+# Chapter numbers restart in the appendix part, so "1.1" is carried by two chapters
+BOOK = b"""<?xml version="1.0"?>
+<!DOCTYPE book PUBLIC "-//OASIS//DTD DocBook XML V4.5//EN" "docbookx.dtd" [
+<!ENTITY sect1.9780000000001.ch0001s0001 SYSTEM "sect1.9780000000001.ch0001s0001.xml">
+]>
+<book id="b1">
+  <part id="pt0001">
+    <title>Part 1</title>
+    <chapter id="ch0001" label="1">
+      <title><emphasis role="chapterNumber">1.1</emphasis><emphasis role="chapterTitle">Blood &amp; Urine</emphasis></title>
+      <sect1 id="ch0001s0001"><title><emphasis role="chapterNumber">9.9</emphasis></title></sect1>
+      &sect1.9780000000001.ch0001s0001;
+    </chapter>
+    <chapter id="ch0002" label="2">
+      <title><emphasis role="chapterNumber">1.2</emphasis><emphasis role="chapterTitle">Wounds &mdash; Tissue</emphasis></title>
+    </chapter>
+  </part>
+  <part id="pt0002">
+    <title>Appendices</title>
+    <chapter id="ap0001">
+      <title><emphasis role="chapterNumber">1.1</emphasis><emphasis role="chapterTitle">Media</emphasis></title>
+    </chapter>
+    <chapter id="ch0003">
+      <title><emphasis role="chapterNumber">1.2</emphasis><emphasis role="chapterTitle">Stains</emphasis></title>
+    </chapter>
+  </part>
+  <chapter id="ch0004">
+    <title><emphasis role="chapterNumber">5.1</emphasis><emphasis role="chapterTitle">Outside</emphasis></title>
+  </chapter>
+</book>
+"""
+
+class BookIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = BookIndex(None, BOOK)
+
+    def test_chapters(self):
+        self.assertEqual(self.index.parts, ['pt0001', 'pt0002'])
+        self.assertEqual(self.index.chapter('ch0001'), {
+            'number': '1.1', 'title': 'Blood & Urine', 'label': '1', 'part': 'pt0001',
+        })
+        # Undeclared entities are kept as written; a nested section title is not the chapter's
+        self.assertEqual(self.index.chapter('ch0002')['title'], 'Wounds &mdash; Tissue')
+        self.assertEqual(self.index.chapter('ch0004')['part'], None)
+        self.assertIsNone(self.index.chapter('ch0001s0001'))
+        self.assertEqual(self.index.ids['ch0001s0001'], 'sect1')
+
+    def test_part_scoped_numbers(self):
+        self.assertEqual(self.index.chapter_id('1.1'), 'ch0001')
+        self.assertEqual(self.index.chapter_id('1.1', 'pt0001'), 'ch0001')
+        self.assertEqual(self.index.chapter_id('1.1', 'pt0002'), 'ap0001')
+        self.assertEqual(self.index.chapter_id('1.2', 'pt0002'), 'ch0003')
+        self.assertIsNone(self.index.chapter_id('5.1', 'pt0001'))
+        self.assertEqual(self.index.chapter_id('5.1'), 'ch0004')
+        self.assertIsNone(self.index.chapter_id('9.9'))
+
+    def test_part_chapters(self):
+        self.assertEqual(self.index.part_chapter_numbers('pt0002'), [('ap0001', '1.1'), ('ch0003', '1.2')])
+        self.assertEqual(self.index.part_chapter_numbers('pt0009'), [])
+        self.assertEqual(find_chapter_ids_for_part(self.index, 'pt0001'), ['ch0001', 'ch0002'])
+        self.assertEqual(find_chapter_ids_for_part(self.index, 'pt0002'), ['ch0003'])
+
+    def test_streamed_file_matches_content(self):
+        import tempfile
+        from pathlib import Path
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / 'book.9780000000001.xml'
+            path.write_bytes(BOOK)
+            streamed = BookIndex(path)
+        self.assertEqual(streamed.chapters, self.index.chapters)
+        self.assertEqual(streamed.ids, self.index.ids)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,190 @@
+import itertools
+import random
+import unittest
+from unittest import mock
+
+import chapter_alignment
+from book_index import BookIndex
+from chapter_alignment import (
+    align_chapters, align_chapters_banded, banded_alignment, max_weight_matching, title_similarities,
+)
+from section_trie import build_section_trie
+
+WORDS = (
+    'Blood Urine Respiratory Wound Tissue Body Fluid Cultures Specimen Collection Transport Processing '
+    'Aerobic Anaerobic Bacteria Fungi Mycobacteria Viruses Parasites Identification Susceptibility Testing '
+    'Molecular Methods Quality Control Safety Media Stains Reagents Serology Antigen Antibody Microscopy '
+    'Incubation Storage Labels Reports Validation Training'
+).split()
+
+def chapter_title(index):
+    """A title sharing no words with its neighbours"""
+    return ' '.join(WORDS[(index * 3 + offset) % len(WORDS)] for offset in range(3))
+
+def make_book(count, chapters_per_part=10):
+    """BookIndex with count numbered chapters, chapters_per_part to a part"""
+    body = []
+    for start in range(0, count, chapters_per_part):
+        part = start // chapters_per_part + 1
+        body.append(f'<part id="pt{part:04d}"><title>Part {part}</title>')
+        for index in range(start, min(count, start + chapters_per_part)):
+            body.append(
+                f'<chapter id="ch{index + 1:04d}" label="{index + 1}"><title>'
+                f'<emphasis role="chapterNumber">{part}.{index - start + 1}</emphasis>'
+                f'<emphasis role="chapterTitle">{chapter_title(index)}</emphasis></title></chapter>'
+            )
+        body.append('</part>')
+    return BookIndex(None, f'<book id="b1">{"".join(body)}</book>'.encode('utf-8'))
+
+def signature(book_index, ch_id, number=None):
+    chapter = book_index.chapters[ch_id]
+    return {'chapter_num': number or chapter['number'], 'chapter_title': chapter['title']}
+
+def ops_id(index):
+    return f'9780000000001_v1_c{index:02d}'
+
+def best_matching_weight(weights, rows, columns):
+    """Total weight of the best partial one-to-one matching, by trying every assignment"""
+    best = 0.0
+    options = [None] + list(range(columns))
+    for assignment in itertools.product(options, repeat=rows):
+        taken = [column for column in assignment if column is not None]
+        if len(taken) != len(set(taken)) or any(
+            column is not None and (row, column) not in weights for row, column in enumerate(assignment)
+        ):
+            continue
+        best = max(best, sum(weights[row, column] for row, column in enumerate(assignment) if column is not None))
+    return best
+
+@unittest.skipIf(chapter_alignment.np is None, "NumPy is not installed")
+class TitleSimilarityParityTest(unittest.TestCase):
+    """The NumPy path returns exactly what the sparse token index does"""
+
+    def compare(self, ops_titles, xml_titles, min_score):
+        with mock.patch.object(chapter_alignment, 'BATCH_ROWS', 3):
+            dense = title_similarities(ops_titles, xml_titles, min_score)
+        with mock.patch.object(chapter_alignment, 'np', None):
+            sparse = title_similarities(ops_titles, xml_titles, min_score)
+        self.assertEqual(dense, sparse)
+        return dense
+
+    def test_threshold_boundaries(self):
+        xml_titles = ['Blood Cultures', 'Blood Urine Cultures', 'Wound Tissue Body Fluid', '']
+        ops_titles = ['Blood Cultures Collection Transport', 'Blood Urine Wound', 'Fluid', '', 'Stains']
+        # Scores equal to the threshold (2/4 here) are not above it
+        self.assertEqual(self.compare(ops_titles, xml_titles, 0.5), {row: [] for row in range(5)})
+        self.assertEqual(self.compare(ops_titles, xml_titles, 0.3)[0], [(0, 0.5), (1, 0.4)])
+        # 1/3 is not above a threshold of 1/3, which single-precision scores got wrong
+        self.assertEqual(self.compare(['Blood Urine'], xml_titles, 1 / 3), {0: [(1, 2 / 3)]})
+        self.compare(ops_titles, xml_titles, 0.0)
+
+    def test_random_titles(self):
+        rng = random.Random(7)
+        def titles(count):
+            return [' '.join(rng.sample(WORDS[:12], rng.randint(1, 5))) for _ in range(count)]
+        xml_titles = titles(40)
+        ops_titles = titles(25)
+        for min_score in (0.0, 1 / 3, 0.5):
+            self.compare(ops_titles, xml_titles, min_score)
+
+class MaxWeightMatchingTest(unittest.TestCase):
+
+    def test_small_cases(self):
+        cases = [
+            ({}, {}),
+            ({(0, 0): 1.0}, {0: 0}),
+            # The second row's only edge takes the column the first row prefers
+            ({(0, 0): 2.0, (0, 1): 1.5, (1, 0): 1.8}, {0: 1, 1: 0}),
+            # One heavy edge beats two light ones
+            ({(0, 0): 1.0, (1, 1): 1.0, (0, 1): 3.0}, {0: 1}),
+            ({(3, 7): 0.5, (5, 7): 0.6}, {5: 7}),
+        ]
+        for weights, expected in cases:
+            with self.subTest(weights=weights):
+                self.assertEqual(max_weight_matching(weights), expected)
+
+    def test_against_brute_force(self):
+        rng = random.Random(7)
+        for case in range(300):
+            rows, columns = rng.randint(1, 5), rng.randint(1, 5)
+            weights = {
+                (row, column): round(rng.uniform(0.1, 2.0), 2)
+                for row in range(rows) for column in range(columns) if rng.random() < 0.6
+            }
+            matching = max_weight_matching(weights)
+            with self.subTest(case=case):
+                self.assertEqual(len(set(matching.values())), len(matching))
+                self.assertTrue(all((row, column) in weights for row, column in matching.items()))
+                self.assertAlmostEqual(
+                    sum(weights[row, column] for row, column in matching.items()),
+                    best_matching_weight(weights, rows, columns),
+                )
+
+class BandedAlignmentTest(unittest.TestCase):
+
+    def align(self, signatures, book_index, band):
+        order = sorted(signatures)
+        xml_ids = list(book_index.chapters)
+        return banded_alignment(order, signatures, xml_ids, book_index, build_section_trie(book_index), band)
+
+    def test_fewer_ops_files_than_the_band_covers(self):
+        book_index = make_book(40)
+        signatures = {ops_id(1): signature(book_index, 'ch0005'), ops_id(2): signature(book_index, 'ch0037')}
+        for band in (8, 2, 0):
+            with self.subTest(band=band):
+                path = self.align(signatures, book_index, band)
+                self.assertEqual([ch_id for _ops, ch_id, _step in path if ch_id], list(book_index.chapters))
+                self.assertIn((ops_id(1), 'ch0005', 'match'), path)
+                self.assertIn((ops_id(2), 'ch0037', 'match'), path)
+
+    def test_more_ops_files_than_chapters(self):
+        book_index = make_book(3)
+        signatures = {ops_id(index): signature(book_index, 'ch0002') for index in range(1, 30)}
+        signatures[ops_id(1)] = signature(book_index, 'ch0001')
+        signatures[ops_id(29)] = signature(book_index, 'ch0003')
+        for band in (8, 1):
+            with self.subTest(band=band):
+                alignment = align_chapters_banded(signatures, book_index, sorted(signatures), band)
+                self.assertEqual(alignment[ops_id(1)]['chapter'], 'ch0001')
+                self.assertEqual(alignment[ops_id(29)]['chapter'], 'ch0003')
+
+    def test_empty_sequences(self):
+        book_index = make_book(40)
+        cases = [
+            ({}, book_index, 40),
+            ({ops_id(1): signature(book_index, 'ch0001')}, make_book(0), 1),
+            ({}, make_book(0), 0),
+        ]
+        for signatures, index, gaps in cases:
+            with self.subTest(ops=len(signatures), chapters=len(index.chapters)):
+                path = self.align(signatures, index, 8)
+                self.assertEqual(len(path), gaps)
+                self.assertTrue(all(step == 'gap' for _ops, _ch, step in path))
+                self.assertEqual(align_chapters_banded(signatures, index, band=8), {})
+
+    def test_agrees_with_global_alignment(self):
+        book_index = make_book(60)
+        ch_ids = list(book_index.chapters)
+        cases = {
+            'one to one': {ops_id(i + 1): signature(book_index, ch_id) for i, ch_id in enumerate(ch_ids)},
+            'missing files': {
+                ops_id(i + 1): signature(book_index, ch_id) for i, ch_id in enumerate(ch_ids) if i % 7 != 3
+            },
+            # Numbers shifted by one on a run of files: the titles still place them
+            'numbering drift': {
+                ops_id(i + 1): signature(book_index, ch_id, f'9.{i}' if 20 <= i < 30 else None)
+                for i, ch_id in enumerate(ch_ids)
+            },
+        }
+        for name, signatures in cases.items():
+            for band in (64, 4):
+                with self.subTest(case=name, band=band):
+                    expected = align_chapters(signatures, book_index)
+                    actual = align_chapters_banded(signatures, book_index, sorted(signatures), band)
+                    self.assertEqual(
+                        {key: entry['chapter'] for key, entry in actual.items()},
+                        {key: entry['chapter'] for key, entry in expected.items()},
+                    )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import contextlib
+import io
+import re
+import tempfile
+import unittest
+from pathlib import Path
+
+import comprehensive_link_fixer
+import fix_broken_links
+import fix_xml_references
+from apply_correct_mappings import fix_content_with_mappings
+from synthetic_corpus import generate_corpus
+
+ISBN = '9780000000009'
+
+class StandaloneScriptsTest(unittest.TestCase):
+    """The scripts take the book from --xml-dir instead of assuming one title"""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.corpus = generate_corpus(Path(self.tmp.name), parts=3, chapters_per_part=2, isbn=ISBN)
+        self.xml_dir = Path(self.corpus['xml_dir'])
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_script(self, module):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            module.main(['--xml-dir', str(self.xml_dir)])
+        return out.getvalue()
+
+    def ops_links(self):
+        pattern = re.compile(rf'linkend="{ISBN}_v')
+        return sum(
+            len(pattern.findall(path.read_text(encoding='utf-8'))) for path in self.xml_dir.glob('sect1.*.pt*.xml')
+        )
+
+    def test_scripts_fix_another_book(self):
+        self.assertGreater(self.ops_links(), 0)
+        self.run_script(fix_xml_references)
+        book = (self.xml_dir / f'book.{ISBN}.xml.new').read_text(encoding='utf-8')
+        for part in ('pt0001', 'pt0002', 'pt0003'):
+            self.assertIn(f'<!ENTITY sect1.{ISBN}.{part}s0001 SYSTEM', book)
+
+        output = self.run_script(fix_broken_links)
+        self.assertIn(f'sect1.{ISBN}.pt0003s0001.xml', output)
+        self.run_script(comprehensive_link_fixer)
+        self.assertEqual(self.ops_links(), 0)
+
+class RecheckTest(unittest.TestCase):
+
+    def test_manual_targets_are_resolved_again(self):
+        content = (
+            '<link linkend="ch0012s0004ta01">Table 2.1–3</link>'
+            '<link linkend="ch0003s0001ta01">Table 2.1–4</link>'
+        )
+        mappings = {'Table 2.1–3': 'ch0012s0004ta13', 'Table 2.1–4': 'ch0012s0004ta14'}
+        new_content, fixes = fix_content_with_mappings(content, mappings, ISBN, recheck={'ch0012s0004ta01'})
+        self.assertEqual(fixes, 1)
+        self.assertIn('linkend="ch0012s0004ta13"', new_content)
+        # Links to other existing ids are left alone
+        self.assertIn('linkend="ch0003s0001ta01"', new_content)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from epub_nav import NavEntry, load_navigation
+from ops_source import OpsSource
+
+PACKAGE = """<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0">
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+    <item id="c01" href="book_v1_c01.xhtml" media-type="application/xhtml+xml"/>
+    <item id="c02" href="book_v1_c02.xhtml" media-type="application/xhtml+xml"/>
+  </manifest>
+  <spine>
+    <itemref idref="c01"/>
+    <itemref idref="c02"/>
+  </spine>
+</package>
+"""
+
+NAV = """<?xml version="1.0" encoding="utf-8"?>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">
+  <body>
+    <nav epub:type="toc">
+      <ol>
+        <li><a href="book_v1_c01.xhtml">Chapter 1 Cells</a></li>
+        <li><a href="book_v1_c02.xhtml#top">Chapter 2 Tissues</a></li>
+      </ol>
+    </nav>
+  </body>
+</html>
+"""
+
+class LoadNavigationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        (self.root / 'content.opf').write_text(PACKAGE, encoding='utf-8')
+        (self.root / 'nav.xhtml').write_text(NAV, encoding='utf-8')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_navigation(self):
+        self.assertEqual(load_navigation(OpsSource(self.root)), {
+            'book_v1_c01.xhtml': NavEntry('Chapter 1 Cells', 0),
+            'book_v1_c02.xhtml': NavEntry('Chapter 2 Tissues', 1),
+        })
+
+    def test_read_once_per_source(self):
+        ops = OpsSource(self.root)
+        navigation = load_navigation(ops)
+        (self.root / 'content.opf').unlink()
+        self.assertIs(load_navigation(ops), navigation)
+        # Another source over the same location reads it again
+        self.assertEqual(load_navigation(OpsSource(self.root)), {})
+
+if __name__ == '__main__':
+    unittest.main()
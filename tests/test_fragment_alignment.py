@@ -0,0 +1,89 @@
+import tempfile
+import unittest
+
+from fragment_alignment import (
+    FragmentTable, align_fragments, build_fragment_table, extract_ops_elements, extract_xml_elements,
+    load_chapter_elements,
+)
+from ops_source import open_ops_source
+from synthetic_corpus import generate_corpus
+
+OPS_CHAPTER = """<html><body><div id="top">Cover</div>
+<h1 id="h1">2.1 Blood Cultures</h1>
+<p id="p1">a</p><p id="p2">b</p><p id="p3">c</p>
+<p>See <a id="r1" href="#t1">Table 2.1–1</a></p>
+<table id="t1"><caption>Table 2.1-1 Media</caption></table>
+<h2 id="h2">Collection</h2><p id="p4">d</p><div id="d1">e</div>
+</body></html>
+"""
+
+XML_CHAPTER = """<sect1 id="ch0002s0001"><title>2.1 Blood Cultures</title>
+<para id="x1">a</para><para id="x2">b</para>
+<table id="ch0002s0001ta01"><title>Table 2.1–1 Media</title></table>
+<sect2 id="ch0002s0001s01"><title>Collection</title><para id="x3">d</para></sect2>
+</sect1>
+"""
+
+class AlignFragmentsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fragments = align_fragments(
+            extract_ops_elements(OPS_CHAPTER), extract_xml_elements(XML_CHAPTER), 'ch0002'
+        )
+
+    def test_labels_anchor_the_alignment(self):
+        self.assertEqual(self.fragments['h1'], ('ch0002s0001', 'label'))
+        self.assertEqual(self.fragments['h2'], ('ch0002s0001s01', 'label'))
+        # Hyphen and en dash spell the same label
+        self.assertEqual(self.fragments['t1'], ('ch0002s0001ta01', 'label'))
+        # A reference carrying the label resolves to the labelled element, wherever it sits
+        self.assertEqual(self.fragments['r1'], ('ch0002s0001ta01', 'label'))
+
+    def test_unlabelled_elements_pair_by_position(self):
+        self.assertEqual(self.fragments['p1'], ('x1', 'sequence'))
+        self.assertEqual(self.fragments['p2'], ('x2', 'sequence'))
+        self.assertEqual(self.fragments['p4'], ('x3', 'sequence'))
+
+    def test_leftovers_map_to_the_enclosing_section(self):
+        # No third para before the table anchor: p3 falls back to the section around p2
+        self.assertEqual(self.fragments['p3'], ('ch0002s0001', 'enclosing'))
+        self.assertEqual(self.fragments['d1'], ('ch0002s0001s01', 'enclosing'))
+        # Nothing aligned yet: the chapter itself
+        self.assertEqual(self.fragments['top'], ('ch0002', 'enclosing'))
+
+    def test_every_ops_id_is_mapped(self):
+        self.assertEqual(set(self.fragments), {'top', 'h1', 'p1', 'p2', 'p3', 'r1', 't1', 'h2', 'p4', 'd1'})
+
+class FragmentTableTest(unittest.TestCase):
+
+    def test_resolve(self):
+        table = FragmentTable()
+        table.add_document('book_c01', 'ch0001', {'p1': ('x1', 'sequence'), 'only': ('x2', 'label')},
+                           {'table 1.1–1': 'ch0001s0001ta01'})
+        table.add_document('book_c02', 'ch0002', {'p1': ('x9', 'sequence')})
+
+        self.assertEqual(table.resolve('book_c01'), 'ch0001')
+        self.assertEqual(table.resolve('book_c01', 'Table 1.1-1'), 'ch0001s0001ta01')
+        self.assertEqual(table.resolve('book_c01', 'Table 9.9–9'), 'ch0001')
+        self.assertEqual(table.resolve('book_c02#p1'), 'x9')
+        self.assertEqual(table.resolve('only'), 'x2')
+        self.assertIsNone(table.resolve('p1'))  # ambiguous without its file
+        self.assertIsNone(table.resolve('elsewhere'))
+        self.assertEqual(table.methods(), {'file': 2, 'sequence': 2, 'label': 1})
+
+    def test_synthetic_book(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            corpus = generate_corpus(tmp, parts=1, chapters_per_part=2, isbn='9780000000009')
+            mapping = {f'9780000000009_v1_c{n:02d}': f'ch{n:04d}' for n in (1, 2)}
+            table = build_fragment_table(
+                open_ops_source(corpus['ops_location']), mapping,
+                load_chapter_elements(corpus['xml_dir'], '9780000000009', workers=1),
+            )
+
+        self.assertEqual(table.resolve('t1.2-3'), 'ch0002s0001ta03')
+        self.assertEqual(table.resolve('9780000000009_v1_c01#c01-tbl-0004'), 'ch0001s0001ta04')
+        self.assertEqual(table.resolve('9780000000009_v1_c02-app1'), 'ch0002s0001s0001')
+        self.assertEqual(table.resolve('9780000000009_v1_c01', 'Table 1.1–2'), 'ch0001s0001ta02')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from id_index import INDEX_FILENAME, MEMORY_INDEX, load_id_index
+from scanner import extract_ids_from_bytes
+
+class ExtractIdsTest(unittest.TestCase):
+
+    def test_quote_styles_and_xml_id(self):
+        data = (
+            b'<sect1 id="s1"><para id = \'p1\'>x</para>'
+            b'<table xml:id="t1"/><anchor xmlns:xl="x" xl:id="not-an-id" data-id="nor-this"/>'
+            b'<link linkend="s1"/></sect1>'
+        )
+        self.assertEqual(extract_ids_from_bytes(data), [
+            ('s1', 'sect1', 0),
+            ('p1', 'para', data.index(b'<para')),
+            ('t1', 'table', data.index(b'<table')),
+        ])
+
+class IdIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        self.write('a.xml', '<sect1 id="a1"><para id="shared"/></sect1>')
+        self.write('b.xml', "<sect1 id='b1'><para xml:id=\"shared\"/></sect1>")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, text, mtime_ns=None):
+        path = self.dir / name
+        path.write_text(text, encoding='utf-8')
+        if mtime_ns:
+            os.utime(path, ns=(mtime_ns, mtime_ns))
+
+    def test_lookup_and_refresh(self):
+        with load_id_index(self.dir) as index:
+            self.assertEqual(index.ids(), {'a1', 'b1', 'shared'})
+            self.assertEqual(len(index), 3)
+            self.assertEqual(
+                index.lookup('shared'),
+                [(str(self.dir / 'a.xml'), 'para', 15), (str(self.dir / 'b.xml'), 'para', 15)],
+            )
+            self.assertEqual(index.refresh(), 0)
+
+            self.write('a.xml', '<sect1 id="a2"/>', mtime_ns=10**18)
+            (self.dir / 'b.xml').unlink()
+            self.write('c.xml', '<sect1 id="c1"/>')
+            self.assertEqual(index.refresh(), 2)
+            self.assertEqual(index.id_files(), {'a2': [str(self.dir / 'a.xml')], 'c1': [str(self.dir / 'c.xml')]})
+            self.assertNotIn('shared', index)
+
+        # The next run starts from the stored index
+        with load_id_index(self.dir) as index:
+            self.assertEqual(index.refresh(), 0)
+            self.assertIn('c1', index)
+
+    def test_older_schema_is_rebuilt(self):
+        with load_id_index(self.dir):
+            pass
+        conn = sqlite3.connect(str(self.dir / INDEX_FILENAME))
+        conn.execute('DELETE FROM ids')
+        conn.execute('PRAGMA user_version = 1')
+        conn.commit()
+        conn.close()
+        with load_id_index(self.dir) as index:
+            self.assertEqual(index.ids(), {'a1', 'b1', 'shared'})
+
+    def test_memory_index_writes_nothing(self):
+        with load_id_index(self.dir, index_path=MEMORY_INDEX) as index:
+            self.assertIn('b1', index)
+        self.assertFalse((self.dir / INDEX_FILENAME).exists())
+
+if __name__ == '__main__':
+    unittest.main()
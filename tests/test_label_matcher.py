@@ -0,0 +1,63 @@
+import unittest
+
+from label_matcher import LabelMatcher, dash_variants
+
+TABLES = {
+    'Table 2.1–1': 't1',
+    'Table 2.1–10': 't10',
+    'Table 2.1–2': 't2',
+    'Appendix 2.1–1': 'a1',
+}
+
+class LabelMatcherTest(unittest.TestCase):
+
+    def test_boundaries(self):
+        matcher = LabelMatcher(TABLES)
+        cases = [
+            ('Table 2.1–1', 't1'),
+            ('see Table 2.1–1.', 't1'),
+            ('(Table 2.1–1)', 't1'),
+            # A label never matches the start of a longer number
+            ('Table 2.1–10', 't10'),
+            ('Table 2.1–10 and Table 2.1–1', 't10'),
+            ('Table 2.1–100', None),
+            ('Table 2.1–12', None),
+            # ...nor the end of a longer word
+            ('SubTable 2.1–1', None),
+            ('xAppendix 2.1–1', None),
+            # Hyphen and en dash are interchangeable
+            ('Table 2.1-1', 't1'),
+            ('Appendix 2.1-1', 'a1'),
+            # The longest label wins, the leftmost one on ties
+            ('Table 2.1–2 or Table 2.1–1', 't2'),
+            ('Table 2.1–1 or Table 2.1–10', 't10'),
+            ('', None),
+            ('Table 2.1', None),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(matcher.get(text), expected)
+
+    def test_later_labels_win(self):
+        matcher = LabelMatcher({'Table 1.1–1': 'first'})
+        matcher.add('Table 1.1-1', 'second')
+        self.assertEqual(matcher.get('Table 1.1–1'), 'second')
+        self.assertEqual(matcher.get('Table 1.1-1'), 'second')
+        # The hyphen spelling replaced the en dash one rather than adding a label
+        self.assertEqual(len(matcher), 1)
+        matcher.add('Table 1.1–2', 'third')
+        self.assertEqual(len(matcher), 2)
+
+    def test_add_after_build(self):
+        matcher = LabelMatcher(TABLES)
+        self.assertIsNone(matcher.get('Table 3.1–1'))
+        matcher.add('Table 3.1–1', 't31')
+        self.assertEqual(matcher.get('see Table 3.1–1'), 't31')
+        self.assertEqual(len(matcher), len(TABLES) + 1)
+
+    def test_dash_variants(self):
+        self.assertEqual(dash_variants('Table 1.1–1'), {'Table 1.1–1', 'Table 1.1-1'})
+        self.assertEqual(dash_variants('Figure 1'), {'Figure 1'})
+
+if __name__ == '__main__':
+    unittest.main()
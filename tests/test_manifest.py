@@ -0,0 +1,82 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
+import unittest
+from pathlib import Path
+
+from manifest import MANIFEST_VERSION, Manifest, hash_bytes, hash_json
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        self.path = self.dir / 'manifest.json'
+        self.part = self.dir / 'part.xml'
+        self.part.write_bytes(b'<sect1 id="a"/>')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_hash_json_ignores_key_order(self):
+        self.assertEqual(hash_json({'a': 1, 'b': 'ü'}), hash_json({'b': 'ü', 'a': 1}))
+        self.assertNotEqual(hash_json({'a': 1}), hash_json({'a': 2}))
+
+    def test_file_hash_is_reused_until_the_stat_changes(self):
+        manifest = Manifest(self.path)
+        original = manifest.file_hash(self.part)
+        self.assertEqual(original, hash_bytes(b'<sect1 id="a"/>'))
+
+        # Same size and mtime: the recorded hash is trusted without reading the file
+        stat = self.part.stat()
+        self.part.write_bytes(b'<sect1 id="b"/>')
+        os.utime(self.part, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(manifest.file_hash(self.part), original)
+
+        os.utime(self.part, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertEqual(manifest.file_hash(self.part), hash_bytes(b'<sect1 id="b"/>'))
+
+        # Passing the data always hashes it
+        self.assertEqual(manifest.file_hash(self.part, b'other'), hash_bytes(b'other'))
+
+    def test_unchanged_outputs(self):
+        manifest = Manifest(self.path)
+        missing = self.dir / 'missing.xml'
+        manifest.record('inputs-1', {self.part: manifest.file_hash(self.part), missing: 'x'}, {}, {})
+
+        self.assertEqual(manifest.unchanged_outputs('inputs-1', [self.part, missing]), {str(self.part)})
+        self.assertEqual(manifest.unchanged_outputs('inputs-2', [self.part]), set())
+
+        self.part.write_bytes(b'<sect1 id="changed"/>')
+        os.utime(self.part, ns=(0, 10**18))
+        self.assertEqual(manifest.unchanged_outputs('inputs-1', [self.part]), set())
+
+    def test_saved_state_is_loaded_by_the_next_run(self):
+        manifest = Manifest(self.path)
+        manifest.record('inputs', {self.part: manifest.file_hash(self.part)},
+                        {'part.xml': {'fragments': 2}}, {'fragments': 2})
+        manifest.save()
+        self.assertFalse(self.path.with_name(self.path.name + '.tmp').exists())
+
+        manifest = Manifest(self.path)
+        manifest.record('inputs-2', {}, {'other.xml': {'tables': 1}}, {'tables': 1})
+        # Fixes accumulate per file; outputs and results describe the last run only
+        self.assertEqual(manifest.data['fixes'], {'part.xml': {'fragments': 2}, 'other.xml': {'tables': 1}})
+        self.assertEqual(manifest.data['outputs'], {})
+        self.assertEqual(manifest.data['results'], {'tables': 1})
+
+    def test_unreadable_or_outdated_manifest_starts_empty(self):
+        self.path.write_text(json.dumps({'version': MANIFEST_VERSION - 1, 'inputs': 'old'}), encoding='utf-8')
+        self.assertIsNone(Manifest(self.path).data['inputs'])
+
+        self.path.write_text('{not json', encoding='utf-8')
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            manifest = Manifest(self.path)
+        self.assertIn('Ignoring unreadable manifest', output.getvalue())
+        self.assertEqual(manifest.data['outputs'], {})
+
+if __name__ == '__main__':
+    unittest.main()
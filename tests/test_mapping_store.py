@@ -0,0 +1,91 @@
+import contextlib
+import io
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import apply_correct_mapping_final
+import mapping_store
+from mapping_store import MappingStore, open_mapping_store
+from synthetic_corpus import generate_corpus
+
+ISBN = '9780000000009'
+
+def write_manual(directory, entries):
+    with open(Path(directory) / f'{ISBN}.jsonl', 'w', encoding='utf-8') as f:
+        for kind, source, target in entries:
+            f.write(json.dumps({'kind': kind, 'source': source, 'target': target}, ensure_ascii=False) + '\n')
+
+class MappingStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.manual_dir = self.root / 'mappings'
+        self.manual_dir.mkdir()
+        patcher = mock.patch.object(mapping_store, 'MANUAL_MAPPING_DIR', self.manual_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_provenances_merge_in_order(self):
+        with MappingStore(self.root / 'store.sqlite') as store:
+            store.replace(ISBN, 'chapter', 'auto', {'c01': ('ch0001', 0.9), 'c02': ('ch0002', 0.4), 'c03': 'ch0003'})
+            store.replace(ISBN, 'chapter', 'content', {'c02': ('ch0005', 0.8)})
+            store.replace(ISBN, 'chapter', 'manual', {'c01': 'ch0007'})
+
+            self.assertEqual(store.mapping(ISBN, 'chapter'), {'c01': 'ch0007', 'c02': 'ch0005', 'c03': 'ch0003'})
+            self.assertEqual(store.mapping(ISBN, 'chapter', ('auto', 'manual')),
+                             {'c01': 'ch0007', 'c02': 'ch0002', 'c03': 'ch0003'})
+            self.assertEqual(store.mapping(ISBN, 'chapter', ('manual',)), {'c01': 'ch0007'})
+            self.assertEqual(store.mapping(ISBN, 'table'), {})
+            self.assertEqual(store.mapping('9780000000001', 'chapter'), {})
+
+    def test_version_counts_changes(self):
+        with MappingStore(self.root / 'store.sqlite') as store:
+            self.assertEqual(store.version(ISBN), 0)
+            self.assertTrue(store.replace(ISBN, 'table', 'auto', {'Table 1.1–1': 'ch0001s0001ta01'}, 'h1'))
+            self.assertFalse(store.replace(ISBN, 'table', 'auto', {'Table 1.1–1': 'ch0001s0001ta01'}, 'h1'))
+            # Same entries derived from other inputs still count as a change
+            self.assertTrue(store.replace(ISBN, 'table', 'auto', {'Table 1.1–1': 'ch0001s0001ta01'}, 'h2'))
+            self.assertEqual(store.version(ISBN), 2)
+            self.assertEqual(store.inputs(ISBN, 'table'), 'h2')
+
+        with MappingStore(self.root / 'store.sqlite') as store:
+            self.assertEqual(store.version(ISBN), 2)
+
+    def test_manual_file_is_imported_when_it_changes(self):
+        write_manual(self.manual_dir, [('chapter', 'c01', 'ch0002'), ('table', 'Table 1.1–1', 'ch0001s0001ta03')])
+        with open_mapping_store(self.root, ISBN) as store:
+            version = store.version(ISBN)
+            self.assertEqual(store.mapping(ISBN, 'table', ('manual',)), {'Table 1.1–1': 'ch0001s0001ta03'})
+        with open_mapping_store(self.root, ISBN) as store:
+            self.assertEqual(store.version(ISBN), version)
+
+        write_manual(self.manual_dir, [('chapter', 'c01', 'ch0004')])
+        with open_mapping_store(self.root, ISBN) as store:
+            self.assertEqual(store.mapping(ISBN, 'chapter'), {'c01': 'ch0004'})
+            self.assertEqual(store.mapping(ISBN, 'table'), {})
+            self.assertGreater(store.version(ISBN), version)
+
+    def test_apply_correct_mapping_final_applies_manual_entries_only(self):
+        corpus = generate_corpus(self.root / 'book', parts=1, chapters_per_part=2, isbn=ISBN)
+        write_manual(self.manual_dir, [('chapter', f'{ISBN}_v1_c02', 'ch0002')])
+        with open_mapping_store(corpus['xml_dir'], ISBN) as store:
+            store.replace(ISBN, 'chapter', 'auto', {f'{ISBN}_v1_c01': 'ch0009'})
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            apply_correct_mapping_final.main(['--xml-dir', corpus['xml_dir']])
+
+        part = (Path(corpus['xml_dir']) / f'sect1.{ISBN}.pt0001s0001.xml').read_text(encoding='utf-8')
+        self.assertIn(f'linkend="{ISBN}_v1_c01"', part)
+        self.assertNotIn('ch0009', part)
+        self.assertNotIn(f'linkend="{ISBN}_v1_c02"', part)
+        self.assertEqual(part.count('linkend="ch0002"'), 2)
+
+if __name__ == '__main__':
+    unittest.main()
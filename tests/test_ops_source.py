@@ -0,0 +1,75 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from ops_source import PREFIX_CHUNK_SIZE, OpsSource
+
+def marker_found(text):
+    return 'MARK' in text
+
+class OpsTextCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self.tmp.name)
+        self.texts = {
+            'short.xhtml': 'tiny file',
+            'long.xhtml': 'x' * (3 * PREFIX_CHUNK_SIZE) + 'MARK' + 'y' * (8 * PREFIX_CHUNK_SIZE),
+        }
+        for name, text in self.texts.items():
+            (self.root / name).write_text(text, encoding='utf-8')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def remove_files(self):
+        """Later reads can only succeed from the cache"""
+        for name in self.texts:
+            (self.root / name).unlink()
+
+    def test_prefixes_are_reused(self):
+        ops = OpsSource(self.root, cache=True)
+        long_text = self.texts['long.xhtml']
+        prefix = ops.read_prefix('long.xhtml', marker_found, 100000)
+        self.assertIn('MARK', prefix)
+        ops.read_prefixes(sorted(self.texts), marker_found, 100000)
+        self.remove_files()
+
+        cases = [
+            (lambda: ops.read_prefix('long.xhtml', marker_found, 100000), prefix),
+            (lambda: ops.read_text('long.xhtml', 100), long_text[:100]),
+            (lambda: ops.read_text('long.xhtml', len(prefix)), prefix),
+            # The end of a short file was reached, so its whole text is cached
+            (lambda: ops.read_text('short.xhtml'), 'tiny file'),
+            (lambda: ops.read_texts(['short.xhtml', 'short.xhtml']), ['tiny file', 'tiny file']),
+        ]
+        for index, (read, expected) in enumerate(cases):
+            with self.subTest(case=index):
+                self.assertEqual(read(), expected)
+
+    def test_longest_text_is_kept(self):
+        ops = OpsSource(self.root, cache=True)
+        whole = ops.read_texts(sorted(self.texts))
+        self.assertEqual(whole, [self.texts[name] for name in sorted(self.texts)])
+        # A shorter read served from the whole text does not replace it
+        ops.read_prefix('long.xhtml', marker_found, 100000)
+        ops.read_text('long.xhtml', 10)
+        self.remove_files()
+        self.assertEqual(ops.read_text('long.xhtml'), self.texts['long.xhtml'])
+
+    def test_prefix_is_extended(self):
+        ops = OpsSource(self.root, cache=True)
+        ops.read_text('long.xhtml', 100)
+        self.assertEqual(ops.read_text('long.xhtml'), self.texts['long.xhtml'])
+        self.remove_files()
+        self.assertEqual(ops.read_text('long.xhtml', 200), self.texts['long.xhtml'][:200])
+
+    def test_without_cache(self):
+        ops = OpsSource(self.root)
+        ops.read_texts(sorted(self.texts))
+        self.remove_files()
+        with self.assertRaises(FileNotFoundError):
+            ops.read_text('short.xhtml')
+
+if __name__ == '__main__':
+    unittest.main()
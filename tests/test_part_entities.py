@@ -0,0 +1,69 @@
+import contextlib
+import io
+import tempfile
+import unittest
+from pathlib import Path
+
+from fix_xml_references import add_part_entities, transform_part_entities
+
+ISBN = '9780000000001'
+
+BODY = """<book id="b1">
+<part id="pt0001"><title>One</title><partintro><para>Intro</para></partintro>
+<chapter id="ch0001"/></part>
+<part id="pt0002"><title>Two</title><partintro><para>Intro</para></partintro>
+<chapter id="ch0002"/></part>
+</book>
+"""
+
+def entity(part_id):
+    return f"sect1.{ISBN}.{part_id}s0001"
+
+class TransformPartEntitiesTest(unittest.TestCase):
+
+    def test_second_run_changes_nothing(self):
+        book = f'<?xml version="1.0"?>\n<!DOCTYPE book [\n<!ENTITY ch0001 SYSTEM "ch0001.xml">\n]>\n{BODY}'
+        once, declared, referenced = transform_part_entities(book, ISBN, ['pt0001', 'pt0002'])
+        self.assertEqual((declared, referenced), (2, 2))
+        self.assertEqual(once.count(f'<!ENTITY {entity("pt0002")} SYSTEM "{entity("pt0002")}.xml">'), 1)
+        self.assertIn(f'</partintro>\n&{entity("pt0001")};\n<chapter id="ch0001"/>', once)
+
+        twice, declared, referenced = transform_part_entities(once, ISBN, ['pt0001', 'pt0002'])
+        self.assertEqual(twice, once)
+        self.assertEqual((declared, referenced), (0, 0))
+
+    def test_internal_subset_is_created(self):
+        public = '<!DOCTYPE book PUBLIC "-//OASIS//DTD DocBook XML V4.5//EN" "docbookx.dtd">'
+        for doctype in (public, ''):
+            with self.subTest(doctype=doctype):
+                book = f'<?xml version="1.0"?>\n{doctype}\n{BODY}'
+                new_book, declared, _referenced = transform_part_entities(book, ISBN, ['pt0002'])
+                self.assertEqual(declared, 1)
+                self.assertIn('<!DOCTYPE book', new_book)
+                self.assertIn(f' [\n<!ENTITY {entity("pt0002")} SYSTEM "{entity("pt0002")}.xml">\n]>', new_book)
+                self.assertEqual(transform_part_entities(new_book, ISBN, ['pt0002'])[0], new_book)
+                if doctype:
+                    self.assertTrue(new_book.startswith(f'<?xml version="1.0"?>\n{public[:-1]} [\n'))
+
+    def test_parts_without_a_file_are_skipped(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            book_path = Path(tmp) / f'book.{ISBN}.xml'
+            book_path.write_text(f'<!DOCTYPE book [\n]>\n{BODY}', encoding='utf-8')
+            (Path(tmp) / f'{entity("pt0002")}.xml').write_text('<sect1 id="pt0002s0001"/>', encoding='utf-8')
+
+            new_book, declared, referenced = transform_part_entities(
+                book_path.read_text(encoding='utf-8'), ISBN, xml_dir=tmp
+            )
+            self.assertEqual((declared, referenced), (1, 1))
+            self.assertNotIn(entity('pt0001'), new_book)
+
+            output = Path(tmp) / 'out.xml'
+            with contextlib.redirect_stdout(io.StringIO()):
+                add_part_entities(book_path, output, ISBN)
+            self.assertEqual(output.read_text(encoding='utf-8'), new_book)
+
+        with self.assertRaises(ValueError):
+            transform_part_entities(BODY, ISBN)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import contextlib
+import io
+import re
+import tempfile
+import unittest
+from pathlib import Path
+
+from pipeline import main, run_pipeline
+from synthetic_corpus import generate_corpus
+from validate import validate_directory
+
+ISBN = '9780000000009'
+CHAPTERS_PER_PART = 3
+
+LINK_PATTERN = re.compile(r'<link linkend="([^"]+)">([^<]+)</link>')
+CHAPTER_TEXT = re.compile(r'(\d+)\.(\d+)\. ')
+TABLE_TEXT = re.compile(r'Table (\d+)\.(\d+)–(\d+)$')
+
+def expected_target(text):
+    """The XML id the synthetic corpus link text names"""
+    table = TABLE_TEXT.match(text)
+    part, chapter = map(int, (table or CHAPTER_TEXT.match(text)).group(1, 2))
+    ch_id = f"ch{(part - 1) * CHAPTERS_PER_PART + chapter:04d}"
+    return f"{ch_id}s0001ta{int(table.group(3)):02d}" if table else ch_id
+
+class PipelineRunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.corpus = generate_corpus(
+            self.tmp.name, parts=2, chapters_per_part=CHAPTERS_PER_PART, isbn=ISBN, fragment_links=0.5
+        )
+        self.xml_dir = Path(self.corpus['xml_dir'])
+        self.parts = [self.xml_dir / f'sect1.{ISBN}.pt{p:04d}s0001.xml' for p in (1, 2)]
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_quietly(self, **kwargs):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            results, written = run_pipeline(self.xml_dir, workers=1, **kwargs)
+        return results, written, output.getvalue()
+
+    def test_every_link_reaches_its_xml_target(self):
+        results, written, _output = self.run_quietly()
+
+        self.assertEqual(results['broken'] + results['fragments'], self.corpus['broken_links'])
+        self.assertEqual(sorted(written), sorted(str(path) for path in [self.xml_dir / f'book.{ISBN}.xml'] + self.parts))
+        for path in self.parts:
+            links = LINK_PATTERN.findall(path.read_text(encoding='utf-8'))
+            self.assertTrue(links)
+            self.assertEqual([linkend for linkend, _text in links], [expected_target(text) for _linkend, text in links])
+
+        book = (self.xml_dir / f'book.{ISBN}.xml').read_text(encoding='utf-8')
+        self.assertIn(f'<!ENTITY sect1.{ISBN}.pt0002s0001 SYSTEM "sect1.{ISBN}.pt0002s0001.xml">', book)
+        self.assertEqual([result for result in validate_directory(self.xml_dir, workers=1) if result['broken']], [])
+
+    def test_rerun_processes_only_changed_parts(self):
+        self.run_quietly()
+        self.assertEqual(self.run_quietly()[:2], ({}, []))
+
+        # Break one link again: only that part file is reprocessed
+        fixed = self.parts[1].read_text(encoding='utf-8')
+        self.parts[1].write_text(fixed.replace('linkend="ch0004"', f'linkend="{ISBN}_v1_c04"'), encoding='utf-8')
+        results, written, output = self.run_quietly()
+        self.assertIn('Skipping 1 unchanged part files', output)
+        self.assertEqual(results['broken'], 1)
+        self.assertIn(str(self.parts[1]), written)
+        self.assertNotIn(str(self.parts[0]), written)
+        self.assertEqual(self.parts[1].read_text(encoding='utf-8'), fixed)
+
+    def test_selected_stages_and_book_output(self):
+        book_output = Path(self.tmp.name) / 'book.out.xml'
+        original_book = (self.xml_dir / f'book.{ISBN}.xml').read_bytes()
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            main(['--xml-dir', str(self.xml_dir), '--stages', 'entities', '--book-output', str(book_output),
+                  '--workers', '1'])
+
+        self.assertIn('entities: 4', output.getvalue())
+        self.assertNotIn('STAGE: broken', output.getvalue())
+        self.assertEqual((self.xml_dir / f'book.{ISBN}.xml').read_bytes(), original_book)
+        self.assertIn(f'&sect1.{ISBN}.pt0001s0001;', book_output.read_text(encoding='utf-8'))
+        # Part files are untouched when no link stage runs
+        self.assertIn(f'linkend="{ISBN}_v1_c01"', self.parts[0].read_text(encoding='utf-8'))
+
+if __name__ == '__main__':
+    unittest.main()
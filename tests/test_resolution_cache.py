@@ -0,0 +1,74 @@
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+from resolution_cache import CACHE_FILENAME, MISSING, ResolutionCache, open_resolution_cache
+
+class ResolutionCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_least_recently_used_entry_is_evicted(self):
+        cache = ResolutionCache(max_entries=2)
+        cache.put('broken', 'c01', 'Table 1.1–1', 'ch0001s0001ta01')
+        cache.put('broken', 'c02', '1.2. Urine', 'ch0002')
+        # Reading c01 makes c02 the oldest entry
+        self.assertEqual(cache.get('broken', 'c01', '  Table 1.1–1\n'), 'ch0001s0001ta01')
+        cache.put('broken', 'c03', 'Unknown', None)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIs(cache.get('broken', 'c02', '1.2. Urine'), MISSING)
+        self.assertIsNone(cache.get('broken', 'c03', 'Unknown'))
+        self.assertEqual(cache.stats, {'hits': 2, 'disk_hits': 0, 'misses': 1, 'evictions': 1})
+        self.assertEqual(cache.summary(), "2 hits (0 from disk), 1 misses, 1 evictions, hit rate 66.7%")
+
+    def test_keys_include_stage_and_context(self):
+        cache = ResolutionCache()
+        cache.put('broken', 'c01', 'x', 'ch0001', context='pt0001')
+        self.assertIs(cache.get('broken', 'c01', 'x', context='pt0002'), MISSING)
+        self.assertIs(cache.get('tables', 'c01', 'x', context='pt0001'), MISSING)
+        self.assertEqual(cache.save(), 0)  # nothing to persist without a file
+
+    def test_resolutions_persist_while_inputs_are_unchanged(self):
+        with open_resolution_cache(self.dir, 'inputs-1') as cache:
+            cache.put('broken', 'c01', 'Table 1.1–1', 'ch0001s0001ta01')
+            cache.put('broken', 'c02', 'Unknown', None)
+
+        with open_resolution_cache(self.dir, 'inputs-1', max_entries=1) as cache:
+            self.assertEqual(cache.get('broken', 'c01', 'Table 1.1–1'), 'ch0001s0001ta01')
+            self.assertIsNone(cache.get('broken', 'c02', 'Unknown'))
+            self.assertEqual(cache.stats['disk_hits'], 2)
+            # Evicted from memory, still served from disk
+            self.assertEqual(cache.get('broken', 'c01', 'Table 1.1–1'), 'ch0001s0001ta01')
+            self.assertEqual(cache.stats['disk_hits'], 3)
+            self.assertEqual(cache.save(), 0)
+
+        with open_resolution_cache(self.dir, 'inputs-2') as cache:
+            self.assertIs(cache.get('broken', 'c01', 'Table 1.1–1'), MISSING)
+
+        conn = sqlite3.connect(str(self.dir / CACHE_FILENAME))
+        self.assertEqual(conn.execute('SELECT COUNT(*) FROM resolutions').fetchone(), (0,))
+        conn.close()
+
+    def test_older_schema_is_dropped(self):
+        conn = sqlite3.connect(str(self.dir / CACHE_FILENAME))
+        conn.executescript("""
+            CREATE TABLE resolutions (linkend TEXT, target TEXT);
+            INSERT INTO resolutions VALUES ('c01', 'stale');
+            PRAGMA user_version = 0;
+        """)
+        conn.close()
+        with open_resolution_cache(self.dir, 'inputs') as cache:
+            self.assertIs(cache.get('broken', 'c01', ''), MISSING)
+            cache.put('broken', 'c01', '', 'ch0001')
+        with open_resolution_cache(self.dir, 'inputs') as cache:
+            self.assertEqual(cache.get('broken', 'c01', ''), 'ch0001')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+from rewrite import splice
+
+class SpliceTest(unittest.TestCase):
+
+    def test_edits(self):
+        content = 'abcdefgh'
+        cases = [
+            ([], 'abcdefgh'),
+            ([((0, 1), 'X')], 'Xbcdefgh'),
+            ([((7, 8), 'X')], 'abcdefgX'),
+            ([((2, 4), '')], 'abefgh'),
+            ([((3, 3), '+')], 'abc+defgh'),
+            # Edits are applied by position, whatever order they were collected in
+            ([((6, 7), 'G'), ((0, 2), 'AB'), ((3, 4), 'D')], 'ABcDefGh'),
+            # Adjacent spans do not overlap
+            ([((2, 4), '1'), ((4, 6), '2')], 'ab12gh'),
+            # Replacements may be longer or shorter than their span
+            ([((1, 2), 'BBB'), ((5, 8), '')], 'aBBBcde'),
+        ]
+        for edits, expected in cases:
+            with self.subTest(edits=edits):
+                self.assertEqual(splice(content, edits), expected)
+
+    def test_overlapping_edits(self):
+        cases = [
+            [((1, 4), 'x'), ((3, 5), 'y')],
+            [((3, 5), 'y'), ((1, 4), 'x')],
+            [((2, 4), 'x'), ((2, 4), 'y')],
+            [((0, 8), 'x'), ((3, 3), 'y')],
+        ]
+        for edits in cases:
+            with self.subTest(edits=edits):
+                with self.assertRaises(ValueError):
+                    splice('abcdefgh', edits)
+
+if __name__ == '__main__':
+    unittest.main()
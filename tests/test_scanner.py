@@ -0,0 +1,101 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from scanner import (
+    ALL_FIELDS, ORDINAL_FIELDS, build_chapter_ordinals, scan_content, scan_directory, scan_files,
+)
+
+ISBN = '9780000000001'
+
+CHAPTER_1 = f"""<sect1 id="ch0001s0001"><title>1.1 Blood Cultures</title>
+<sect2 id="ch0001s0001s01"><title>1.1.1 Collection <emphasis>and</emphasis> Transport</title>
+<table id="ch0001s0001ta01"><title>Table 1.1–1 Media</title></table>
+<table id="ch0001s0001ta02"><title>Table 1.1-2 Stains</title></table>
+</sect2>
+<sect2 id="ch0001s0001s02"><title>Incubation</title></sect2>
+</sect1>
+"""
+CHAPTER_2 = """<sect1 id="ch0002s0001"><title>Urine</title>
+<sect2 id="ch0002s0001appendix1"><title>Appendix 1.2–1</title></sect2>
+<table id="ch0002s0001ta01"><title>Untitled</title></table>
+</sect1>
+"""
+
+class ScanContentTest(unittest.TestCase):
+
+    def test_all_fields(self):
+        result = scan_content('a.xml', CHAPTER_1.encode('utf-8'))
+        self.assertEqual(set(result), {'name'} | set(ALL_FIELDS))
+        self.assertEqual(result['tables'], [
+            ('Table 1.1–1', 'ch0001s0001ta01'), ('Table 1.1–2', 'ch0001s0001ta02'),
+        ])
+        self.assertEqual(result['sections'], [
+            ('1.1', 'ch0001s0001', 'Blood Cultures'),
+            ('1.1.1', 'ch0001s0001s01', 'Collection and Transport'),
+        ])
+        self.assertEqual(result['sect2_ids'], ['ch0001s0001s01', 'ch0001s0001s02'])
+        self.assertEqual(len(result['ids']), 5)
+
+    def test_only_requested_fields_run(self):
+        result = scan_content('a.xml', CHAPTER_1.encode('utf-8'), fields=('tables',))
+        self.assertEqual(sorted(result), ['name', 'tables'])
+
+        # Ids come from the raw bytes: nothing is decoded unless a text field asks for it
+        undecodable = b'<sect1 id="s1">\xff</sect1>'
+        self.assertEqual(scan_content('b.xml', undecodable, fields=('ids',))['ids'], [('s1', 'sect1', 0)])
+        with self.assertRaises(UnicodeDecodeError):
+            scan_content('b.xml', undecodable, fields=('ids', 'sections'))
+
+        extracted = scan_content('a.xml', CHAPTER_1.encode('utf-8'), extract=lambda name, text: len(text), fields=())
+        self.assertEqual(extracted, {'name': 'a.xml', 'extracted': len(CHAPTER_1)})
+
+class ScanDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        for name, text in (
+            (f'sect1.{ISBN}.ch0001s0001.xml', CHAPTER_1),
+            (f'sect1.{ISBN}.ch0002s0001.xml', CHAPTER_2),
+            # Same label in a later file: the later file wins
+            (f'sect1.{ISBN}.ch0003s0001.xml', '<sect1 id="x"><table id="ch0003ta09"><title>Table 1.1–1</title></table></sect1>'),
+        ):
+            (self.dir / name).write_text(text, encoding='utf-8')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_worker_count_does_not_change_the_result(self):
+        single = scan_directory(self.dir, workers=1)
+        pooled = scan_directory(self.dir, workers=2, chunk_size=1)
+        self.assertEqual(single, pooled)
+        self.assertEqual(single['tables']['Table 1.1–1'], 'ch0003ta09')
+        self.assertEqual(single['appendix_ids'], {f'sect1.{ISBN}.ch0002s0001.xml': ['ch0002s0001appendix1']})
+
+    def test_cached_results_gain_missing_fields(self):
+        cache = {}
+        paths = sorted(self.dir.glob('*.xml'))
+        scan_files(paths, workers=1, cache=cache, fields=('ids',))
+        self.assertEqual({tuple(sorted(result)) for result in cache.values()}, {('ids', 'name')})
+
+        # Files already scanned for these fields are served from the cache, even once deleted
+        scan_files(paths, workers=1, cache=cache, fields=ORDINAL_FIELDS)
+        for path in paths:
+            path.unlink()
+        results = scan_files(paths, workers=1, cache=cache, fields=('ids',) + ORDINAL_FIELDS)
+        self.assertTrue(all(set(result) == {'name', 'ids'} | set(ORDINAL_FIELDS) for result in results))
+
+    def test_chapter_ordinals(self):
+        scan = scan_directory(self.dir, fields=ORDINAL_FIELDS)
+        ordinals = build_chapter_ordinals(scan['files'], ISBN)
+        self.assertEqual(ordinals['ch0001'], {
+            'tables': ['ch0001s0001ta01', 'ch0001s0001ta02'],
+            # No appendix ids in the chapter, so its sect2s stand in for them
+            'appendices': ['ch0001s0001s01', 'ch0001s0001s02'],
+        })
+        self.assertEqual(ordinals['ch0002']['appendices'], ['ch0002s0001appendix1'])
+        self.assertEqual(build_chapter_ordinals(scan['files'], '9780000000002'), {})
+
+if __name__ == '__main__':
+    unittest.main()
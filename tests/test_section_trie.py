@@ -0,0 +1,158 @@
+import contextlib
+import io
+import unittest
+
+from book_index import BookIndex
+from fix_broken_links import fix_broken_links_in_content
+from section_trie import Match, SectionTrie, build_section_trie, number_pieces
+
+ISBN = '9780000000001'
+
+def make_collision_book():
+    """
+    Part 3 of a book where 3.7.2 is both a Campylobacter subsection of chapter 3.7 and
+    the number the OPS edition gives the quantitative culture chapter (3.8 in the XML)
+    """
+    chapters = [
+        ('ch0024', '3.7', 'Fecal and Other Gastrointestinal Cultures'),
+        ('ch0025', '3.8', 'Quantitative Culture of Small-Bowel Contents'),
+        ('ch0028', '3.9', 'Genital Cultures'),
+    ]
+    body = ''.join(
+        f'<chapter id="{ch_id}"><title><emphasis role="chapterNumber">{number}</emphasis>'
+        f'<emphasis role="chapterTitle">{title}</emphasis></title></chapter>'
+        for ch_id, number, title in chapters
+    )
+    book_index = BookIndex(None, f'<book><part id="pt0003">{body}</part></book>'.encode('utf-8'))
+    scan_results = [{
+        'name': f'sect1.{ISBN}.ch0024s0001.xml',
+        'sections': [
+            ('3.7.2', 'ch0024s0001s02', 'Campylobacter'),
+            ('3.7.3', 'ch0024s0001s03', 'Helicobacter pylori'),
+        ],
+    }]
+    return book_index, build_section_trie(book_index, scan_results, ISBN)
+
+def make_trie():
+    trie = SectionTrie()
+    trie.add('3', 'pt0003', 'pt0003')
+    trie.add('3.7', 'ch0024', 'ch0024')
+    trie.add('3.7.2', 'ch0024s0002', 'ch0024')
+    trie.add('3.7.2.4', 'ch0024s0002s04', 'ch0024')
+    trie.add('4.1', 'ch0030', 'ch0030')
+    return trie
+
+class SectionTrieTest(unittest.TestCase):
+
+    def test_number_pieces(self):
+        cases = [
+            ('3.7.2', ['3', '7', '2']),
+            ('3.07.2.', ['3', '7', '2']),
+            (' 12 ', ['12']),
+            ('3.a', []),
+            ('', []),
+            ('3..2', []),
+        ]
+        for number, expected in cases:
+            with self.subTest(number=number):
+                self.assertEqual(number_pieces(number), expected)
+
+    def test_lookup(self):
+        trie = make_trie()
+        cases = [
+            ('3.7.2', Match('ch0024s0002', 'ch0024', '3.7.2')),
+            ('3.07.2.', Match('ch0024s0002', 'ch0024', '3.7.2')),
+            # Longest prefix: deeper pieces that are not in the trie fall back to the deepest entry
+            ('3.7.2.9', Match('ch0024s0002', 'ch0024', '3.7.2')),
+            ('3.7.5', Match('ch0024', 'ch0024', '3.7')),
+            ('3.9', Match('pt0003', 'pt0003', '3')),
+            ('3.7.2.4.1', Match('ch0024s0002s04', 'ch0024', '3.7.2.4')),
+            # Misses: no entry on the path at all
+            ('4', None),
+            ('4.2', None),
+            ('5.1', None),
+            ('7', None),
+            ('x.1', None),
+            ('', None),
+        ]
+        for number, expected in cases:
+            with self.subTest(number=number):
+                self.assertEqual(trie.lookup(number), expected)
+                self.assertEqual(trie.resolve(number), expected.id if expected else None)
+                self.assertEqual(trie.chapter_of(number), expected.chapter if expected else None)
+
+    def test_max_depth(self):
+        trie = make_trie()
+        self.assertEqual(trie.lookup('3.7.2', max_depth=2), Match('ch0024', 'ch0024', '3.7'))
+        self.assertEqual(trie.lookup('3.7.2', max_depth=1), Match('pt0003', 'pt0003', '3'))
+        self.assertIsNone(trie.lookup('4.1', max_depth=1))
+
+    def test_parent_chapter(self):
+        trie = make_trie()
+        cases = [
+            ('3.7.2', 'ch0024'),
+            ('3.7', 'pt0003'),
+            ('4.1.3', 'ch0030'),
+            ('4.1', None),
+            ('3', None),
+            ('5.1.1', None),
+        ]
+        for number, expected in cases:
+            with self.subTest(number=number):
+                self.assertEqual(trie.parent_chapter(number), expected)
+
+    def test_first_entry_per_chapter_wins(self):
+        trie = make_trie()
+        size = len(trie)
+        self.assertFalse(trie.add('3.7', 'ch0024s0001', 'ch0024'))
+        self.assertFalse(trie.add('not a number', 'x', 'x'))
+        self.assertTrue(trie.add('3.8', 'ch0025', 'ch0025'))
+        self.assertEqual(trie.resolve('3.7'), 'ch0024')
+        self.assertEqual(len(trie), size + 1)
+
+    def test_number_shared_by_two_chapters(self):
+        trie = SectionTrie()
+        trie.add('3.7', 'ch0024', 'ch0024', 'Fecal Cultures')
+        trie.add('3.7.2', 'ch0024s0002', 'ch0024', '3.7.2. Campylobacter')
+        self.assertTrue(trie.add('3.7.2', 'ch0026s0001', 'ch0026', 'Quantitative Culture'))
+        self.assertEqual(trie.lookup('3.7.2', '3.7.2 Campylobacter'), Match('ch0024s0002', 'ch0024', '3.7.2'))
+        self.assertEqual(trie.lookup('3.7.2', 'Quantitative culture'), Match('ch0026s0001', 'ch0026', '3.7.2'))
+        # Neither the number nor the title settles it
+        self.assertIsNone(trie.lookup('3.7.2'))
+        self.assertIsNone(trie.lookup('3.7.2.1'))
+
+class SubsectionCollisionTest(unittest.TestCase):
+    """Subsection numbers resolve from the book alone, without a hand-kept mapping"""
+
+    def test_trie(self):
+        _book_index, trie = make_collision_book()
+        self.assertEqual(trie.chapter_of('3.7.2', 'Campylobacter'), 'ch0024')
+        self.assertEqual(trie.lookup('3.7.2', '3.7.2. Quantitative Culture of Small-Bowel'),
+                         Match('ch0025', 'ch0025', None))
+        self.assertEqual(trie.chapter_of('3.7.5', 'Yersinia'), 'ch0024')
+        self.assertIsNone(trie.chapter_of('3.7.3', 'Antifungal Susceptibility Testing'))
+
+    def test_fix_broken_links(self):
+        book_index, trie = make_collision_book()
+        links = [
+            ('3.7.2. Campylobacter', 'ch0024'),
+            ('3.7.2. Quantitative Culture of Small-Bowel', 'ch0025'),
+            ('3.7.3 Helicobacter pylori', 'ch0024'),
+            ('3.7.5 Yersinia', 'ch0024'),
+            ('3.7 Fecal and Other Gastrointestinal Cultures', 'ch0024'),
+            # The title names nothing in the book: left for a later stage rather than guessed
+            ('3.7.2 Antifungal Susceptibility Testing', None),
+        ]
+        content = ''.join(f'<link linkend="ops_c{index}">{text}</link>' for index, (text, _target) in enumerate(links))
+        with contextlib.redirect_stdout(io.StringIO()):
+            _content, fixes = fix_broken_links_in_content(
+                content, 'sect1.pt0003s0001.xml', 'pt0003', book_index, None, set(book_index.ids), ISBN,
+                ordinals={}, section_trie=trie,
+            )
+        resolved = {fix['old']: fix['new'] for fix in fixes}
+        for index, (text, target) in enumerate(links):
+            with self.subTest(text=text):
+                self.assertEqual(resolved.get(f'ops_c{index}'), target)
+
+if __name__ == '__main__':
+    unittest.main()
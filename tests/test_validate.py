@@ -0,0 +1,73 @@
+import contextlib
+import io
+import json
+import tempfile
+import unittest
+from pathlib import Path
+
+import validate
+from validate import find_broken_references, validate_directory
+
+class FindBrokenReferencesTest(unittest.TestCase):
+
+    def test_positions_of_broken_references(self):
+        data = (
+            '<sect1 id="s1">\n'
+            '<para>Größe <link linkend="missing">x</link> <xref linkend=\'s1\'/></para>\n'
+            '<para><link linkend="t1" endterm="gone"/></para>\n'
+            '</sect1>\n'
+        ).encode('utf-8')
+        result = find_broken_references('a.xml', data, {'s1', 't1'})
+
+        self.assertEqual(result['references'], 4)
+        self.assertEqual(result['broken'], [
+            # Columns count characters, so the multi-byte "ö" and "ß" count once each
+            {'file': 'a.xml', 'line': 2, 'column': 19, 'element': 'link', 'attribute': 'linkend', 'target': 'missing'},
+            {'file': 'a.xml', 'line': 3, 'column': 26, 'element': 'link', 'attribute': 'endterm', 'target': 'gone'},
+        ])
+
+class ValidateDirectoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = Path(self.tmp.name)
+        # Targets declared with single quotes and xml:id are as valid as double-quoted ids
+        (self.dir / 'a.xml').write_text(
+            "<sect1 id='a1'><table xml:id=\"t1\"/><link linkend=\"b1\"/><link linkend=\"nowhere\"/></sect1>",
+            encoding='utf-8',
+        )
+        (self.dir / 'b.xml').write_text('<sect1 id="b1"><xref linkend="a1"/><xref linkend="t1"/></sect1>',
+                                        encoding='utf-8')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_only_unknown_targets_are_reported(self):
+        results = list(validate_directory(self.dir, workers=1))
+        self.assertEqual([result['file'] for result in results], ['a.xml', 'b.xml'])
+        self.assertEqual([result['references'] for result in results], [2, 2])
+        self.assertEqual([entry['target'] for result in results for entry in result['broken']], ['nowhere'])
+
+        # A subset is still checked against the ids of every file
+        (subset,) = validate_directory(self.dir, pattern='b.xml', workers=1)
+        self.assertEqual(subset['broken'], [])
+
+    def test_pool_matches_single_process(self):
+        self.assertEqual(list(validate_directory(self.dir, workers=2, chunk_size=1)),
+                         list(validate_directory(self.dir, workers=1)))
+
+    def test_main_writes_report_and_exit_status(self):
+        report = self.dir / 'report.jsonl'
+        with contextlib.redirect_stdout(io.StringIO()) as summary:
+            status = validate.main(['--xml-dir', str(self.dir), '--workers', '1', '--output', str(report)])
+        self.assertEqual(status, 1)
+        self.assertIn('Broken references: 1 in 1 files', summary.getvalue())
+        entries = [json.loads(line) for line in report.read_text(encoding='utf-8').splitlines()]
+        self.assertEqual([(entry['file'], entry['target']) for entry in entries], [('a.xml', 'nowhere')])
+
+        (self.dir / 'a.xml').write_text("<sect1 id='a1'><table xml:id=\"t1\"/></sect1>", encoding='utf-8')
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(validate.main(['--xml-dir', str(self.dir), '--workers', '1', '--output', str(report)]), 0)
+
+if __name__ == '__main__':
+    unittest.main()
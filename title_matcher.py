@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Token inverted index for fuzzy chapter title matching (OPS <-> XML alignment).
+Titles are tokenised once; a query only touches the posting lists of its own tokens,
+and with a minimum score only those of its rarest tokens (prefix filtering), so
+ranking stays fast at thousands of chapters. Scores are Jaccard similarities of the
+token sets, the same measure correct_mapping.py used for a single candidate.
+"""
+
+import math
+import re
+import weakref
+
+_MATCHER_CACHE = weakref.WeakKeyDictionary()
+
+MIN_TITLE_SCORE = 0.5  # title Jaccard similarity a candidate must exceed
+
+def title_tokens(title):
+    """Lower-cased word set of a title with punctuation removed"""
+    return frozenset(re.sub(r'[^\w\s]', '', title.lower()).split())
+
+def jaccard(tokens_a, tokens_b):
+    if not tokens_a or not tokens_b:
+        return 0.0
+    common = len(tokens_a & tokens_b)
+    return common / (len(tokens_a) + len(tokens_b) - common)
+
+class TitleMatcher:
+    """Inverted index key -> title tokens; rank() returns the most similar keys"""
+
+    def __init__(self, titles=None):
+        self._postings = {}  # token -> keys whose title contains it
+        self._tokens = {}    # key -> title token set
+        self._order = {}     # key -> insertion position, for stable tie-breaking
+        if titles:
+            for key, title in titles.items():
+                self.add(key, title)
+
+    def add(self, key, title):
+        tokens = title_tokens(title)
+        if key in self._tokens:
+            for token in self._tokens[key]:
+                self._postings[token].remove(key)
+        else:
+            self._order[key] = len(self._order)
+        self._tokens[key] = tokens
+        for token in tokens:
+            self._postings.setdefault(token, []).append(key)
+
+    def similarity(self, key, title):
+        """Jaccard similarity between an indexed key's title and another title"""
+        return jaccard(self._tokens.get(key, frozenset()), title_tokens(title))
+
+    def rank(self, title, limit=5, min_score=0.0):
+        """Return up to limit (key, score) pairs, best first, with score >= min_score"""
+        query = title_tokens(title)
+        if not query:
+            return []
+
+        # Rarest tokens first; any title with Jaccard >= min_score shares at least one
+        # of the first len(query) - ceil(min_score * len(query)) + 1 of them
+        probe = sorted(query, key=lambda token: len(self._postings.get(token, ())))
+        if min_score > 0:
+            probe = probe[:len(probe) - math.ceil(min_score * len(probe)) + 1]
+
+        candidates = set()
+        for token in probe:
+            candidates.update(self._postings.get(token, ()))
+
+        scored = []
+        for key in candidates:
+            score = jaccard(self._tokens[key], query)
+            if score >= min_score and score > 0:
+                scored.append((key, score))
+        scored.sort(key=lambda item: (-item[1], self._order[item[0]]))
+        return scored[:limit]
+
+    def __len__(self):
+        return len(self._tokens)
+
+def chapter_title_matcher(book_index):
+    """Return the (cached) TitleMatcher over a BookIndex's chapter titles"""
+    matcher = _MATCHER_CACHE.get(book_index)
+    if matcher is None:
+        matcher = TitleMatcher({
+            ch_id: chapter['title']
+            for ch_id, chapter in book_index.chapters.items()
+            if chapter['number'] and chapter['title']
+        })
+        _MATCHER_CACHE[book_index] = matcher
+    return matcher
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Corpus-wide reference validator for an extracted XML directory.
+Checks every linkend and endterm on <link> and <xref> elements in every XML file
+against the global ID set (from the persistent ID index), in a process pool, and
+streams each broken reference as one JSON line with file, line and column.
+Exits with status 1 when anything is broken, so it can gate a conversion.
+
+Usage:
+    python validate.py [--xml-dir DIR] [--workers N] [--output report.jsonl]
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import metrics
+from id_index import load_id_index
+from scanner import DEFAULT_CHUNK_SIZE
+
+# Start tag of a referencing element; group 2 holds its attributes
+REFERENCE_TAG_PATTERN = re.compile(rb'<(link|xref)\b([^>]*)>')
+REFERENCE_ATTRIBUTE_PATTERN = re.compile(rb'\s(linkend|endterm)\s*=\s*(["\'])(.*?)\2')
+
+_known_ids = None  # set in each worker process by _init_worker
+
+def _init_worker(known_ids):
+    global _known_ids
+    _known_ids = known_ids
+
+def find_broken_references(name, data, known_ids):
+    """
+    Return {'file', 'references', 'broken'} for the raw bytes of one XML file.
+    Each broken entry has file, line, column (1-based, in characters), element, attribute and target.
+    """
+    references = 0
+    broken = []
+    line = 1
+    line_start = 0
+    last = 0
+
+    for tag in REFERENCE_TAG_PATTERN.finditer(data):
+        for attribute in REFERENCE_ATTRIBUTE_PATTERN.finditer(tag.group(2)):
+            references += 1
+            target = attribute.group(3).decode('utf-8')
+            if target in known_ids:
+                continue
+
+            position = tag.start(2) + attribute.start(1)
+            newlines = data.count(b'\n', last, position)
+            if newlines:
+                line += newlines
+                line_start = data.rfind(b'\n', last, position) + 1
+            last = position
+            broken.append({
+                'file': name,
+                'line': line,
+                'column': len(data[line_start:position].decode('utf-8', 'replace')) + 1,
+                'element': tag.group(1).decode('utf-8'),
+                'attribute': attribute.group(1).decode('utf-8'),
+                'target': target,
+            })
+
+    return {'file': name, 'references': references, 'broken': broken}
+
+def validate_file(path):
+    """Worker entry point: check one file against the ID set given to the pool"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    return find_broken_references(Path(path).name, data, _known_ids)
+
+def validate_directory(directory, pattern='*.xml', workers=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the per-file results for every file matching pattern, in sorted file order.
+    Targets are checked against the ids of every XML file in the directory (the shared ID
+    index always covers *.xml); pattern only selects the files whose references are checked.
+    """
+    with load_id_index(directory, workers=workers) as id_index:
+        known_ids = id_index.ids()
+
+    paths = [str(path) for path in sorted(Path(directory).glob(pattern))]
+    metrics.count('validate.files', len(paths))
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, max(1, len(paths) // chunk_size + 1))
+
+    if workers <= 1:
+        _init_worker(known_ids)
+        yield from map(validate_file, paths)
+        return
+
+    # The ID set is shipped once per worker, not once per file
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(known_ids,)) as executor:
+        yield from executor.map(validate_file, paths, chunksize=chunk_size)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check every linkend/endterm in an extracted XML directory")
+    parser.add_argument('--xml-dir', default='/workspace/extracted_final')
+    parser.add_argument('--pattern', default='*.xml', help="files to check (default: *.xml)")
+    parser.add_argument('--workers', type=int, help="process pool size (default: CPU count)")
+    parser.add_argument('--output', default='-', help="JSON Lines report of broken references (default: stdout)")
+    args = parser.parse_args(argv)
+
+    # With the report on stdout, the human-readable summary goes to stderr
+    report = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    summary = sys.stderr if report is sys.stdout else sys.stdout
+
+    files = references = 0
+    broken_files = {}
+    try:
+        for result in validate_directory(args.xml_dir, args.pattern, args.workers):
+            files += 1
+            references += result['references']
+            for entry in result['broken']:
+                report.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            if result['broken']:
+                broken_files[result['file']] = len(result['broken'])
+                report.flush()
+    finally:
+        if report is not sys.stdout:
+            report.close()
+
+    total_broken = sum(broken_files.values())
+    print("=" * 80, file=summary)
+    print("REFERENCE VALIDATION", file=summary)
+    print("=" * 80, file=summary)
+    print(f"  Files checked: {files}", file=summary)
+    print(f"  References checked: {references}", file=summary)
+    print(f"  Broken references: {total_broken} in {len(broken_files)} files", file=summary)
+    for name, count in sorted(broken_files.items(), key=lambda item: (-item[1], item[0]))[:20]:
+        print(f"    {name}: {count}", file=summary)
+    return 1 if total_broken else 0
+
+if __name__ == '__main__':
+    sys.exit(main())